@@ -1,26 +1,162 @@
-from anthropic import Anthropic
+import httpx
+from typing import List, Dict, Any
+from anthropic import Anthropic, AsyncAnthropic, DefaultHttpxClient, DefaultAsyncHttpxClient
+
+from Metrics import record_usage, trace_request, trace_request_async
+from PromptBuilder import split_system
+from ContextManager import count_tokens
+
+# Shortest prompt in tokens each model will cache, shorter prefixes are sent without breakpoints
+cache_min_tokens = {
+	'claude-3-haiku-20240307': 2048
+}
 
 class anthropicHandler:
-	def __init__(self, api_key:str):
+	def __init__(self, api_key:str, base_url: str = None, prompt_caching: bool = True):
 		"""
-		Initialize the Anthropic handler with the necessary API key
+		Initialize the Anthropic handler with the necessary API key and optional base URL.
+		Requests share one keep-alive connection pool for the life of the handler.
 
 		:param api_key: Your Anthropic API key
+		:param base_url: The base URL of an Anthropic-compatible API, e.g. a local mock server. Defaults to the Anthropic API.
+		:param prompt_caching: Whether to mark the conversation prefix for the provider's prompt cache.
 		"""
 		self.api_key = api_key
-		self.client = Anthropic(api_key=self.api_key)
+		self.base_url = base_url
+		self.prompt_caching = prompt_caching
+		self.max_tokens = 800
+		self.temperature = None
+		self.http_client = DefaultHttpxClient(limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=300),
+			event_hooks={'request': [trace_request], 'response': [self.report_headers]})
+		self.client = Anthropic(base_url=self.base_url, api_key=self.api_key, http_client=self.http_client, max_retries=0)
+		self.async_client = None
+		self.on_headers = None # Called with the headers of every API response, set by the provider registry
+
+	def prewarm(self):
+		"""
+		Open a pooled connection to the API ahead of the first request, so it does not pay for DNS and TLS setup.
+		"""
+		try:
+			self.http_client.head(str(self.client.base_url), timeout=5)
+		except httpx.HTTPError:
+			pass
+
+	def report_headers(self, response):
+		"""
+		Pass the headers of an API response to on_headers, e.g. so a rate limiter can follow the provider's limits.
+
+		:param response: The httpx response.
+		"""
+		if self.on_headers:
+			self.on_headers(response.headers)
+
+	async def report_headers_async(self, response):
+		"""
+		Pass the headers of an API response made by the asyncio client to on_headers.
+
+		:param response: The httpx response.
+		"""
+		self.report_headers(response)
+
+	def request_args(self, messages: List[Dict[str, str]], model: str) -> Dict[str, Any]:
+		"""
+		Build the arguments of a messages request. The system prompt is its own parameter, and the
+		conversation has to open with a user turn, so leading assistant turns cut off by the context window are dropped.
+
+		:param messages: Role-tagged messages starting with the system prompt, built by promptBuilder.
+		:param model: The chat completion model to use.
+		:return: Keyword arguments for messages.create and messages.stream.
+		"""
+		system, messages = split_system(messages)
+		while messages and messages[0]['role'] == 'assistant':
+			messages = messages[1:]
+		if self.prompt_caching and count_tokens(model, messages) >= cache_min_tokens.get(model, 1024):
+			system, messages = self.mark_cache_breakpoints(system, messages)
+		args = {'model': model, 'max_tokens': self.max_tokens, 'messages': messages}
+		if system:
+			args['system'] = system
+		return args
+
+	@staticmethod
+	def mark_cache_breakpoints(system: str, messages: List[Dict[str, str]]):
+		"""
+		Place prompt cache breakpoints on the system prompt, the previous user turn and the last message.
+		The breakpoint on the last message writes the whole conversation to the cache, and the one on the
+		previous user turn reads what the last request wrote, so each turn only pays for its new messages.
+		Messages are copied, the ones built by promptBuilder are shared between requests.
+
+		:param system: The system prompt, or None.
+		:param messages: The conversation, alternating user and assistant turns.
+		:return: Tuple of the system prompt and the messages, with breakpoints as content blocks.
+		"""
+		def block(text):
+			return [{'type': 'text', 'text': text, 'cache_control': {'type': 'ephemeral'}}]
 
-	def claude_chat(self, conversation: str, model: str):
+		users = [index for index, msg in enumerate(messages) if msg['role'] == 'user']
+		marked = {len(messages) - 1, *users[-2:-1]}
+		messages = [{'role': msg['role'], 'content': block(msg['content'])} if index in marked else msg
+			for index, msg in enumerate(messages)]
+		return (block(system) if system else system), messages
+
+	def claude_chat(self, messages: List[Dict[str, str]], model: str):
 		"""
 		Handle a chat request for Claude versions
 
-		:param conversation: The conversation history as a single string. Includes system instructions.
+		:param messages: Role-tagged messages starting with the system prompt, built by promptBuilder.
+		:param model: The chat completion model to use.
+		:return: The response from the given model.
+		"""
+		response = self.client.messages.create(**self.request_args(messages, model))
+		record_usage(response.usage)
+		return response.content[0].text
+
+	def claude_chat_stream(self, messages: List[Dict[str, str]], model: str):
+		"""
+		Handle a streaming chat request for Claude versions
+
+		:param messages: Role-tagged messages starting with the system prompt, built by promptBuilder.
+		:param model: The chat completion model to use.
+		:return: A generator yielding text deltas as they are generated.
+		"""
+		with self.client.messages.stream(**self.request_args(messages, model)) as stream:
+			for text in stream.text_stream:
+				yield text
+			record_usage(stream.get_final_message().usage)
+
+
+	def get_async_client(self) -> AsyncAnthropic:
+		"""
+		Build the asyncio client on first use. It has its own connection pool, bound to the event loop that first uses it.
+
+		:return: The asyncio Anthropic client.
+		"""
+		if self.async_client is None:
+			self.async_client = AsyncAnthropic(base_url=self.base_url, api_key=self.api_key, max_retries=0,
+				http_client=DefaultAsyncHttpxClient(limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=300),
+					event_hooks={'request': [trace_request_async], 'response': [self.report_headers_async]}))
+		return self.async_client
+
+	async def chat(self, messages: List[Dict[str, str]], model: str) -> str:
+		"""
+		Handle a chat request for Claude versions without blocking the event loop
+
+		:param messages: Role-tagged messages starting with the system prompt, built by promptBuilder.
 		:param model: The chat completion model to use.
 		:return: The response from the given model.
 		"""
-		response = self.client.messages.create(
-			model=model,
-			max_tokens=800,
-			messages=[{"role": "user", "content": conversation}]
-		)
-		return response.content[0].text
\ No newline at end of file
+		response = await self.get_async_client().messages.create(**self.request_args(messages, model))
+		record_usage(response.usage)
+		return response.content[0].text
+
+	async def chat_stream(self, messages: List[Dict[str, str]], model: str):
+		"""
+		Handle a streaming chat request for Claude versions without blocking the event loop
+
+		:param messages: Role-tagged messages starting with the system prompt, built by promptBuilder.
+		:param model: The chat completion model to use.
+		:return: An async generator yielding text deltas as they are generated.
+		"""
+		async with self.get_async_client().messages.stream(**self.request_args(messages, model)) as stream:
+			async for text in stream.text_stream:
+				yield text
+			record_usage((await stream.get_final_message()).usage)
@@ -1,9 +1,14 @@
-from openai import OpenAI
+import httpx
+from typing import List, Dict
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
+
+from Metrics import record_usage, trace_request, trace_request_async
 
 class anyscaleHandler:
     def __init__(self, api_key: str, base_url: str = "https://api.endpoints.anyscale.com/"):
         """
         Initialize the AnyScale API handler with the necessary API key and optional base URL.
+        Requests share one keep-alive connection pool for the life of the handler.
 
         :param api_key: Your AnyScale API key.
         :param base_url: The base URL for the AnyScale API endpoints.
@@ -14,27 +19,131 @@ class anyscaleHandler:
 
         self.api_key = api_key
         self.base_url = base_url
-        self.client = OpenAI(base_url=self.base_url + "v1", api_key=self.api_key)
+        self.max_tokens = None
+        self.temperature = 0.01
+        self.http_client = DefaultHttpxClient(limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=300),
+            event_hooks={'request': [trace_request], 'response': [self.report_headers]})
+        self.client = OpenAI(base_url=self.base_url + "v1", api_key=self.api_key, http_client=self.http_client, max_retries=0)
+        self.async_client = None
+        self.on_headers = None # Called with the headers of every API response, set by the provider registry
+
+    def prewarm(self):
+        """
+        Open a pooled connection to the API ahead of the first request, so it does not pay for DNS and TLS setup.
+        """
+        try:
+            self.http_client.head(self.base_url, timeout=5)
+        except httpx.HTTPError:
+            pass
+
+    def report_headers(self, response):
+        """
+        Pass the headers of an API response to on_headers, e.g. so a rate limiter can follow the provider's limits.
+
+        :param response: The httpx response.
+        """
+        if self.on_headers:
+            self.on_headers(response.headers)
+
+    async def report_headers_async(self, response):
+        """
+        Pass the headers of an API response made by the asyncio client to on_headers.
+
+        :param response: The httpx response.
+        """
+        self.report_headers(response)
 
-    def anyscale_chat(self, conversation: str, model_id: str):
+    def anyscale_chat(self, messages: List[Dict[str, str]], model_id: str):
         """
         Handle a chat request using RayLLM models like Mistral
 
-        :param conversation: The user's query or conversation string.
+        :param messages: Role-tagged messages starting with the system prompt, built by promptBuilder.
         :param model_id: The RayLLM model ID to use, e.g., 'mistralai/Mistral-7B-Instruct-v0.1'.
         :return: The response from the given model.
         """
-        # Set up the initial system and user messages according to the new API requirements
-        messages = [
-            {"role": "system", "content": "You are a helpful assistant."},
-            {"role": "user", "content": conversation}
-        ]
-
-        # Use stream=False unless you specifically need streaming responses
+        # Use anyscale_chat_stream for streaming responses
         response = self.client.chat.completions.create(
             model=model_id,
             messages=messages,
-            temperature=0.01,
-            stream=False  # Set to True if you need streaming
+            temperature=self.temperature,
+            stream=False
+        )
+        record_usage(response.usage)
+        return response.choices[0].message.content if response.choices[0].message.content is not None else "No response generated."
+
+    def anyscale_chat_stream(self, messages: List[Dict[str, str]], model_id: str):
+        """
+        Handle a streaming chat request using RayLLM models like Mistral
+
+        :param messages: Role-tagged messages starting with the system prompt, built by promptBuilder.
+        :param model_id: The RayLLM model ID to use, e.g., 'mistralai/Mistral-7B-Instruct-v0.1'.
+        :return: A generator yielding text deltas as they are generated.
+        """
+
+        stream = self.client.chat.completions.create(
+            model=model_id,
+            messages=messages,
+            temperature=self.temperature,
+            stream=True
+        )
+        try:
+            for chunk in stream:
+                if chunk.usage:
+                    record_usage(chunk.usage)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            stream.close()
+
+
+    def get_async_client(self) -> AsyncOpenAI:
+        """
+        Build the asyncio client on first use. It has its own connection pool, bound to the event loop that first uses it.
+
+        :return: The asyncio client for the AnyScale endpoints.
+        """
+        if self.async_client is None:
+            self.async_client = AsyncOpenAI(base_url=self.base_url + "v1", api_key=self.api_key, max_retries=0,
+                http_client=DefaultAsyncHttpxClient(limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=300),
+                    event_hooks={'request': [trace_request_async], 'response': [self.report_headers_async]}))
+        return self.async_client
+
+    async def chat(self, messages: List[Dict[str, str]], model_id: str) -> str:
+        """
+        Handle a chat request using RayLLM models without blocking the event loop
+
+        :param messages: Role-tagged messages starting with the system prompt, built by promptBuilder.
+        :param model_id: The RayLLM model ID to use, e.g., 'mistralai/Mistral-7B-Instruct-v0.1'.
+        :return: The response from the given model.
+        """
+        response = await self.get_async_client().chat.completions.create(
+            model=model_id,
+            messages=messages,
+            temperature=self.temperature,
+            stream=False
+        )
+        record_usage(response.usage)
+        return response.choices[0].message.content if response.choices[0].message.content is not None else "No response generated."
+
+    async def chat_stream(self, messages: List[Dict[str, str]], model_id: str):
+        """
+        Handle a streaming chat request using RayLLM models without blocking the event loop
+
+        :param messages: Role-tagged messages starting with the system prompt, built by promptBuilder.
+        :param model_id: The RayLLM model ID to use, e.g., 'mistralai/Mistral-7B-Instruct-v0.1'.
+        :return: An async generator yielding text deltas as they are generated.
+        """
+        stream = await self.get_async_client().chat.completions.create(
+            model=model_id,
+            messages=messages,
+            temperature=self.temperature,
+            stream=True
         )
-        return response.choices[0].message.content if response.choices[0].message.content is not None else "No response generated."
\ No newline at end of file
+        try:
+            async for chunk in stream:
+                if chunk.usage:
+                    record_usage(chunk.usage)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            await stream.close()
@@ -1,11 +1,15 @@
 # Copyright © 2021 rdbende <rdbende@gmail.com>
 
-source [file join [file dirname [info script]] theme light.tcl]
-source [file join [file dirname [info script]] theme dark.tcl]
+# Each theme decodes all of its images when sourced, so a theme is only sourced the first time it is used
+set azure_theme_dir [file join [file dirname [file normalize [info script]]] theme]
 
 option add *tearOff 0
 
 proc set_theme {mode} {
+	if {[lsearch -exact [ttk::style theme names] "azure-$mode"] < 0} {
+		source [file join $::azure_theme_dir $mode.tcl]
+	}
+
 	if {$mode == "dark"} {
 		ttk::style theme use "azure-dark"
 
@@ -0,0 +1,145 @@
+import sys
+import json
+import asyncio
+import argparse
+from typing import List, Dict, Any, Iterator, Tuple
+
+from PromptBuilder import promptBuilder, SYSTEM_PROMPT
+from ContextManager import contextManager
+from ProviderRegistry import providerRegistry, model_name_mapping, model_token_budgets
+
+def iter_scripts(file_path: str) -> Iterator[Tuple[int, List[str]]]:
+	"""
+	Read scripted conversations one at a time. Each line of a .jsonl file, or each entry of a .json list,
+	is either a list of user turns or a dictionary with a 'turns' list and an optional 'chat_id'.
+
+	:param file_path: Path to the script file.
+	:return: Iterator of (chat_id, user turns) pairs.
+	"""
+	with open(file_path, 'r', encoding='utf-8') as file:
+		if file_path.endswith(".jsonl"):
+			scripts = (json.loads(line) for line in file if line.strip())
+		else:
+			scripts = iter(json.load(file))
+		for index, script in enumerate(scripts, start=1):
+			if isinstance(script, dict):
+				yield script.get('chat_id', index), script['turns']
+			else:
+				yield index, script
+
+async def run_conversation(registry: providerRegistry, args, chat_id: int, turns: List[str]) -> Dict[str, Any]:
+	"""
+	Replay the user turns of one scripted conversation against the true model
+
+	:param registry: providerRegistry used to reach the true model.
+	:param args: Parsed command-line arguments.
+	:param chat_id: Id recorded with the conversation.
+	:param turns: User messages to send in order.
+	:return: The conversation in the same chat_id/chatlog schema as Conversations.json, with the given and true model.
+	"""
+	true_model = model_name_mapping[args.true_model]
+	provider = await asyncio.to_thread(registry.provider, true_model)
+	summarizer = registry.chat_function(true_model)
+	builder = promptBuilder(args.system_prompt)
+	context = contextManager(true_model, model_token_budgets.get(true_model, 4000), strategy=args.context_strategy,
+		keep_first=args.keep_first, keep_last=args.keep_last, summarizer=lambda text: summarizer([{'role': 'user', 'content': text}], true_model))
+	chatlog = []
+	result = {'chat_id': chat_id, 'given_model': args.given_model, 'true_model': true_model, 'chatlog': chatlog}
+
+	for turn in turns:
+		chatlog.append({'msg_id': len(chatlog) + 1, 'sender': 'User', 'content': turn})
+		messages = await asyncio.to_thread(context.fit, chatlog, builder.build(chatlog))
+		try:
+			rsp = await asyncio.wait_for(provider.chat(messages, true_model), args.timeout)
+		except Exception as e:
+			result['error'] = repr(e) # Keep the turns that succeeded
+			break
+		chatlog.append({'msg_id': len(chatlog) + 1, 'sender': 'Bot', 'content': rsp})
+	return result
+
+async def run_batch(args):
+	"""
+	Run every scripted conversation with at most args.concurrency running at once, writing each one
+	to the output file as soon as it finishes. Scripts are read as slots free up, so memory stays flat.
+
+	:param args: Parsed command-line arguments.
+	"""
+	registry = providerRegistry({
+		'openai': {'api_key': args.openai_key},
+		'anyscale': {'api_key': args.anyscale_key},
+		'anthropic': {'api_key': args.anthropic_key}
+	})
+	slots = asyncio.Semaphore(args.concurrency)
+	running = set()
+	done = 0
+
+	with open(args.output, 'a', encoding='utf-8') as output:
+		async def run(chat_id, turns):
+			nonlocal done
+			try:
+				try:
+					result = await run_conversation(registry, args, chat_id, turns)
+				except Exception as e:
+					# Failures outside the turns, e.g. while building the provider, are written as error rows too
+					result = {'chat_id': chat_id, 'given_model': args.given_model, 'true_model': model_name_mapping[args.true_model],
+						'chatlog': [], 'error': repr(e)}
+				output.write(json.dumps(result, ensure_ascii=False) + "\n")
+				output.flush()
+				done += 1
+				print(f"Finished chat {chat_id} ({done} done)" + (f", stopped early: {result['error']}" if 'error' in result else ""))
+			finally:
+				slots.release()
+
+		try:
+			for chat_id, turns in iter_scripts(args.scripts):
+				await slots.acquire()
+				task = asyncio.create_task(run(chat_id, turns))
+				running.add(task)
+				task.add_done_callback(running.discard)
+		finally:
+			# Running conversations finish writing before the output file is closed, even if reading the scripts failed
+			await asyncio.gather(*running, return_exceptions=True)
+
+def parse_batch_arguments():
+	"""
+	Parse command-line arguments for a batch run.
+
+	:return: Namespace object with arguments
+	"""
+	parser = argparse.ArgumentParser(description="Replay scripted conversations against a model without the UI.")
+	parser.add_argument('--given_model', type=str, required=True,
+						choices=['GPT-4','Llama3','Claude3'],
+						help='Model name recorded with each conversation as the one participants were told about')
+	parser.add_argument('--true_model', type=str, required=True,
+						choices=['GPT-4','Llama3','Claude3'])
+	parser.add_argument('--scripts', type=str, required=True,
+						help='JSON or JSONL file of scripted user turns')
+	parser.add_argument('--output', type=str, required=True,
+						help='JSONL file each finished conversation is appended to')
+	parser.add_argument('--concurrency', type=int, default=8,
+						help='Maximum number of conversations running at once')
+	parser.add_argument('--timeout', type=float, default=120,
+						help='Seconds the model has to answer each turn')
+	parser.add_argument('--system_prompt', type=str, default=SYSTEM_PROMPT,
+						help='System prompt sent ahead of every conversation')
+	parser.add_argument('--context_strategy', type=str, default='sliding',
+						choices=['sliding','first_last','summary'])
+	parser.add_argument('--keep_first', type=int, default=2)
+	parser.add_argument('--keep_last', type=int, default=20)
+	parser.add_argument('--openai_key', type=str,
+						help='OpenAI API key')
+	parser.add_argument('--anyscale_key', type=str,
+						help='Anyscale API key')
+	parser.add_argument('--anthropic_key', type=str,
+						help='Anthropic API key')
+	return parser.parse_args()
+
+def main():
+	args = parse_batch_arguments()
+	try:
+		asyncio.run(run_batch(args))
+	except KeyboardInterrupt:
+		print("Batch run interrupted, finished conversations are saved.", file=sys.stderr)
+
+if __name__ == "__main__":
+	main()
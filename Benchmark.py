@@ -0,0 +1,330 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+from typing import Dict, List, Callable
+
+from IOFunctions import save_json_data
+from CompactArchive import save_compact_data, iter_compact_data, compactArchive
+from PromptBuilder import promptBuilder
+from ContextManager import contextManager
+from ProviderRegistry import providerRegistry, model_providers, model_token_budgets
+from MockLLMServer import mockLLMServer
+
+def median_time(func: Callable, repeats: int) -> float:
+	"""
+	Time a function several times
+
+	:param func: Function to time, called without arguments.
+	:param repeats: Number of runs.
+	:return: Median run time in seconds.
+	"""
+	times = []
+	for _ in range(repeats):
+		start = time.perf_counter()
+		func()
+		times.append(time.perf_counter() - start)
+	return statistics.median(times)
+
+def make_chatlog(count: int, words: int = 40) -> List[Dict[str, str]]:
+	"""
+	Build a chat log of alternating user and bot messages
+
+	:param count: Number of messages.
+	:param words: Words per message.
+	:return: The chat log.
+	"""
+	return [{'msg_id': i + 1, 'sender': 'User' if i % 2 == 0 else 'Bot', 'content': " ".join(f"word{i}_{j}" for j in range(words))}
+		for i in range(count)]
+
+def bench_turns(args) -> Dict[str, float]:
+	"""
+	Time whole conversation turns against the mock server: building and fitting the prompt,
+	then the model call through the provider registry, once blocking and once streamed
+
+	:param args: Parsed command-line arguments.
+	:return: Dictionary mapping benchmark names to median seconds.
+	"""
+	server = mockLLMServer(latency=args.latency, tokens_per_sec=args.tokens_per_sec, error_rate=args.error_rate,
+		response_tokens=args.response_tokens, seed=0)
+	server.start()
+	registry = providerRegistry(server.provider_options())
+	results = {}
+	try:
+		for model in model_providers:
+			for stream in (False, True):
+				chat_function = registry.chat_function(model, stream=stream)
+				builder = promptBuilder()
+				context = contextManager(model, model_token_budgets.get(model, 4000))
+				chatlog = []
+				turn_times, first_token_times = [], []
+				for turn in range(args.turns):
+					chatlog.append({'msg_id': len(chatlog) + 1, 'sender': 'User', 'content': f"Question number {turn}?"})
+					start = time.perf_counter()
+					messages = context.fit(chatlog, builder.build(chatlog))
+					if stream:
+						parts = []
+						for delta in chat_function(messages, model):
+							if not parts:
+								first_token_times.append(time.perf_counter() - start)
+							parts.append(delta)
+						rsp = "".join(parts)
+					else:
+						rsp = chat_function(messages, model)
+					turn_times.append(time.perf_counter() - start)
+					chatlog.append({'msg_id': len(chatlog) + 1, 'sender': 'Bot', 'content': rsp})
+				name = f"turn/{model_providers[model][0]}/{'stream' if stream else 'blocking'}"
+				results[name] = statistics.median(turn_times)
+				if first_token_times:
+					results[name + "/first_token"] = statistics.median(first_token_times)
+	finally:
+		server.stop()
+	return results
+
+def bench_prompt(args) -> Dict[str, float]:
+	"""
+	Time building the prompt messages for chat logs of several sizes: a full rebuild, and the incremental
+	build after one new message that every turn pays
+
+	:param args: Parsed command-line arguments.
+	:return: Dictionary mapping benchmark names to median seconds.
+	"""
+	results = {}
+	for count in args.messages:
+		chatlog = make_chatlog(count)
+		results[f"prompt/{count}/rebuild"] = median_time(lambda: promptBuilder().build(chatlog), args.repeats)
+
+		builders = [promptBuilder() for _ in range(args.repeats)]
+		for builder in builders:
+			builder.build(chatlog[:-1])
+		pending = iter(builders)
+		results[f"prompt/{count}/append"] = median_time(lambda: next(pending).build(chatlog), args.repeats)
+	return results
+
+def bench_render(args) -> Dict[str, float]:
+	"""
+	Time update_window, drawing one new message into a view already holding N messages,
+	including the deferred layout pass, with the widget and the canvas item renderers.
+	Skipped when no display is available.
+
+	:param args: Parsed command-line arguments.
+	:return: Dictionary mapping benchmark names to median seconds.
+	"""
+	import tkinter as tk
+	from tkinter import ttk
+	from ChatApp import colors
+	from MessageView import messageView
+	from CanvasMessageView import canvasMessageView
+
+	try:
+		root = tk.Tk()
+	except tk.TclError as e:
+		print(f"Skipping render benchmarks, no display: {e}", file=sys.stderr)
+		return {}
+	results = {}
+	try:
+		root.geometry('1200x900')
+		root.tk.call("source", "Azure-ttk-theme-main/azure.tcl")
+		root.tk.call("set_theme", "dark")
+		icon = tk.PhotoImage(width=32, height=32)
+		for suffix, view_class in (("", messageView), ("/canvas", canvasMessageView)):
+			for count in args.messages:
+				frame = ttk.Frame(root)
+				frame.pack(fill='both', expand=True)
+				canvas = tk.Canvas(frame, highlightthickness=0)
+				scrollbar = ttk.Scrollbar(frame, command=canvas.yview)
+				canvas.pack(side='left', fill='both', expand=True)
+				scrollbar.pack(side='right', fill='y')
+				view = view_class(canvas, scrollbar, colors, {'User': icon, 'Bot': icon}, icon, icon, lambda msg_id: None)
+				chatlog = make_chatlog(count)
+				view.set_messages(chatlog)
+				view.scroll_to_end()
+				root.update()
+
+				def update_window():
+					msg_info = {'msg_id': len(chatlog) + 1, 'sender': 'Bot', 'content': f"New message {len(chatlog)}"}
+					chatlog.append(msg_info)
+					view.append(msg_info)
+					view.scroll_to_end()
+					root.update_idletasks()
+				results[f"render/{count}/update_window{suffix}"] = median_time(update_window, args.repeats)
+				frame.destroy()
+	finally:
+		root.destroy()
+	return results
+
+def bench_startup(args) -> Dict[str, float]:
+	"""
+	Time the startup steps ChatApp defers or caches: sourcing the theme, and loading the icons from
+	the full-size images as opposed to from the icon cache. Every run gets a new Tk interpreter so
+	nothing is loaded yet. Skipped when no display is available.
+
+	:param args: Parsed command-line arguments.
+	:return: Dictionary mapping benchmark names to median seconds.
+	"""
+	import tkinter as tk
+	from ChatApp import model_icons
+	from IconCache import iconCache
+
+	try:
+		tk.Tk().destroy()
+	except tk.TclError as e:
+		print(f"Skipping startup benchmarks, no display: {e}", file=sys.stderr)
+		return {}
+	icons = list(model_icons.values()) + [("Images/user.png", (12, 12)), ("Images/edit.png", (150, 150)), ("Images/dots.png", (8, 8))]
+
+	def time_step(step):
+		times = []
+		for _ in range(args.repeats):
+			root = tk.Tk()
+			try:
+				start = time.perf_counter()
+				step(root)
+				times.append(time.perf_counter() - start)
+			finally:
+				root.destroy()
+		return statistics.median(times)
+
+	def theme(root):
+		root.tk.call("source", "Azure-ttk-theme-main/azure.tcl")
+		root.tk.call("set_theme", "dark")
+
+	def full_size(root):
+		for icon_path, subsample in icons:
+			tk.PhotoImage(master=root, file=icon_path).subsample(*subsample)
+
+	results = {'startup/theme': time_step(theme), 'startup/icons/full_size': time_step(full_size)}
+	with tempfile.TemporaryDirectory() as folder:
+		def cached(root):
+			cache = iconCache(root, folder)
+			for icon_path, subsample in icons:
+				cache.get(icon_path, subsample)
+			cache.load()
+		time_step(cached) # Fill the cache
+		results['startup/icons/cached'] = time_step(cached)
+	return results
+
+def bench_save(args) -> Dict[str, float]:
+	"""
+	Time save_json_data for archives of several sizes, against saving, streaming back and
+	looking up one chat in the compact archive format
+
+	:param args: Parsed command-line arguments.
+	:return: Dictionary mapping benchmark names to median seconds.
+	"""
+	results = {}
+	with tempfile.TemporaryDirectory() as folder:
+		path = os.path.join(folder, "Conversations.json")
+		for count in args.archive_sizes:
+			conversations = [{'chat_id': chat_id, 'chatlog': make_chatlog(20)} for chat_id in range(1, count + 1)]
+			results[f"save/{count}/save_json_data"] = median_time(lambda: save_json_data(conversations, path), args.repeats)
+			compact_path = os.path.join(folder, "Conversations.jsonl.gz")
+			results[f"save/{count}/save_compact_data"] = median_time(lambda: save_compact_data(conversations, compact_path), args.repeats)
+			results[f"save/{count}/iter_compact_data"] = median_time(lambda: sum(1 for _ in iter_compact_data(compact_path)), args.repeats)
+			def get_chat():
+				archive = compactArchive(compact_path)
+				archive.get_chat(count // 2)
+				archive.close()
+			results[f"save/{count}/compact_get_chat"] = median_time(get_chat, args.repeats)
+	return results
+
+# Dictionary mapping suite names to their benchmark functions
+benchmark_suites = {
+	'turns': bench_turns,
+	'prompt': bench_prompt,
+	'render': bench_render,
+	'startup': bench_startup,
+	'save': bench_save
+}
+
+def compare(results: Dict[str, float], baseline: Dict[str, float], tolerance: float, min_delta: float) -> List[str]:
+	"""
+	Find benchmarks that got slower than the baseline
+
+	:param results: Current median seconds by benchmark name.
+	:param baseline: Baseline median seconds by benchmark name.
+	:param tolerance: Allowed slowdown as a fraction of the baseline.
+	:param min_delta: Slowdowns below this many seconds are ignored as noise.
+	:return: Names of the regressed benchmarks.
+	"""
+	return [name for name, seconds in results.items()
+		if name in baseline and seconds > baseline[name] * (1 + tolerance) and seconds - baseline[name] > min_delta]
+
+def print_report(results: Dict[str, float], baseline: Dict[str, float], regressions: List[str]):
+	"""
+	Print a table of results next to the baseline
+
+	:param results: Current median seconds by benchmark name.
+	:param baseline: Baseline median seconds by benchmark name.
+	:param regressions: Names of the regressed benchmarks.
+	"""
+	width = max(map(len, results), default=0)
+	print(f"{'benchmark':<{width}}  {'median':>10}  {'baseline':>10}  {'change':>8}")
+	for name, seconds in results.items():
+		if name in baseline:
+			change = f"{(seconds / baseline[name] - 1) * 100:+.0f}%" if baseline[name] else "n/a"
+			base = f"{baseline[name] * 1000:.3f}ms"
+		else:
+			change, base = "new", "-"
+		flag = "  REGRESSION" if name in regressions else ""
+		print(f"{name:<{width}}  {seconds * 1000:>8.3f}ms  {base:>10}  {change:>8}{flag}")
+
+def parse_benchmark_arguments():
+	"""
+	Parse command-line arguments for a benchmark run.
+
+	:return: Namespace object with arguments
+	"""
+	parser = argparse.ArgumentParser(description="Benchmark the app offline against a local mock model server.")
+	parser.add_argument('--suites', type=str, nargs='+', default=list(benchmark_suites),
+						choices=list(benchmark_suites))
+	parser.add_argument('--baseline', type=str, default='Benchmark.baseline.json',
+						help='JSON file of baseline results to compare against')
+	parser.add_argument('--save_baseline', action='store_true',
+						help='Store these results as the new baseline')
+	parser.add_argument('--tolerance', type=float, default=0.2,
+						help='Allowed slowdown against the baseline as a fraction')
+	parser.add_argument('--min_delta', type=float, default=0.001,
+						help='Seconds a slowdown must exceed to count as a regression')
+	parser.add_argument('--repeats', type=int, default=20)
+	parser.add_argument('--turns', type=int, default=10,
+						help='Conversation turns per model in the turn benchmarks')
+	parser.add_argument('--messages', type=int, nargs='+', default=[10, 100, 1000],
+						help='Chat log sizes for the prompt and render benchmarks')
+	parser.add_argument('--archive_sizes', type=int, nargs='+', default=[10, 100, 1000],
+						help='Numbers of saved chats for the save benchmarks')
+	parser.add_argument('--latency', type=float, default=0.05,
+						help='Mock server seconds before the first token')
+	parser.add_argument('--tokens_per_sec', type=float, default=500,
+						help='Mock server generation rate')
+	parser.add_argument('--response_tokens', type=int, default=50)
+	parser.add_argument('--error_rate', type=float, default=0.0,
+						help='Fraction of mock requests that fail, to measure retries')
+	return parser.parse_args()
+
+def main():
+	args = parse_benchmark_arguments()
+	results = {}
+	for suite in args.suites:
+		results.update(benchmark_suites[suite](args))
+
+	baseline = {}
+	if os.path.exists(args.baseline):
+		with open(args.baseline, 'r', encoding='utf-8') as file:
+			baseline = json.load(file)
+	regressions = compare(results, baseline, args.tolerance, args.min_delta)
+	print_report(results, baseline, regressions)
+
+	if args.save_baseline:
+		with open(args.baseline, 'w', encoding='utf-8') as file:
+			json.dump({**baseline, **results}, file, indent=4)
+		print(f"Saved baseline to {args.baseline}")
+	elif regressions:
+		print(f"{len(regressions)} benchmark(s) regressed by more than {args.tolerance:.0%}", file=sys.stderr)
+		sys.exit(1)
+
+if __name__ == "__main__":
+	main()
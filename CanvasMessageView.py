@@ -0,0 +1,182 @@
+from tkinter import ttk
+from collections import OrderedDict
+
+from MessageView import messageView
+
+def rounded_rect(x1, y1, x2, y2, radius):
+	"""
+	Get the points of a rectangle with rounded corners, to be drawn as a smoothed polygon. Each corner
+	point is repeated so the smoothing only rounds the corners and keeps the edges straight.
+
+	:param x1: Left edge.
+	:param y1: Top edge.
+	:param x2: Right edge.
+	:param y2: Bottom edge.
+	:param radius: Corner radius, reduced to fit small rectangles.
+	:return: Flat list of x, y coordinates.
+	"""
+	r = max(min(radius, (x2 - x1) / 2, (y2 - y1) / 2), 0)
+	return [x1 + r, y1, x1 + r, y1, x2 - r, y1, x2 - r, y1, x2, y1, x2, y1 + r, x2, y1 + r, x2, y2 - r, x2, y2 - r,
+		x2, y2, x2 - r, y2, x2 - r, y2, x1 + r, y2, x1 + r, y2, x1, y2, x1, y2 - r, x1, y2 - r, x1, y1 + r, x1, y1 + r, x1, y1]
+
+class canvasMessageView(messageView):
+	padding = 10 # Pixels between the canvas edge, the icon and the bubble
+	bubble_padding = 8 # Pixels between the bubble edge and its text
+	radius = 12 # Corner radius of the bubbles
+	gap = 6 # Pixels between messages
+
+	def __init__(self, *args, **kwargs):
+		"""
+		Initialize a message list that draws each message as canvas items instead of widgets: a rounded
+		bubble, its text and the sender's icon, tagged as one group so they move together. Only the edit
+		button of user messages is a widget, drawn as an overlay. Rows of items are pooled and bound to
+		the messages near the viewport as in messageView, which takes the same arguments.
+		"""
+		self.text_sizes = OrderedDict() # Message content -> width and height of its wrapped text, least recently used first
+		self.row_count = 0
+		super().__init__(*args, **kwargs)
+
+		# Text item that is never in view, used to measure wrapped text exactly as the bubbles wrap it
+		self.measure_text = self.canvas.create_text(-10000, -10000, anchor='nw', font=self.font, width=self.wraplength)
+
+	def bubble_colors(self, sender):
+		"""
+		Get the background and text color of a message for the current theme
+		:param sender: Sender of the message
+		:return: Tuple of background and text color
+		"""
+		if sender == "User":
+			if self.dark:
+				return self.colors.get("user_msg_bg_dark"), self.colors.get("user_msg_text_dark")
+			return self.colors.get("user_msg_bg_light"), self.colors.get("user_msg_text_light")
+		if self.dark:
+			return self.colors.get("bot_msg_bg_dark"), self.colors.get("user_msg_text_dark")
+		return self.colors.get("bot_msg_bg_light"), self.colors.get("user_msg_text_light")
+
+	def set_theme(self, dark):
+		"""
+		Recolor every bubble for a theme, one canvas call per sender and item kind
+		:param dark: Whether the dark theme is in use
+		"""
+		super().set_theme(dark)
+		for sender in ("User", "Bot"):
+			bg_color, text_color = self.bubble_colors(sender)
+			self.canvas.itemconfig(f"{sender}.bubble", fill=bg_color)
+			self.canvas.itemconfig(f"{sender}.text", fill=text_color)
+
+	def text_size(self, text):
+		"""
+		Measure the wrapped text of a message, caching the result per content
+		:param text: Content of the message
+		:return: Tuple of width and height in pixels
+		"""
+		def compute():
+			self.canvas.itemconfig(self.measure_text, text=text)
+			bbox = self.canvas.bbox(self.measure_text)
+			return (bbox[2] - bbox[0], bbox[3] - bbox[1]) if bbox else (0, 0)
+		return self.cached(self.text_sizes, text, compute)
+
+	def measure(self, msg):
+		"""
+		Measure the height of a message's items
+		:param msg: Dictionary containing message id, sender, and content
+		:return: Height of the row in pixels
+		"""
+		height = self.text_size(msg['content'])[1] + 2 * self.bubble_padding
+		if msg['sender'] == "User":
+			height += self.edit_height
+		icon = self.icons.get(msg['sender'])
+		return max(icon.height() if icon else 0, height) + self.gap
+
+	def new_row(self):
+		"""
+		Create a group of canvas items that can be bound to any message
+		:return: Dictionary of the row's items and overlay widgets
+		"""
+		self.row_count += 1
+		tag = f"row{self.row_count}"
+		frame = ttk.Frame(self.canvas)
+		return {
+			'tag': tag,
+			'top': 0,
+			'bubble': self.canvas.create_polygon(rounded_rect(0, 0, 1, 1, 0), smooth=True, outline='', tags=(tag,)),
+			'text': self.canvas.create_text(0, 0, anchor='nw', font=self.font, width=self.wraplength, tags=(tag,)),
+			'icon': self.canvas.create_image(0, 0, anchor='nw', tags=(tag,)),
+			'frame': frame,
+			**self.new_tools(frame),
+			'overlay': self.canvas.create_window(0, 0, window=frame, anchor='ne', state='hidden', tags=(tag,))
+		}
+
+	def bind_row(self, row, index):
+		"""
+		Draw a message into a row at the message's position
+		:param row: Row to draw into
+		:param index: Index of the message in the view
+		"""
+		msg_info = self.messages[index]
+		send = msg_info['sender']
+		style = "User" if send == "User" else "Bot"
+		bg_color, text_color = self.bubble_colors(style)
+		text_width, text_height = self.text_size(msg_info['content'])
+		icon = self.icons.get(send)
+		icon_width = icon.width() if icon else 0
+		top = self.tops[index]
+
+		# User messages are aligned to the right with the icon at the edge, bot messages to the left
+		if send == "User":
+			icon_x = self.width - self.padding - icon_width
+			right = icon_x - self.padding
+			left = right - text_width - 2 * self.bubble_padding
+		else:
+			icon_x = self.padding
+			left = icon_x + icon_width + self.padding
+			right = left + text_width + 2 * self.bubble_padding
+		bottom = top + text_height + 2 * self.bubble_padding
+
+		self.canvas.coords(row['bubble'], *rounded_rect(left, top, right, bottom, self.radius))
+		self.canvas.itemconfig(row['bubble'], fill=bg_color, state='normal', tags=(row['tag'], f"{style}.bubble"))
+		self.canvas.coords(row['text'], left + self.bubble_padding, top + self.bubble_padding)
+		self.canvas.itemconfig(row['text'], text=msg_info['content'], fill=text_color, state='normal', tags=(row['tag'], f"{style}.text"))
+		self.canvas.coords(row['icon'], icon_x, top)
+		self.canvas.itemconfig(row['icon'], image=icon or '')
+
+		# Only user messages get the edit button overlay, below the bubble
+		if send == "User":
+			self.bind_tools(row, msg_info)
+			row['tools'].pack(side='right')
+			self.canvas.coords(row['overlay'], right, bottom)
+			self.canvas.itemconfig(row['overlay'], state='normal')
+		else:
+			self.canvas.itemconfig(row['overlay'], state='hidden')
+
+		row.update({'info': msg_info, 'index': index, 'top': top})
+
+	def move_row(self, row, top):
+		"""
+		Move all items of a row to a vertical position on the canvas
+		:param row: Row to move
+		:param top: Y offset of the top of the row
+		"""
+		self.canvas.move(row['tag'], 0, top - row['top'])
+		row['top'] = top
+
+	def start_edit(self, msg_id):
+		"""
+		Hide a message's bubble and tools so an editor can be drawn in the overlay, its row stays bound until unpinned
+		:param msg_id: Id number of the message, which must currently have a row
+		:return: Frame to pack the editor widgets into
+		"""
+		self.pin(msg_id)
+		row = self.widgets[msg_id]
+		row['tools'].pack_forget()
+		self.canvas.itemconfig(row['bubble'], state='hidden')
+		self.canvas.itemconfig(row['text'], state='hidden')
+		return row['frame']
+
+	def on_resize(self, event):
+		"""
+		Redraw the bound rows for the canvas's new width, user messages are aligned to its right edge
+		"""
+		self.width = event.width
+		self.dirty.update(self.rows)
+		self.schedule()
@@ -1,27 +1,32 @@
 import pdb
 import copy
+import time
 import tkinter as tk
 from tkinter import ttk
 from tkinter import simpledialog, scrolledtext
 
-from OpenaiHandler import openaiHandler
-from AnyscaleHandler import anyscaleHandler
-from AnthropicHandler import anthropicHandler
-from IOFunctions import save_json_data, parse_arguments
+from ProviderRegistry import providerRegistry, model_name_mapping
+from IOFunctions import conversationStore, parse_arguments
+from LLMWorker import llmWorker
+from SessionEngine import sessionEngine
+from ContextManager import count_tokens
+from ResponseCache import responseCache
+from Metrics import callMetrics
+from ConversationArchive import conversationArchive
+from MessageView import messageView
+from CanvasMessageView import canvasMessageView
+from IconCache import iconCache
 
 
-# Dictionary mapping shorthand to proper LLM names. Change manually to test different models.
-model_name_mapping = {'GPT-4': 'gpt-4o-mini', 
-		'Llama3': 'meta-llama/Meta-Llama-3-70B-Instruct', 
-		'Claude3': 'claude-3-haiku-20240307'}
-
-# Dictionary mapping models to their icons
+# Dictionary mapping models to their icons and how much the images are shrunk
 model_icons = {
-	"GPT-4": ("images/gpt.png", (24, 24)),
-	"Claude3": ("images/claude.png", (12, 12)),
-	"Llama3": ("images/llama.png", (26, 26))
+	"GPT-4": ("Images/gpt.png", (24, 24)),
+	"Claude3": ("Images/claude.png", (12, 12)),
+	"Llama3": ("Images/llama.png", (26, 26))
 }
 
+launch_time = time.perf_counter() # Start of the time to the first drawn frame
+
 colors = {
 	'bg_scrollable_window': '#333333',
 	'user_msg_bg_dark': '#2e86c1',
@@ -37,24 +42,84 @@ class ChatApp:
 	def __init__(self, root, config):
 		self.root = root
 		self.config = config
-		self.chatlog = []
-		self.conversations = {}
-		self.msg_widgets = {}
+		self.startup_times = {} # Seconds spent in each startup step, saved with the metrics once the window is drawn
+		self.theme = None # 'dark' or 'light', kept here so drawing never has to ask Tk
+		started = time.perf_counter()
+		self.set_theme('dark')
+		self.startup_times['theme'] = time.perf_counter() - started
+		self.worker = llmWorker()
+		self.archive = conversationArchive(self.config['archive_path'])
+		self.cache = None
+		if self.config['cache'] != 'off':
+			self.cache = responseCache(self.config['cache_path'], mode=self.config['cache'],
+				ttl=self.config['cache_ttl'], max_entries=self.config['cache_max_entries'])
+		self.metrics = callMetrics(self.config['metrics_path'], port=self.config['metrics_port'])
+		# The chat log, its edit branches and their saving, and the model calls, shared with the session server
+		store = conversationStore(self.config['store_path'], given_model=self.config['given_model'], true_model=self.config['true_model'])
+		self.engine = sessionEngine(self.config, store, self.metrics, cache=self.cache)
+		self.pending_request = None # Id of the model call currently in flight, if any
+		self.pending_response = None # The engine's response the call in flight generates
+		self.speculation = None # Request started for the draft in the input field before it was sent, if any
+		self.speculation_tokens = 0 # Estimated prompt tokens spent on speculative requests this session
+		self.draft_job = None # Pending typing pause timer
+		self.stream_msg = None # Bot message currently being streamed into, drawn before it is added to the chat log
+		self.poll_interval = 30 # Milliseconds between checks for finished model calls
 		self.main_frame = ttk.Frame(self.root)
 
-		# Import images
-		icon_path, subsample = model_icons.get(self.config['given_model'], ("images/bot.png", (20, 20)))
-		self.bot_icon = tk.PhotoImage(file=icon_path).subsample(*subsample)
-		self.user_icon = tk.PhotoImage(file="images/user.png").subsample(12,12)
-		self.edit_icon = tk.PhotoImage(file="images/edit.png").subsample(150,150)
-		self.dots_icon = tk.PhotoImage(file="images/dots.png").subsample(8,8)
+		# Import images, they are only read once the window is first drawn and come from the icon cache after the first launch
+		self.icons = iconCache(self.root, self.config['icon_cache'])
+		icon_path, subsample = model_icons.get(self.config['given_model'], ("Images/bot.png", (20, 20)))
+		self.bot_icon = self.icons.get(icon_path, subsample)
+		self.user_icon = self.icons.get("Images/user.png", (12, 12))
+		self.edit_icon = self.icons.get("Images/edit.png", (150, 150))
+		self.dots_icon = self.icons.get("Images/dots.png", (8, 8))
 
 		# Draw the UI
+		started = time.perf_counter()
 		self.initialize_ui()
+		self.startup_times['ui'] = time.perf_counter() - started
+
+		# Reopen an archived chat if asked to
+		if self.config['resume'] is not None:
+			chats = self.archive.get_chat(self.config['resume'], self.config['resume_session'])
+			if chats and chats[0]['chatlog']:
+				self.open_chat(chats[0])
+			else:
+				print(f"There is no archived chat with id {self.config['resume']}.")
 
 		# Bind the window close event
 		self.root.protocol("WM_DELETE_WINDOW", self.on_close)
 
+		# Start checking for responses from the background worker
+		self.root.after(self.poll_interval, self.poll_responses)
+
+		# Build the true model's client and connect to it while the window is drawing
+		self.config['providers'].prewarm(self.config['true_model'])
+
+		# Startup ends once the window is mapped and the redraws that mapping queued have run
+		self.map_binding = self.root.bind('<Map>', self.on_map, '+')
+
+	def on_map(self, event):
+		"""
+		Waits for the first frame once the main window is mapped, only the first time
+		:param event: The map event, also reported for every child widget
+		"""
+		if event.widget is not self.root or self.map_binding is None:
+			return
+		self.root.unbind('<Map>', self.map_binding)
+		self.map_binding = None
+		self.root.after_idle(self.on_first_frame)
+
+	def on_first_frame(self):
+		"""
+		Loads the icons once the window has been drawn, and saves how long startup took
+		"""
+		self.startup_times['first_frame'] = time.perf_counter() - launch_time
+		started = time.perf_counter()
+		self.icons.load()
+		self.startup_times['icons'] = time.perf_counter() - started
+		self.metrics.log('startup', **{name: round(seconds, 4) for name, seconds in self.startup_times.items()})
+
 	def initialize_ui(self):
 		"""
 		Create all UI elements on the screen
@@ -66,25 +131,30 @@ class ChatApp:
 		self.btn_color = ttk.Checkbutton(self.root, style='Switch.TCheckbutton', command=self.change_theme)
 		self.btn_color.pack()
 
+		# Button to reopen an archived chat
+		self.btn_open = ttk.Button(self.root, text="Open chat", command=self.pick_session)
+		self.btn_open.pack(pady=(5, 0))
+
 		self.botname = ttk.Label(self.root, text=f"Connected to {self.config['given_model']}", font=("Helvetica", 24, "bold"))
 		self.botname.pack(pady=20)
 
 		# Create the main canvas to draw on, create a vertical scrollbar and link it to the canvas
 		self.canvas = tk.Canvas(self.main_frame, highlightthickness=0)
 		self.scrollbar = ttk.Scrollbar(self.main_frame, command=self.canvas.yview)
-		self.canvas.configure(yscrollcommand=self.scrollbar.set)
 
 		# Pack the canvas to the left and set the scrollbar to the right of it
 		self.canvas.pack(side='left', fill='both', expand=True)
 		self.scrollbar.pack(side='right', fill='y')
 
-		# A new frame within the canvas that is scrollable, messages will be placed in here
-		self.scrollable_window = tk.Frame(self.canvas, bg=colors.get('bg_scrollable_window'))
-		self.canvas_window = self.canvas.create_window((0, 0), window=self.scrollable_window, anchor="nw")
+		# Messages are drawn into a small pool of recycled rows, only near the visible part of the canvas,
+		# either as widgets or as plain canvas items
+		view_class = canvasMessageView if self.config['renderer'] == 'canvas' else messageView
+		self.view = view_class(self.canvas, self.scrollbar, colors, {'User': self.user_icon, 'Bot': self.bot_icon},
+			self.edit_icon, self.dots_icon, self.edit_message, branches=self.engine.branch_position, on_switch=self.switch_branch,
+			dark=self.theme == 'dark')
+		self.msg_widgets = self.view.widgets # Rows of the messages that currently have widgets
 
-		# Configure the scrollregion and bind mouse wheel to it
-		self.scrollable_window.bind("<Configure>", self.update_scrollregion)
-		self.canvas.bind('<Configure>', self.resize_canvas)
+		# Bind mouse wheel to the canvas
 		self.canvas.bind_all("<MouseWheel>", self.on_mousewheel)
 		self.main_frame.pack(fill='both', expand=True)
 
@@ -95,6 +165,7 @@ class ChatApp:
 		# Text entry field
 		self.msg_ent = ttk.Entry(bottom_frame, font=('Arial', 12))
 		self.msg_ent.pack(side='left', fill='x', expand=True, padx=(22, 0), pady=10)
+		self.msg_ent.bind('<KeyRelease>', self.on_draft_changed)
 
 		# Send button
 		self.btn_send = ttk.Button(bottom_frame, text="Send", style="Accent.TButton", command=self.send_message)
@@ -105,30 +176,23 @@ class ChatApp:
 		"""
 		Handles event of user sending a message and subsequent actions once the send button is clicked
 		"""
-		# Get the user message from the input field and strip
-		msg = self.msg_ent.get().strip()
+		# Update and save the chat log with the user message from the input field, unless it is blank or a response is still in flight
+		try:
+			msg_info = self.engine.add_user_message(self.msg_ent.get())
+		except (RuntimeError, ValueError) as e:
+			print(e)
+			return
 
-		if msg: # Check if a blank message or not
-			msg_id = len(self.chatlog) + 1 # Assign an id to the message, for logging
-			msg_info = {
-				'msg_id': msg_id,
-				'sender': 'User',
-				'content': msg
-			}
+		# Clear the input field, and draw the message to the screen
+		self.msg_ent.delete(0, 'end')
+		self.update_window(msg_info)
 
-			# Update the chat log, clear the input field, and draw the message to the screen
-			self.chatlog.append(msg_info)
-			self.msg_ent.delete(0, 'end')
-			self.update_window(msg_info)
+		# Draw dots to indicate the chatbot is thinking until a response is given
+		self.view.show_dots()
 
-			# Draw dots to indicate the chatbot is thinking until a response is given
-			self.dots_label = tk.Label(self.scrollable_window, image=self.dots_icon, bg=colors.get("bg_scrollable_window"))
-			self.dots_label.pack(side='left', fill='x', padx=5)
-
-			# This is required so that tkinter updates events properly
-			self.root.after(10, self.get_llm_response)
-		else:
-			print("There was no message entered.")
+		# Request the response in the background so the window keeps repainting, unless it was already requested while typing
+		if not self.adopt_speculation(msg_info):
+			self.get_llm_response()
 
 
 	def edit_message(self, msg_id):
@@ -136,43 +200,46 @@ class ChatApp:
 		Handles event of user editing a previous message and subsequent actions
 		:param msg_id: Id number of message to edit
 		"""
-		# Get the message we want to edit
-		msg_widget = self.msg_widgets.get(msg_id)
+		# Get the message we want to edit, and keep its row from being recycled while editing
+		msg_info = self.msg_widgets[msg_id]['info']
+		frame = self.view.start_edit(msg_id)
 
 		# Draw the edit message elements to the screen needed for input
-		edit_ent = ttk.Entry(msg_widget['frame'], font=('Arial', 14), width=25)
-		edit_ent.insert(0, msg_widget['info']['content'])
+		edit_ent = ttk.Entry(frame, font=('Arial', 14), width=25)
+		edit_ent.insert(0, msg_info['content'])
 		edit_ent.pack(side='right', fill='x')
-		msg_widget['edit'].pack_forget()
-		msg_widget['label'].pack_forget()
 
 		# Create a cancel button
-		canc_btn = ttk.Button(msg_widget['frame'], text='Cancel', width=6, command=lambda: on_cancel())
+		canc_btn = ttk.Button(frame, text='Cancel', width=6, command=lambda: on_cancel())
 		canc_btn.pack(side='right', padx=3)
 
 		# Create a send button to confirm edits
-		send_btn = ttk.Button(msg_widget['frame'], text='Send', width=4, command=lambda: on_confirm())
+		send_btn = ttk.Button(frame, text='Send', width=4, command=lambda: on_confirm())
 		send_btn.pack(side='right', padx=3)
 
 		# Function to handle cancelling of edits
 		def on_cancel():
-			# Remove edit entry elements and repack the original message and edit button
+			# Remove edit entry elements and redraw the original message and edit button
 			canc_btn.destroy()
 			send_btn.destroy()
 			edit_ent.destroy()
-
-			msg_widget['edit'].pack(side='bottom', anchor='se', padx=(0, msg_widget['padxr']))
-			msg_widget['label'].pack(side='right', anchor='e', padx=(msg_widget['padxl'], msg_widget['padxr']), expand=True)
+			self.view.unpin(msg_id)
 
 		# Function to handle confirmation of edits
 		def on_confirm():
 			new_text = edit_ent.get()
 			if new_text:
-				# Backup the current state of chatlog
-				self.backup_chatlog()
+				on_cancel()
+
+				# Drop any response still being generated for the old message
+				self.cancel_response()
 
-				# Delete all messages after this point
-				self.delete_messages(msg_id)
+				# Index the chat as it was, then continue in a new chat sharing the messages before the edited one
+				self.archive_chat()
+				self.engine.fork(msg_id)
+
+				# Delete all messages after this point from the screen
+				self.view.truncate(msg_id)
 
 				# Send the updated message
 				self.msg_ent.insert(0, new_text)
@@ -186,138 +253,245 @@ class ChatApp:
 
 	def get_llm_response(self):
 		"""
-		Retreives the LLM response given the current chat log and the true model
-		"""
-		# Create a prompt of the current chatlog
-		prompt = self.concat_conversation()
-
-		# Get a response from the true model
-		model_function_map = {
-			'gpt-4o-mini': self.config['openai'].gpt_chat,
-			'meta-llama/Meta-Llama-3-70B-Instruct': self.config['anyscale'].anyscale_chat,
-			'claude-3-haiku-20240307': self.config['anthropic'].claude_chat
-		}
-		chat_function = model_function_map.get(self.config['true_model'])
-		rsp = chat_function(prompt, self.config['true_model']) if chat_function else None
-
-		if rsp: # Check if the LLM actually responded
-			msg_id = len(self.chatlog) + 1
-			rsp_info = {
-				'msg_id': msg_id,
-				'sender': 'Bot',
-				'content': rsp
-			}
-
-			# Update the chat log, remove thinking dots, and draw the message to the screen
-			self.dots_label.pack_forget()
-			self.chatlog.append(rsp_info)
-			self.update_window(rsp_info)
+		Requests the LLM response given the current chat log and the true model on the background worker
+		"""
+		# The messages are built now, the engine fits them to the token budget and calls the model on the worker's loop
+		self.stream_msg = None # Bubble is created once the first chunk arrives
+		self.pending_response = self.engine.start_response()
+		self.pending_request = self.worker.submit_stream(self.engine.generate, self.pending_response)
+
+	def on_draft_changed(self, event=None):
+		"""
+		Restarts the typing pause timer after a key press in the input field, and drops the speculative request
+		if the draft no longer matches it
+		:param event: The key event
+		"""
+		if not self.config['speculate']:
+			return
+		if self.draft_job is not None:
+			self.root.after_cancel(self.draft_job)
+			self.draft_job = None
+		draft = self.msg_ent.get().strip()
+		if self.speculation and self.speculation['draft'] != draft:
+			self.cancel_speculation()
+		if draft and self.speculation is None:
+			self.draft_job = self.root.after(self.config['speculate_debounce'], self.speculate)
+
+	def speculate(self):
+		"""
+		Requests the response to the draft in the input field once the user pauses typing, so it is
+		already on its way if the draft is sent unchanged. Stops once the session's token cap is spent.
+		"""
+		self.draft_job = None
+		draft = self.msg_ent.get().strip()
+		if (len(draft) < self.config['speculate_min_chars'] or self.pending_request is not None
+				or self.speculation is not None or self.config['fan_out']):
+			return
+
+		msg_info = {'msg_id': len(self.engine.chatlog) + 1, 'sender': 'User', 'content': draft}
+		response = self.engine.start_response(draft=msg_info)
+
+		cost = count_tokens(self.config['true_model'], response['messages'])
+		if self.speculation_tokens + cost > self.config['speculate_max_tokens']:
+			return # Its spans were never measured, so they are dropped unfinished
+		self.speculation_tokens += cost
+		request_id = self.worker.submit_stream(self.engine.generate, response)
+		self.speculation = {'request': request_id, 'response': response, 'draft': draft, 'msg_id': msg_info['msg_id'], 'events': []}
+
+	def adopt_speculation(self, msg_info):
+		"""
+		Takes over the speculative request as the response to a sent message if it was made for the same text
+		:param msg_info: The message that was just sent
+		:return: Whether the speculative request was taken over, otherwise it is cancelled
+		"""
+		speculation = self.speculation
+		if speculation is None:
+			return False
+		if (speculation['draft'] != msg_info['content'] or speculation['msg_id'] != msg_info['msg_id']
+				or any(status in ('error', 'cancelled') for status, _ in speculation['events'])):
+			self.cancel_speculation()
+			return False
+
+		self.speculation = None
+		self.engine.take_response(speculation['response'])
+		self.pending_request, self.pending_response = speculation['request'], speculation['response']
+		self.stream_msg = None
+		self.handle_events(speculation['events']) # Draw whatever arrived while the user was typing
+		return True
+
+	def cancel_speculation(self):
+		"""
+		Cancels the speculative request, if any
+		"""
+		speculation, self.speculation = self.speculation, None
+		if speculation is not None:
+			self.worker.cancel(speculation['request'])
+			self.engine.finish_response(speculation['response'], 'discarded')
+
+	def poll_responses(self):
+		"""
+		Checks the background worker for streamed chunks and finished model calls and draws them, then reschedules itself.
+		All chunks that arrived since the last check are drawn in a single update.
+		"""
+		events = []
+		for request_id, status, result in self.worker.poll():
+			if self.speculation and request_id == self.speculation['request']:
+				self.speculation['events'].append((status, result)) # Held until the draft is sent
+			elif request_id == self.pending_request:
+				events.append((status, result))
+		self.handle_events(events)
+		self.root.after(self.poll_interval, self.poll_responses)
+
+	def handle_events(self, events):
+		"""
+		Draws the streamed chunks and the outcome of the model call in flight
+		:param events: (status, result) pairs reported by the worker for the call, in order
+		"""
+		chunks = []
+		for status, result in events:
+			if status == 'chunk':
+				chunks.append(result)
+				continue
+			self.pending_request = None
+			if chunks:
+				self.show_chunks("".join(chunks))
+				chunks = []
+			if status == 'error':
+				print(f"Error getting a response: {result}")
+			response, self.pending_response = self.pending_response, None
+			rsp_info = self.engine.finish_response(response, status)
+			if rsp_info is None:
+				print("There was an error getting a response.")
+			self.show_response(rsp_info)
+		if chunks:
+			self.show_chunks("".join(chunks))
+
+	def show_chunks(self, text):
+		"""
+		Appends streamed response text to the bot message, creating the message on the first chunk
+		:param text: The text received since the last update
+		"""
+		if self.stream_msg is None:
+			self.view.hide_dots()
+			self.stream_msg = {'msg_id': len(self.engine.chatlog) + 1, 'sender': 'Bot', 'content': text}
+			self.update_window(self.stream_msg)
 		else:
-			print("There was an error getting a response.")
+			self.append_to_message(self.stream_msg, text)
+
+	def show_response(self, rsp_info):
+		"""
+		Draws a model response the engine added to the chat log, or brings the streamed message up to date with it
+		:param rsp_info: The chatlog entry of the response, or None if the model did not respond
+		"""
+		# Remove thinking dots
+		self.view.hide_dots()
+
+		stream_msg, self.stream_msg = self.stream_msg, None
+		if rsp_info is None:
+			return
+		if stream_msg is None:
+			self.update_window(rsp_info)
+		elif stream_msg['content'] != rsp_info['content']: # Chunks that arrived after the last poll of a cancelled response
+			stream_msg['content'] = rsp_info['content']
+			self.view.update_message(rsp_info['msg_id'])
+
+	def cancel_response(self):
+		"""
+		Cancels the model call currently in flight, if any, and removes the thinking dots. The part of a
+		streamed response already generated is kept and saved, marked as cancelled. A speculative request for
+		the draft is dropped too, the chat it was made for is changing.
+		"""
+		self.cancel_speculation()
+		if self.pending_request is not None:
+			self.worker.cancel(self.pending_request)
+			self.pending_request = None
+			response, self.pending_response = self.pending_response, None
+			self.show_response(self.engine.finish_response(response, 'cancelled'))
 
 	def update_window(self, msg_info):
 		"""
-		Updates the chat log with the current message and draws it to the screen
+		Draws the current message to the screen and scrolls to it
 		:param msg_info: Dictionary containing message id, sender, and content
 		"""
-		msg = msg_info['content']
-		send = msg_info['sender']
-		# Determine color and alignment based on the sender
-		if send == "User":
-			if self.root.tk.call("ttk::style", "theme", "use") == "azure-dark":
-				bg_color = colors.get("user_msg_bg_dark")
-				text_color = colors.get("user_msg_text_dark")
-			else:
-				bg_color = colors.get("user_msg_bg_light")
-				text_color = colors.get("user_msg_text_light")
-			icon = self.user_icon
-			anchor = 'e'
-			side = 'right'
-			padx_right = 10
-			padx_left = max(100, 250 - len(msg)*7)  # Dynamic left padding based on message length
-		else:
-			if self.root.tk.call("ttk::style", "theme", "use") == "azure-dark":
-				bg_color = colors.get("bot_msg_bg_dark")
-				text_color = colors.get("user_msg_text_dark")
-			else:	
-				bg_color = colors.get("bot_msg_bg_light")
-				text_color = colors.get("user_msg_text_light")
-			icon = self.bot_icon
-			anchor = 'w'
-			side = 'left'
-			padx_left = 10
-			padx_right = max(100, 250 - len(msg)*7)  # Dynamic right padding based on message length
-
-		# Create a frame to contain the message label and pack it to the correct side
-		frame = ttk.Frame(self.scrollable_window)
-		frame.pack(fill='x', expand=True, pady=0)
-
-		# Add icons for the message to indicate who is speaking
-		icon_label = tk.Label(frame, image=icon)
-		icon_label.pack(side=side, anchor='n', padx=(padx_left if send == "Bot" else 0, padx_right if send == "User" else 0))
-
-		# If the sender is a user, add a button to edit the message
-		if send == "User":
-			edit_btn = tk.Button(frame, image=self.edit_icon, bg=colors.get("edit_button_bg"), command=lambda msg_id=msg_info['msg_id']: self.edit_message(msg_id))
-			edit_btn.pack(side='bottom', anchor='se', padx=(0, padx_right))
-
-		# Create a label inside the frame that contains the message contents
-		msg_label = tk.Label(frame, text=msg, bg=bg_color, fg=text_color, font=('Arial', 14), justify='left', wraplength=500)
-		msg_label.pack(side=side, anchor=anchor, padx=(padx_left, padx_right))
-
-		# Update the dictionary of widgets with the important information based on sender
-		if send == "User":
-			self.msg_widgets[msg_info['msg_id']] = {'frame': frame, 'label': msg_label, 'info': msg_info, 'edit': edit_btn, 'padxr': padx_right, 'padxl': padx_left}
-		else:
-			self.msg_widgets[msg_info['msg_id']] = {'frame': frame, 'label': msg_label, 'info': msg_info}
+		self.view.append(msg_info)
 
 		# Scroll to the bottom of the chat window as new messages are added
-		self.canvas.update_idletasks()
-		self.canvas.yview_moveto(1)
+		self.view.scroll_to_end()
 
-	def delete_messages(self, msg_id):
+	def append_to_message(self, msg_info, text):
 		"""
-		Removes all message from chat log and screen from a specified message
-		:param msg_id: Id number of message to be deleted along with subsequent messages
+		Appends text to a message already drawn on the screen
+		:param msg_info: The drawn message to extend
+		:param text: Text to add to the end of the message
 		"""
-		# Remove messages from UI and chatlog
-		ids = [id for id in self.msg_widgets if id >= msg_id]
-		for id in ids:
-			widget = self.msg_widgets[id]
-			widget['frame'].destroy()  # Remove the frame from UI
-			del self.msg_widgets[id]  # Remove from widget storage
-			self.chatlog = [msg for msg in self.chatlog if msg['msg_id'] < msg_id]  # Trim the chat log
+		msg_info['content'] += text
+		self.view.update_message(msg_info['msg_id'])
+
+		# Keep the newest text in view
+		self.view.scroll_to_end()
 
-	def backup_chatlog(self):
+	def archive_chat(self):
 		"""
-		Backs up the current chat log so that edits can be saved
+		Indexes the current chat in the archive, only messages not archived yet are added. Empty chats are not archived,
+		they would hide older chats with the same id from --resume
 		"""
-		chat_id = len(self.conversations) + 1
-		self.conversations[chat_id] = {'chat_id': chat_id, 'chatlog': self.chatlog}
+		if not self.engine.chatlog:
+			return
+		self.archive.add_chat(self.engine.session, self.engine.chat_id, self.engine.chatlog, self.config['given_model'], self.config['true_model'])
 
-	def concat_conversation(self):
+	def switch_branch(self, msg_id, step):
 		"""
-		Concatenates all chat log entry contents in a single model prompt
+		Shows another version of a message, along with the chat that continues from it
+		:param msg_id: Id number of the message
+		:param step: -1 for the previous version, 1 for the next
 		"""
-		conv = ""
-		for msg in self.chatlog:
-			#prefix = "User: " if msg['sender'] == 'User' else "Model:"
-			conv += f"{msg['content']}\n"
-		return conv.strip()
-
-	def update_scrollregion(self, event=None):
+		if self.engine.branch_position(msg_id) is None: # The message was never edited
+			return
+		self.cancel_response()
+		self.archive_chat()
+		self.engine.switch_branch(msg_id, step)
+		self.view.set_messages(self.engine.chatlog)
+
+	def open_chat(self, chat):
 		"""
-		Updates the scroll region of the canvas based on the bounding box of all items.
+		Replaces the current chat with an archived one, archiving the current chat first
+		:param chat: Dictionary with the session, chat id and chat log of the archived chat
 		"""
-		self.canvas.configure(scrollregion=self.canvas.bbox("all"))
+		self.cancel_response()
+		self.archive_chat()
+		self.engine.restore_chat(chat)
 
+		# Only the most recent messages are drawn now, older ones as the user scrolls up
+		self.view.set_messages(self.engine.chatlog)
 
-	def resize_canvas(self, event):
+	def pick_session(self):
 		"""
-		Adjusts the width of the scrollable window to match the canvas's width.
+		Opens a window listing archived chats, the selected chat is reopened in place of the current one
 		"""
-		self.canvas.itemconfig(self.canvas_window, width=event.width)
-		 
+		picker = tk.Toplevel(self.root)
+		picker.title("Open chat")
+		chats = self.archive.find_chats(limit=200)
+
+		# Only the given model is listed so the true model stays hidden
+		tree = ttk.Treeview(picker, columns=('saved', 'chat', 'model'), show='headings', height=15)
+		tree.heading('saved', text='Saved')
+		tree.heading('chat', text='Chat')
+		tree.heading('model', text='Model')
+		for index, chat in enumerate(chats):
+			saved = time.strftime('%Y-%m-%d %H:%M', time.localtime(chat['created']))
+			tree.insert('', 'end', iid=str(index), values=(saved, chat['chat_id'], chat['given_model'] or ''))
+		tree.pack(fill='both', expand=True, padx=10, pady=10)
+
+		# Function to open the selected chat
+		def on_open(event=None):
+			selection = tree.selection()
+			if selection:
+				chat = chats[int(selection[0])]
+				self.open_chat(self.archive.get_chat(chat['chat_id'], chat['session'])[0])
+				picker.destroy()
+
+		ttk.Button(picker, text="Open", style="Accent.TButton", command=on_open).pack(pady=(0, 10))
+		tree.bind('<Double-1>', on_open)
 
 	def on_mousewheel(self, event):
 		"""
@@ -330,32 +504,36 @@ class ChatApp:
 		"""
 		Changes the imported theme and custom elements between dark and light mode
 		"""
-		if self.root.tk.call("ttk::style", "theme", "use") == "azure-dark":
-			self.root.tk.call("set_theme", "light")
-			ids = [id for id in self.msg_widgets]
-			for id in ids:
-				widget = self.msg_widgets[id]
-				if widget['info']['sender'] == "User":
-					widget['label'].config(bg=colors.get("user_msg_bg_light"), fg=colors.get("user_msg_text_light"))
-				else:
-					widget['label'].config(bg=colors.get("bot_msg_bg_light"), fg=colors.get("user_msg_text_light"))
-		else:
-			self.root.tk.call("set_theme", "dark")
-			ids = [id for id in self.msg_widgets]
-			for id in ids:
-				widget = self.msg_widgets[id]
-				if widget['info']['sender'] == "User":
-					widget['label'].config(bg=colors.get("user_msg_bg_dark"), fg=colors.get("user_msg_text_dark"))
-				else:
-					widget['label'].config(bg=colors.get("bot_msg_bg_dark"), fg=colors.get("user_msg_text_dark"))
+		self.set_theme("light" if self.theme == "dark" else "dark")
+
+		# Messages are recolored through their shared styles, however many there are
+		self.view.set_theme(self.theme == "dark")
 
 
+	def set_theme(self, mode):
+		"""
+		Switches to the dark or light Azure theme, the theme script is only sourced on first use and
+		each mode's images are only decoded the first time the mode is used
+		:param mode: 'dark' or 'light'
+		"""
+		if not self.root.tk.call("info", "procs", "set_theme"):
+			self.root.tk.call("source", "Azure-ttk-theme-main/azure.tcl")
+		self.root.tk.call("set_theme", mode)
+		self.theme = mode
+
 	def on_close(self):
 		"""
-		Handles saving the chat log history to a json file on close of the program
+		Handles closing the conversation store on close of the program, messages are already saved as they are sent.
+		The call in flight is cancelled first, so its spans are finished and a partly streamed response is saved.
 		"""
-		self.backup_chatlog()
-		save_json_data(self.conversations, "Conversations.json")
+		self.cancel_response()
+		self.worker.shutdown()
+		if self.cache:
+			self.cache.close()
+		self.metrics.close()
+		self.archive_chat()
+		self.engine.close()
+		self.archive.close()
 		self.root.destroy()
 
 
@@ -365,17 +543,40 @@ def main():
 	config = {
 		'given_model': args.given_model,
 		'true_model': model_name_mapping.get(args.true_model, "Invalid model."),
-		'openai': openaiHandler(api_key=args.openai_key),
-		'anyscale': anyscaleHandler(api_key=args.anyscale_key),
-		'anthropic': anthropicHandler(api_key=args.anthropic_key)
+		'stream': not args.no_stream,
+		'system_prompt': args.system_prompt,
+		'context_strategy': args.context_strategy,
+		'keep_first': args.keep_first,
+		'keep_last': args.keep_last,
+		'store_path': args.store_path,
+		'archive_path': args.archive_path,
+		'resume': args.resume,
+		'fan_out': [model_name_mapping[model] for model in args.fan_out or []],
+		'fan_out_timeout': args.fan_out_timeout,
+		'resume_session': args.resume_session,
+		'cache': args.cache,
+		'cache_path': args.cache_path,
+		'cache_ttl': args.cache_ttl,
+		'cache_max_entries': args.cache_max_entries,
+		'metrics_path': args.metrics_path or None,
+		'metrics_port': args.metrics_port,
+		'speculate': args.speculate,
+		'speculate_debounce': args.speculate_debounce,
+		'speculate_min_chars': args.speculate_min_chars,
+		'speculate_max_tokens': args.speculate_max_tokens,
+		'icon_cache': args.icon_cache,
+		'renderer': args.renderer,
+		'providers': providerRegistry({
+			'openai': {'api_key': args.openai_key},
+			'anyscale': {'api_key': args.anyscale_key},
+			'anthropic': {'api_key': args.anthropic_key, 'prompt_caching': not args.no_prompt_cache}
+		})
 	}
 
 	# Initialize Tkinter window
 	root = tk.Tk()
 	root.geometry('1200x900')
 	#root.geometry('800x600')
-	root.tk.call("source", "Azure-ttk-theme-main/azure.tcl")
-	root.tk.call("set_theme", "dark")
 	app = ChatApp(root, config)
 	root.mainloop()
 
@@ -0,0 +1,47 @@
+import asyncio
+from typing import Protocol, AsyncIterator, Callable, List, Dict, Any, runtime_checkable
+
+@runtime_checkable
+class ChatProvider(Protocol):
+	"""
+	Common asyncio interface implemented by every model handler
+	"""
+	async def chat(self, messages: List[Dict[str, str]], model: str) -> str:
+		"""
+		Get a full response from a model
+
+		:param messages: Role-tagged messages starting with the system prompt, built by promptBuilder.
+		:param model: The proper LLM name.
+		:return: The response from the model.
+		"""
+		...
+
+	def chat_stream(self, messages: List[Dict[str, str]], model: str) -> AsyncIterator[str]:
+		"""
+		Stream a response from a model
+
+		:param messages: Role-tagged messages starting with the system prompt, built by promptBuilder.
+		:param model: The proper LLM name.
+		:return: An async generator yielding text deltas as they are generated.
+		"""
+		...
+
+async def fan_out(registry, models: List[str], messages: List[Dict[str, str]], timeout: float = 60.0,
+		measure: Callable[[str, Callable], Callable] = None) -> Dict[str, Any]:
+	"""
+	Send the same conversation to several models concurrently
+
+	:param registry: providerRegistry used to look up the provider of each model.
+	:param models: Proper LLM names to ask.
+	:param messages: Role-tagged messages starting with the system prompt, built by promptBuilder.
+	:param timeout: Seconds each model has to respond.
+	:param measure: Optional function taking a model and its chat coroutine function and returning it wrapped, e.g. to time each call.
+	:return: Dictionary mapping each model to its response, or to the exception it raised.
+	"""
+	async def ask(model):
+		provider = await asyncio.to_thread(registry.provider, model) # First use imports the SDK
+		chat = measure(model, provider.chat) if measure else provider.chat
+		return await asyncio.wait_for(chat(messages, model), timeout)
+
+	results = await asyncio.gather(*(ask(model) for model in models), return_exceptions=True)
+	return dict(zip(models, results))
@@ -0,0 +1,185 @@
+import os
+import json
+import gzip
+import argparse
+from typing import List, Dict, Any, Iterable, Iterator
+
+from IOFunctions import load_json_data, save_json_data
+
+# Fixed-width last record holding where the index starts, so it can be found by seeking from the end
+TRAILER_FORMAT = '{{"index_offset": {:20d}}}\n'
+
+def compress_record(record: Dict[str, Any], level: int = 6) -> bytes:
+	"""
+	Compress one record as its own gzip member. Concatenated members form a valid gzip file,
+	and each member can also be decompressed on its own.
+
+	:param record: JSON-serializable record.
+	:param level: gzip compression level.
+	:return: The gzip member holding the record as a JSON line.
+	"""
+	line = json.dumps(record, ensure_ascii=False, separators=(',', ':')) + "\n"
+	return gzip.compress(line.encode('utf-8'), compresslevel=level, mtime=0)
+
+def trailer(index_offset: int) -> bytes:
+	"""
+	Build the trailer member, stored uncompressed so its size never changes
+
+	:param index_offset: Byte offset of the index member.
+	:return: The trailer gzip member.
+	"""
+	return gzip.compress(TRAILER_FORMAT.format(index_offset).encode('utf-8'), compresslevel=0, mtime=0)
+
+TRAILER_SIZE = len(trailer(0))
+
+def save_compact_data(conversations: Iterable[Dict[str, Any]], file_path: str, level: int = 6):
+	"""
+	Save conversations in the compact archive format: gzip-compressed JSON lines, one gzip member per
+	conversation, followed by an index of each conversation's byte range and a trailer pointing at the
+	index. The file decompresses with any gzip tool into JSON lines. Conversations are written as they
+	are iterated, and the new file replaces the old one atomically.
+
+	:param conversations: Chats in the chat_id/chatlog schema of Conversations.json.
+	:param file_path: Path to the archive file.
+	:param level: gzip compression level.
+	"""
+	tmp_path = file_path + ".tmp"
+	index = {}
+	try:
+		with open(tmp_path, 'wb') as file:
+			for chat in conversations:
+				member = compress_record(chat, level)
+				index[str(chat['chat_id'])] = [file.tell(), len(member)]
+				file.write(member)
+			index_offset = file.tell()
+			file.write(compress_record({'index': index}, level))
+			file.write(trailer(index_offset))
+			file.flush()
+			os.fsync(file.fileno())
+		os.replace(tmp_path, file_path)
+	except Exception as e:
+		print(f"Error saving compact archive: {e}")
+
+def iter_compact_data(file_path: str) -> Iterator[Dict[str, Any]]:
+	"""
+	Stream the conversations of a compact archive one at a time, without using the index. Also reads
+	archives whose index was never written.
+
+	:param file_path: Path to the archive file.
+	:return: Iterator of chats in the chat_id/chatlog schema of Conversations.json.
+	"""
+	try:
+		with gzip.open(file_path, 'rt', encoding='utf-8') as file:
+			for line in file:
+				try:
+					record = json.loads(line)
+				except json.JSONDecodeError:
+					continue # A torn final record
+				if 'chat_id' in record:
+					yield record
+	except (EOFError, gzip.BadGzipFile) as e:
+		print(f"Compact archive {file_path} ends early: {e}")
+
+class compactArchive:
+	def __init__(self, file_path: str):
+		"""
+		Open a compact archive for random access by chat id, reading only its index
+
+		:param file_path: Path to the archive file.
+		"""
+		self.file = open(file_path, 'rb')
+		self.file.seek(0, os.SEEK_END)
+		end = self.file.tell() - TRAILER_SIZE
+		self.file.seek(end)
+		index_offset = json.loads(gzip.decompress(self.file.read(TRAILER_SIZE)))['index_offset']
+		self.file.seek(index_offset)
+		index = json.loads(gzip.decompress(self.file.read(end - index_offset)))['index']
+		self.index = {int(chat_id): tuple(span) for chat_id, span in index.items()} # Chat id -> (byte offset, size)
+
+	def chat_ids(self) -> List[int]:
+		"""
+		Get the ids of the archived chats
+
+		:return: Chat ids in the order they were written.
+		"""
+		return list(self.index)
+
+	def get_chat(self, chat_id: int) -> Dict[str, Any]:
+		"""
+		Read a single chat, decompressing only its own record
+
+		:param chat_id: Id of the chat.
+		:return: The chat in the chat_id/chatlog schema of Conversations.json, or None if it is not archived.
+		"""
+		span = self.index.get(chat_id)
+		if span is None:
+			return None
+		self.file.seek(span[0])
+		return json.loads(gzip.decompress(self.file.read(span[1])))
+
+	def close(self):
+		"""
+		Close the archive file
+		"""
+		self.file.close()
+
+def json_to_compact(json_path: str, file_path: str, level: int = 6) -> int:
+	"""
+	Convert a Conversations.json file to the compact archive format
+
+	:param json_path: Path to the JSON file.
+	:param file_path: Path to the archive file.
+	:param level: gzip compression level.
+	:return: Number of chats converted.
+	"""
+	data = load_json_data(json_path)
+	chats = list(data.values() if isinstance(data, dict) else data)
+	save_compact_data(chats, file_path, level)
+	return len(chats)
+
+def compact_to_json(file_path: str, json_path: str) -> int:
+	"""
+	Convert a compact archive back to a Conversations.json file, keyed by chat id like the original
+
+	:param file_path: Path to the archive file.
+	:param json_path: Path to the JSON file.
+	:return: Number of chats converted.
+	"""
+	chats = {str(chat['chat_id']): chat for chat in iter_compact_data(file_path)}
+	save_json_data(chats, json_path)
+	return len(chats)
+
+def main():
+	parser = argparse.ArgumentParser(description="Convert conversations between Conversations.json and the compact archive format.")
+	commands = parser.add_subparsers(dest='command', required=True)
+	pack_cmd = commands.add_parser('pack', help='Convert a Conversations.json file to a compact archive')
+	pack_cmd.add_argument('json_path')
+	pack_cmd.add_argument('archive_path')
+	pack_cmd.add_argument('--level', type=int, default=6,
+						help='gzip compression level')
+	unpack_cmd = commands.add_parser('unpack', help='Convert a compact archive to a Conversations.json file')
+	unpack_cmd.add_argument('archive_path')
+	unpack_cmd.add_argument('json_path')
+	show_cmd = commands.add_parser('show', help='Print a single chat of a compact archive')
+	show_cmd.add_argument('archive_path')
+	show_cmd.add_argument('chat_id', type=int)
+	args = parser.parse_args()
+
+	if args.command == 'pack':
+		count = json_to_compact(args.json_path, args.archive_path, args.level)
+		print(f"Packed {count} chats into {args.archive_path} "
+			f"({os.path.getsize(args.archive_path)} bytes, from {os.path.getsize(args.json_path)})")
+	elif args.command == 'unpack':
+		print(f"Unpacked {compact_to_json(args.archive_path, args.json_path)} chats into {args.json_path}")
+	else:
+		archive = compactArchive(args.archive_path)
+		chat = archive.get_chat(args.chat_id)
+		archive.close()
+		if chat is None:
+			print(f"There is no chat with id {args.chat_id} in {args.archive_path}.")
+		else:
+			for msg in chat['chatlog']:
+				print(f"  {msg['msg_id']} {msg['sender']}: {msg['content']}")
+
+if __name__ == "__main__":
+	main()
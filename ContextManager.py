@@ -0,0 +1,207 @@
+import math
+import hashlib
+from functools import lru_cache
+from typing import List, Dict, Any, Callable, Optional
+
+from PromptBuilder import to_messages, split_system
+
+try:
+	import tiktoken
+except ImportError:
+	tiktoken = None
+
+# Rough characters per token for each model family, used when no tokenizer is installed
+chars_per_token = {
+	'gpt': 4.0,
+	'llama': 3.8,
+	'claude': 3.5
+}
+
+# Tokens added by the provider around every message
+msg_overhead = 4
+
+SUMMARY_PROMPT = "Summarize the following conversation in a few sentences. Keep every fact the user stated about themselves.\n\n"
+
+@lru_cache(maxsize=8)
+def get_encoding(model: str):
+	"""
+	Get the tiktoken encoding for an OpenAI model
+
+	:param model: The true model name.
+	:return: A tiktoken encoding, or None if the model is unknown to tiktoken.
+	"""
+	try:
+		return tiktoken.encoding_for_model(model)
+	except KeyError:
+		return None
+
+@lru_cache(maxsize=65536)
+def estimate_tokens(model: str, text: str) -> int:
+	"""
+	Estimate the number of tokens a message costs for a model. Results are cached per model and text.
+
+	:param model: The true model name.
+	:param text: The message content.
+	:return: The estimated token count including per-message overhead.
+	"""
+	encoding = get_encoding(model) if tiktoken and model.startswith('gpt') else None
+	if encoding is not None:
+		return len(encoding.encode(text)) + msg_overhead
+	ratio = next((r for family, r in chars_per_token.items() if family in model.lower()), 4.0)
+	return math.ceil(len(text) / ratio) + msg_overhead
+
+def count_tokens(model: str, messages: List[Dict[str, str]]) -> int:
+	"""
+	Estimate the number of tokens a list of role-tagged messages costs for a model
+
+	:param model: The true model name.
+	:param messages: Messages built by promptBuilder.
+	:return: The estimated token count.
+	"""
+	return sum(estimate_tokens(model, msg['content']) for msg in messages)
+
+class contextManager:
+	def __init__(self, model: str, budget: int, strategy: str = 'sliding', keep_first: int = 2, keep_last: int = 20,
+			summarizer: Optional[Callable[[str], str]] = None, window_fill: float = 0.75):
+		"""
+		Initialize a context manager that keeps the prompt for a model within its token budget
+
+		:param model: The true model name, used to pick the token estimator.
+		:param budget: Maximum number of prompt tokens to send.
+		:param strategy: One of 'sliding', 'first_last' or 'summary'.
+		:param keep_first: Number of opening messages kept by the 'first_last' strategy.
+		:param keep_last: Maximum number of recent messages kept by the 'first_last' strategy.
+		:param summarizer: Function turning a transcript into a summary, required by the 'summary' strategy.
+		:param window_fill: Fraction of the budget the 'sliding' strategy fills when it moves its window, leaving room for later turns.
+		"""
+		if strategy == 'summary' and summarizer is None:
+			raise ValueError("The summary strategy needs a summarizer.")
+		self.model = model
+		self.budget = budget
+		self.strategy = strategy
+		self.keep_first = keep_first
+		self.keep_last = keep_last
+		self.summarizer = summarizer
+		self.summaries = {} # Hash of summarized text -> summary
+		self.summary = None # (msg_id of the last summarized message, summary text) used by the current chat
+		self.window_fill = window_fill
+		self.window_start = None # msg_id of the first message kept by the 'sliding' strategy
+
+	def count(self, msg: Dict[str, Any]) -> int:
+		"""
+		Count the tokens of a single chatlog entry
+
+		:param msg: Chatlog entry containing message id, sender, and content.
+		:return: The estimated token count.
+		"""
+		return estimate_tokens(self.model, msg['content'])
+
+	def fit(self, chatlog: List[Dict[str, Any]], messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+		"""
+		Fit the conversation into the token budget using the selected strategy
+
+		:param chatlog: The chat log the messages were built from.
+		:param messages: The full message list built from the chat log, starting with the system prompt.
+		:return: The messages unchanged if they fit, otherwise messages built from the kept chatlog entries.
+		"""
+		if self.summary is None and sum(self.count(msg) for msg in chatlog) <= self.budget:
+			return messages
+
+		if self.strategy == 'first_last':
+			kept = self.first_last(chatlog)
+		elif self.strategy == 'summary':
+			kept = self.summarize(chatlog)
+		else:
+			kept = self.stable_window(chatlog)
+
+		# The summary extends the system prompt, so user and assistant turns still alternate
+		system, _ = split_system(messages)
+		if kept and kept[0]['sender'] == 'Summary':
+			system = kept[0]['content'] if system is None else system + "\n\n" + kept[0]['content']
+			kept = kept[1:]
+		return to_messages(kept, system)
+
+	def sliding(self, chatlog: List[Dict[str, Any]], budget: int) -> List[Dict[str, Any]]:
+		"""
+		Keep the most recent messages that fit in the budget. The newest message is always kept.
+
+		:param chatlog: Messages to choose from.
+		:param budget: Number of tokens available.
+		:return: The kept messages in chatlog order.
+		"""
+		used = 0
+		start = len(chatlog)
+		while start > 0:
+			used += self.count(chatlog[start - 1])
+			if used > budget and start < len(chatlog):
+				break
+			start -= 1
+		return chatlog[start:]
+
+	def stable_window(self, chatlog: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+		"""
+		Keep the most recent messages that fit in the budget, starting from the same message as last time
+		for as long as the messages from there on still fit. The start of the prompt then only moves every
+		few turns, so provider prompt caches keep matching it in between.
+
+		:param chatlog: Messages to choose from.
+		:return: The kept messages in chatlog order.
+		"""
+		if self.window_start is not None:
+			start = next((index for index, msg in enumerate(chatlog) if msg['msg_id'] >= self.window_start), len(chatlog))
+			kept = chatlog[start:]
+			if kept and sum(self.count(msg) for msg in kept) <= self.budget:
+				return kept
+		kept = self.sliding(chatlog, int(self.budget * self.window_fill))
+		self.window_start = kept[0]['msg_id'] if kept else None
+		return kept
+
+	def first_last(self, chatlog: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+		"""
+		Keep the first N messages and up to the last M messages that still fit in the budget
+
+		:param chatlog: Messages to choose from.
+		:return: The kept messages in chatlog order.
+		"""
+		first = chatlog[:self.keep_first]
+		rest = chatlog[self.keep_first:][-self.keep_last:]
+		return first + self.sliding(rest, self.budget - sum(self.count(msg) for msg in first))
+
+	def summarize(self, chatlog: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+		"""
+		Replace older turns with a summary. The summary is only regenerated once the remaining turns
+		outgrow the budget, and then covers enough turns to free half of it.
+
+		:param chatlog: Messages to choose from.
+		:return: The summary message followed by the recent messages.
+		"""
+		upto, text = self.summary if self.summary else (0, "")
+		recent = [msg for msg in chatlog if msg['msg_id'] > upto]
+		summary_tokens = estimate_tokens(self.model, text) if text else 0
+
+		if summary_tokens + sum(self.count(msg) for msg in recent) > self.budget:
+			kept = self.sliding(recent, self.budget // 2)
+			dropped = recent[:len(recent) - len(kept)]
+			if dropped:
+				transcript = "\n".join([text] + [msg['content'] for msg in dropped]).strip()
+				key = hashlib.sha256(transcript.encode('utf-8')).hexdigest()
+				if key not in self.summaries:
+					self.summaries[key] = self.summarizer(SUMMARY_PROMPT + transcript)
+				upto, text = dropped[-1]['msg_id'], self.summaries[key]
+				self.summary = (upto, text)
+				recent = kept
+
+		if not text:
+			return recent
+		return [{'msg_id': 0, 'sender': 'Summary', 'content': f"Summary of the earlier conversation: {text}"}] + recent
+
+	def truncate(self, msg_id: int):
+		"""
+		Forget the current summary and window start if they depend on messages that are being deleted
+
+		:param msg_id: Id number of the first deleted message.
+		"""
+		if self.summary and self.summary[0] >= msg_id:
+			self.summary = None
+		if self.window_start is not None and self.window_start >= msg_id:
+			self.window_start = None
@@ -0,0 +1,212 @@
+import os
+import time
+import sqlite3
+import argparse
+from typing import List, Dict, Any
+
+from IOFunctions import load_json_data, iter_sessions
+from CompactArchive import iter_compact_data
+
+# Condition on the chats table, empty chats archived by earlier versions are left out of listings
+HAS_MESSAGES = "EXISTS (SELECT 1 FROM messages WHERE messages.session = chats.session AND messages.chat_id = chats.chat_id)"
+
+class conversationArchive:
+	def __init__(self, path: str):
+		"""
+		Open an indexed conversation archive backed by SQLite, with full-text search over message
+		content when the SQLite build has FTS5
+
+		:param path: Path to the SQLite database file, created if missing.
+		"""
+		self.conn = sqlite3.connect(path)
+		self.conn.row_factory = sqlite3.Row
+		self.conn.executescript("""
+			PRAGMA journal_mode=WAL;
+			CREATE TABLE IF NOT EXISTS chats (
+				session TEXT NOT NULL,
+				chat_id INTEGER NOT NULL,
+				given_model TEXT,
+				true_model TEXT,
+				created REAL NOT NULL,
+				PRIMARY KEY (session, chat_id)
+			);
+			CREATE INDEX IF NOT EXISTS chats_created ON chats (created);
+			CREATE INDEX IF NOT EXISTS chats_chat_id ON chats (chat_id);
+			CREATE TABLE IF NOT EXISTS messages (
+				id INTEGER PRIMARY KEY,
+				session TEXT NOT NULL,
+				chat_id INTEGER NOT NULL,
+				msg_id INTEGER NOT NULL,
+				sender TEXT NOT NULL,
+				content TEXT NOT NULL,
+				UNIQUE (session, chat_id, msg_id)
+			);
+		""")
+		try:
+			self.conn.executescript("""
+				CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(content, content='messages', content_rowid='id');
+				CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN
+					INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+				END;
+				CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN
+					INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+				END;
+			""")
+			self.fts = True
+		except sqlite3.OperationalError:
+			self.fts = False # Fall back to LIKE queries
+		self.conn.commit()
+
+	def add_chat(self, session: str, chat_id: int, chatlog: List[Dict[str, Any]], given_model: str = None,
+			true_model: str = None, created: float = None):
+		"""
+		Add a chat to the archive. Messages already archived for the chat are left as they are,
+		so re-adding a chat only indexes its new messages. Empty chats are not added.
+
+		:param session: Id of the session the chat belongs to.
+		:param chat_id: Id of the chat within its session.
+		:param chatlog: List of dictionaries containing message id, sender, and content.
+		:param given_model: Model name shown to the user.
+		:param true_model: Model that generated the responses.
+		:param created: Time the chat was saved, defaults to now.
+		"""
+		if not chatlog:
+			return
+		with self.conn:
+			self.conn.execute("INSERT OR IGNORE INTO chats VALUES (?, ?, ?, ?, ?)",
+				(session, chat_id, given_model, true_model, created or time.time()))
+			self.conn.executemany("INSERT OR IGNORE INTO messages (session, chat_id, msg_id, sender, content) VALUES (?, ?, ?, ?, ?)",
+				[(session, chat_id, msg['msg_id'], msg['sender'], msg['content']) for msg in chatlog])
+
+	def get_chat(self, chat_id: int, session: str = None) -> List[Dict[str, Any]]:
+		"""
+		Look up chats by id
+
+		:param chat_id: Id of the chat.
+		:param session: Restrict the lookup to a single session.
+		:return: List of chats in the same chat_id/chatlog schema as Conversations.json, with their session, newest first.
+			Without a session, chats that have no messages are skipped.
+		"""
+		if session is None:
+			sessions = [row['session'] for row in self.conn.execute("SELECT session FROM chats WHERE chat_id = ? AND " + HAS_MESSAGES
+				+ " ORDER BY created DESC", (chat_id,))]
+		else:
+			sessions = [session]
+		chats = []
+		for session in sessions:
+			rows = self.conn.execute("SELECT msg_id, sender, content FROM messages WHERE session = ? AND chat_id = ? ORDER BY msg_id",
+				(session, chat_id))
+			chats.append({'session': session, 'chat_id': chat_id, 'chatlog': [dict(row) for row in rows]})
+		return chats
+
+	def find_chats(self, since: float = None, until: float = None, model: str = None, limit: int = -1) -> List[Dict[str, Any]]:
+		"""
+		List archived chats by time range and model
+
+		:param since: Only chats saved at or after this time.
+		:param until: Only chats saved before this time.
+		:param model: Only chats whose given or true model matches.
+		:param limit: Maximum number of chats, -1 for all.
+		:return: List of chat summaries, newest first. Chats that have no messages are skipped.
+		"""
+		query = "SELECT * FROM chats WHERE " + HAS_MESSAGES
+		params = []
+		if since is not None:
+			query += " AND created >= ?"
+			params.append(since)
+		if until is not None:
+			query += " AND created < ?"
+			params.append(until)
+		if model is not None:
+			query += " AND (given_model = ? OR true_model = ?)"
+			params += [model, model]
+		return [dict(row) for row in self.conn.execute(query + " ORDER BY created DESC LIMIT ?", params + [limit])]
+
+	def search(self, text: str, limit: int = 20) -> List[Dict[str, Any]]:
+		"""
+		Full-text search over message content
+
+		:param text: Search query, FTS5 syntax when available.
+		:param limit: Maximum number of matching messages.
+		:return: List of matching messages with their session and chat id, best matches first.
+		"""
+		if self.fts:
+			rows = self.conn.execute("""
+				SELECT m.session, m.chat_id, m.msg_id, m.sender, m.content FROM messages_fts f
+				JOIN messages m ON m.id = f.rowid WHERE messages_fts MATCH ? ORDER BY rank LIMIT ?""", (text, limit))
+		else:
+			rows = self.conn.execute("SELECT session, chat_id, msg_id, sender, content FROM messages WHERE content LIKE ? LIMIT ?",
+				(f"%{text}%", limit))
+		return [dict(row) for row in rows]
+
+	def import_file(self, file_path: str) -> int:
+		"""
+		Import an existing Conversations.json file, JSONL conversation store or compact archive (.jsonl.gz)
+
+		:param file_path: Path to the file to import.
+		:return: Number of chats imported.
+		"""
+		count = 0
+		if file_path.endswith(".jsonl"):
+			for session_id, session in iter_sessions(file_path):
+				for chat_id, chat in session['conversations'].items():
+					self.add_chat(session_id, int(chat_id), chat['chatlog'], session.get('given_model'),
+						session.get('true_model'), session.get('time'))
+					count += 1
+		else:
+			session_id = f"import:{os.path.abspath(file_path)}"
+			created = os.path.getmtime(file_path)
+			if file_path.endswith(".jsonl.gz"):
+				chats = iter_compact_data(file_path)
+			else:
+				data = load_json_data(file_path)
+				chats = data.values() if isinstance(data, dict) else data
+			for chat in chats:
+				self.add_chat(session_id, int(chat['chat_id']), chat['chatlog'], created=created)
+				count += 1
+		return count
+
+	def close(self):
+		"""
+		Close the database connection
+		"""
+		self.conn.close()
+
+def main():
+	parser = argparse.ArgumentParser(description="Import, search and look up archived conversations.")
+	parser.add_argument('--archive_path', type=str, default='Archive.sqlite',
+						help='Path to the archive database')
+	commands = parser.add_subparsers(dest='command', required=True)
+	import_cmd = commands.add_parser('import', help='Import Conversations.json files, JSONL stores or compact archives')
+	import_cmd.add_argument('files', nargs='+')
+	search_cmd = commands.add_parser('search', help='Full-text search over message content')
+	search_cmd.add_argument('text')
+	search_cmd.add_argument('--limit', type=int, default=20)
+	show_cmd = commands.add_parser('show', help='Print the chat logs with a given chat id')
+	show_cmd.add_argument('chat_id', type=int)
+	show_cmd.add_argument('--session', type=str)
+	list_cmd = commands.add_parser('list', help='List chats by time range and model')
+	list_cmd.add_argument('--since', type=float, help='Unix time')
+	list_cmd.add_argument('--until', type=float, help='Unix time')
+	list_cmd.add_argument('--model', type=str)
+	args = parser.parse_args()
+
+	archive = conversationArchive(args.archive_path)
+	if args.command == 'import':
+		for file_path in args.files:
+			print(f"Imported {archive.import_file(file_path)} chats from {file_path}")
+	elif args.command == 'search':
+		for hit in archive.search(args.text, args.limit):
+			print(f"{hit['session']} chat {hit['chat_id']} msg {hit['msg_id']} {hit['sender']}: {hit['content']}")
+	elif args.command == 'show':
+		for chat in archive.get_chat(args.chat_id, args.session):
+			print(f"Session {chat['session']}, chat {chat['chat_id']}")
+			for msg in chat['chatlog']:
+				print(f"  {msg['msg_id']} {msg['sender']}: {msg['content']}")
+	else:
+		for chat in archive.find_chats(args.since, args.until, args.model):
+			print(f"{chat['session']} chat {chat['chat_id']} {chat['given_model']}/{chat['true_model']} {time.ctime(chat['created'])}")
+	archive.close()
+
+if __name__ == "__main__":
+	main()
@@ -1,7 +1,13 @@
+import os
 import json
 import sys
+import time
+import uuid
 import argparse
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator, Tuple
+
+from PromptBuilder import SYSTEM_PROMPT
+from MessageTree import messageTree
 
 def load_json_data(file_path: str) -> List[Dict[str, Any]]:
 	"""
@@ -31,6 +37,199 @@ def save_json_data(data: List[Dict[str, Any]], file_path: str):
 	except Exception as e:
 		print(f"Error saving JSON data: {e}")
 
+class conversationStore:
+	def __init__(self, file_path: str, session: str = None, fsync_interval: float = 5.0, file=None, **metadata):
+		"""
+		Open an append-only, line-delimited conversation store. Every message is written and flushed
+		to the operating system as its own JSON line as soon as it is added, so a crash of the process
+		loses nothing. The file is fsynced at most every fsync_interval seconds, so a crash of the
+		machine loses at most the records of the last interval.
+
+		:param file_path: Path to the JSONL file, created if missing.
+		:param session: Id of this session, generated if not given.
+		:param fsync_interval: Minimum seconds between fsync calls.
+		:param file: The store file already opened by a caller running several sessions at once, left open on close. file_path is then ignored.
+		:param metadata: Extra fields recorded with the session, e.g. the given and true model.
+		"""
+		self.session = session or uuid.uuid4().hex
+		self.fsync_interval = fsync_interval
+		self.last_sync = time.monotonic()
+		self.owns_file = file is None
+		self.file = open(file_path, 'a', encoding='utf-8', buffering=1 << 16) if file is None else file
+		self.write({'type': 'start', **metadata})
+
+	def write(self, record: Dict[str, Any]):
+		"""
+		Append a single record for this session. The session id is always the first key,
+		which lets readers skip other sessions without parsing their lines.
+
+		:param record: Fields of the record.
+		"""
+		record = {'session': self.session, 'time': time.time(), **record}
+		self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+		self.file.flush()
+		if time.monotonic() - self.last_sync >= self.fsync_interval:
+			self.sync()
+
+	def append_message(self, chat_id: int, msg_info: Dict[str, Any]):
+		"""
+		Record a message added to a chat log
+
+		:param chat_id: Id of the chat the message belongs to.
+		:param msg_info: Dictionary containing message id, sender, and content.
+		"""
+		self.write({'type': 'message', 'chat_id': chat_id, 'msg': msg_info})
+
+	def fork(self, chat_id: int, parent_id: int, msg_id: int):
+		"""
+		Record a new chat that starts with the messages of another chat before a given message
+
+		:param chat_id: Id of the new chat.
+		:param parent_id: Id of the chat whose messages are shared.
+		:param msg_id: Id number of the first message that is not shared.
+		"""
+		self.write({'type': 'fork', 'chat_id': chat_id, 'parent': parent_id, 'upto': msg_id})
+
+	def restore(self, chat_id: int, chatlog: List[Dict[str, Any]], source: Dict[str, Any]):
+		"""
+		Record a chat that starts from a previously saved chat log
+
+		:param chat_id: Id of the chat in this session.
+		:param chatlog: The restored messages.
+		:param source: Session and chat id the messages were restored from.
+		"""
+		self.write({'type': 'chat', 'chat_id': chat_id, 'chatlog': chatlog, 'source': source})
+
+	def sync(self):
+		"""
+		Force the flushed records to disk
+		"""
+		self.file.flush()
+		os.fsync(self.file.fileno())
+		self.last_sync = time.monotonic()
+
+	def close(self):
+		"""
+		Mark the session as finished and close the file
+		"""
+		self.write({'type': 'close'})
+		self.sync()
+		if self.owns_file:
+			self.file.close()
+
+def apply_record(session: Dict[str, Any], record: Dict[str, Any]):
+	"""
+	Apply a single store record to the session being rebuilt. Forked chats share the
+	messages before the fork in the session's message tree instead of copying them.
+
+	:param session: Dictionary with the session metadata and its message tree.
+	:param record: Record read from the store.
+	"""
+	tree = session['tree']
+	kind = record['type']
+	if kind == 'start':
+		session.update({k: v for k, v in record.items() if k not in ('type', 'tree', 'conversations')})
+	elif kind == 'message':
+		if record['chat_id'] not in tree.tips:
+			tree.new_chat(chat_id=record['chat_id'])
+		tree.append(record['chat_id'], record['msg'])
+	elif kind == 'fork':
+		tree.new_chat(tree.find(record['parent'], record['upto'] - 1), chat_id=record['chat_id'], fork_of=record['parent'])
+	elif kind == 'chat':
+		tree.add_chat(record['chatlog'], chat_id=record['chat_id'])
+	elif kind == 'tree':
+		session['tree'] = messageTree.from_dict(record['tree'])
+
+def new_session(session_id: str) -> Dict[str, Any]:
+	"""
+	Create an empty session to apply store records to
+
+	:param session_id: Id of the session.
+	:return: Dictionary with the session id and an empty message tree.
+	"""
+	return {'session': session_id, 'tree': messageTree()}
+
+def with_conversations(session: Dict[str, Any]) -> Dict[str, Any]:
+	"""
+	Add the chat logs of a rebuilt session's chats, for readers that want whole chat logs
+
+	:param session: Dictionary with the session metadata and its message tree.
+	:return: The session, its conversations mapping chat ids to chats in the Conversations.json schema.
+	"""
+	session['conversations'] = session['tree'].conversations()
+	return session
+
+def iter_sessions(file_path: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+	"""
+	Stream sessions back from a conversation store one at a time. Only sessions that are
+	still open are held in memory.
+
+	:param file_path: Path to the JSONL file.
+	:return: Iterator of (session id, session) pairs, the session holding its metadata, message tree and conversations.
+	"""
+	open_sessions = {}
+	try:
+		with open(file_path, 'r', encoding='utf-8') as file:
+			for line in file:
+				try:
+					record = json.loads(line)
+				except json.JSONDecodeError:
+					continue # A torn final line from a crash
+				session = open_sessions.get(record['session'])
+				if session is None:
+					session = open_sessions[record['session']] = new_session(record['session'])
+				if record['type'] == 'close':
+					yield record['session'], with_conversations(open_sessions.pop(record['session']))
+				else:
+					apply_record(session, record)
+	except FileNotFoundError:
+		pass
+	for session_id, session in open_sessions.items():
+		yield session_id, with_conversations(session)
+
+def load_session(file_path: str, session_id: str) -> Dict[str, Any]:
+	"""
+	Load a single session from a conversation store, skipping the lines of other sessions unparsed
+
+	:param file_path: Path to the JSONL file.
+	:param session_id: Id of the session to load.
+	:return: The session metadata, message tree and conversations, or None if the session is not in the store.
+	"""
+	prefix = json.dumps({'session': session_id})[:-1]
+	session = None
+	with open(file_path, 'r', encoding='utf-8') as file:
+		for line in file:
+			if not line.startswith(prefix):
+				continue
+			try:
+				record = json.loads(line)
+			except json.JSONDecodeError:
+				continue
+			if session is None:
+				session = new_session(session_id)
+			apply_record(session, record)
+	return with_conversations(session) if session else None
+
+def compact_store(file_path: str):
+	"""
+	Rewrite a conversation store with one message tree record per session instead of one record per
+	message, so messages shared by forked chats are stored once, and drop torn lines. The new file
+	replaces the old one atomically. Do not run while a session is writing to it.
+
+	:param file_path: Path to the JSONL file.
+	"""
+	tmp_path = file_path + ".tmp"
+	with open(tmp_path, 'w', encoding='utf-8') as file:
+		for session_id, session in iter_sessions(file_path):
+			metadata = {k: v for k, v in session.items() if k not in ('session', 'tree', 'conversations')}
+			file.write(json.dumps({'session': session_id, **metadata, 'type': 'start'}, ensure_ascii=False) + "\n")
+			record = {'session': session_id, 'type': 'tree', 'tree': session['tree'].to_dict()}
+			file.write(json.dumps(record, ensure_ascii=False) + "\n")
+			file.write(json.dumps({'session': session_id, 'type': 'close'}) + "\n")
+		file.flush()
+		os.fsync(file.fileno())
+	os.replace(tmp_path, file_path)
+
 def parse_arguments():
 	"""
 	Parse command-line arguments.
@@ -48,4 +247,56 @@ def parse_arguments():
 						help='Anyscale API key')
 	parser.add_argument('--anthropic_key', type=str,
 						help='Anthropic API key')
+	parser.add_argument('--no_stream', action='store_true',
+						help='Wait for the full response instead of streaming it')
+	parser.add_argument('--system_prompt', type=str, default=SYSTEM_PROMPT,
+						help='System prompt sent ahead of every conversation')
+	parser.add_argument('--no_prompt_cache', action='store_true',
+						help='Do not mark the conversation prefix for the Anthropic prompt cache')
+	parser.add_argument('--context_strategy', type=str, default='sliding',
+						choices=['sliding','first_last','summary'],
+						help='How to shorten conversations that outgrow the model context window')
+	parser.add_argument('--keep_first', type=int, default=2,
+						help='Opening messages kept by the first_last strategy')
+	parser.add_argument('--keep_last', type=int, default=20,
+						help='Most recent messages kept by the first_last strategy')
+	parser.add_argument('--store_path', type=str, default='Conversations.jsonl',
+						help='Append-only file every message is saved to as it is sent')
+	parser.add_argument('--archive_path', type=str, default='Archive.sqlite',
+						help='Searchable archive every backed up chat log is indexed in')
+	parser.add_argument('--resume', type=int, metavar='CHAT_ID',
+						help='Reopen an archived chat, the most recent one with this chat id')
+	parser.add_argument('--resume_session', type=str,
+						help='Session to resume the chat from when several sessions have the chat id')
+	parser.add_argument('--fan_out', type=str, nargs='+',
+						choices=['GPT-4','Llama3','Claude3'],
+						help='Also send every prompt to these models at the same time and save their responses with the true model\'s')
+	parser.add_argument('--fan_out_timeout', type=float, default=60,
+						help='Seconds each model has to respond when fanning out')
+	parser.add_argument('--cache', type=str, default='off',
+						choices=['on','off','readonly'],
+						help='Serve repeated prompts from the on-disk response cache')
+	parser.add_argument('--cache_path', type=str, default='ResponseCache.sqlite',
+						help='Path to the response cache database')
+	parser.add_argument('--cache_ttl', type=float, default=0,
+						help='Seconds a cached response stays valid, 0 for no expiry')
+	parser.add_argument('--cache_max_entries', type=int, default=10000,
+						help='Maximum number of cached responses before the least recently used are evicted')
+	parser.add_argument('--metrics_path', type=str, default='Metrics.jsonl',
+						help='JSONL file the latency and token metrics of every model call are appended to, empty to disable')
+	parser.add_argument('--metrics_port', type=int,
+						help='Serve Prometheus metrics on this localhost port at /metrics')
+	parser.add_argument('--renderer', type=str, default='widgets',
+						choices=['widgets','canvas'],
+						help='Draw messages as label widgets, or as canvas items which are lighter for long chats')
+	parser.add_argument('--icon_cache', type=str, default='.icon_cache',
+						help='Folder the shrunk icons are cached in between launches')
+	parser.add_argument('--speculate', action='store_true',
+						help='Start requesting the response to a message once the user pauses typing it, and keep it if the message is sent unchanged')
+	parser.add_argument('--speculate_debounce', type=int, default=600,
+						help='Milliseconds of typing pause before a speculative request is started')
+	parser.add_argument('--speculate_min_chars', type=int, default=8,
+						help='Shortest draft a speculative request is started for')
+	parser.add_argument('--speculate_max_tokens', type=int, default=50000,
+						help='Estimated prompt tokens speculative requests may spend per session before speculation stops')
 	return parser.parse_args()
\ No newline at end of file
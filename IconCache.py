@@ -0,0 +1,83 @@
+import os
+import glob
+import struct
+import tkinter as tk
+from typing import Tuple
+
+def png_size(file_path: str) -> Tuple[int, int]:
+	"""
+	Read the size of a PNG image from its header, without decoding it
+
+	:param file_path: Path to the PNG file.
+	:return: Tuple of width and height in pixels.
+	"""
+	with open(file_path, 'rb') as file:
+		header = file.read(24)
+	if header[:8] != b'\x89PNG\r\n\x1a\n':
+		raise ValueError(f"{file_path} is not a PNG file.")
+	return struct.unpack('>II', header[16:24])
+
+class iconCache:
+	def __init__(self, root, cache_dir: str = '.icon_cache'):
+		"""
+		Initialize a cache of icons shrunk from full-size images. Each shrunk icon is written to disk once,
+		keyed by the source file's modification time and the icon size, so later launches read a small
+		file instead of decoding the full-size image. Icons are handed out blank at their final size and
+		only filled in by load, which can run once the window has been drawn.
+
+		:param root: Tk root window the images belong to.
+		:param cache_dir: Folder the shrunk icons are written to, created when the first icon is cached.
+		"""
+		self.root = root
+		self.cache_dir = cache_dir
+		self.icons = {} # (source path, subsample) -> image
+		self.pending = [] # (image, source path, subsample, cached icon path) of the icons not loaded yet
+
+	def cache_path(self, file_path: str, size: Tuple[int, int]) -> str:
+		"""
+		Get where the shrunk version of an image is cached
+
+		:param file_path: Path to the full-size image.
+		:param size: Width and height of the icon.
+		:return: Path of the cached icon, which changes whenever the source file is modified.
+		"""
+		stem = os.path.splitext(os.path.basename(file_path))[0]
+		return os.path.join(self.cache_dir, f"{stem}-{size[0]}x{size[1]}-{os.stat(file_path).st_mtime_ns}.png")
+
+	def get(self, file_path: str, subsample: Tuple[int, int]) -> tk.PhotoImage:
+		"""
+		Get an icon shrunk from an image. The icon is blank until load is called.
+
+		:param file_path: Path to the full-size PNG image.
+		:param subsample: Factors the width and height are divided by, as for PhotoImage.subsample.
+		:return: The icon, already at its final size so layouts can be measured with it.
+		"""
+		key = (file_path, tuple(subsample))
+		if key not in self.icons:
+			width, height = png_size(file_path)
+			size = (-(-width // subsample[0]), -(-height // subsample[1]))
+			image = tk.PhotoImage(master=self.root, width=size[0], height=size[1])
+			self.icons[key] = image
+			self.pending.append((image, file_path, key[1], self.cache_path(file_path, size)))
+		return self.icons[key]
+
+	def load(self):
+		"""
+		Fill in every icon handed out so far. Icons not cached yet are shrunk from their full-size
+		image and cached, replacing cached versions of the same icon made from an older file.
+		"""
+		pending, self.pending = self.pending, []
+		for image, file_path, subsample, cached in pending:
+			if os.path.exists(cached):
+				image.tk.call(image.name, 'read', cached)
+				continue
+			full = tk.PhotoImage(master=self.root, file=file_path)
+			image.tk.call(image.name, 'copy', full.name, '-subsample', *subsample)
+			try:
+				os.makedirs(self.cache_dir, exist_ok=True)
+				for stale in glob.glob(cached.rsplit('-', 1)[0] + "-*.png"):
+					os.remove(stale)
+				image.write(cached + ".tmp", format='png')
+				os.replace(cached + ".tmp", cached)
+			except (OSError, tk.TclError) as e:
+				print(f"Error caching icon {file_path}: {e}")
@@ -0,0 +1,166 @@
+import queue
+import asyncio
+import inspect
+import itertools
+import threading
+from contextlib import aclosing
+from concurrent.futures import ThreadPoolExecutor
+
+class llmWorker:
+	def __init__(self, max_workers: int = 4):
+		"""
+		Initialize a background worker that runs model calls off the Tk main thread.
+		An asyncio event loop runs on its own daemon thread, blocking handler calls are
+		sent to a thread pool, and results are posted to a thread-safe queue for the UI to poll.
+
+		:param max_workers: Maximum number of blocking model calls running at once.
+		"""
+		self.results = queue.Queue()
+		self.requests = {} # request_id -> concurrent future, only touched from the Tk thread
+		self.stop_flags = {} # request_id -> event checked between streamed chunks
+		self.ids = itertools.count(1)
+		self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm")
+		self.loop = asyncio.new_event_loop()
+		self.loop.set_default_executor(self.executor)
+		self.thread = threading.Thread(target=self._run_loop, name="llm-loop", daemon=True)
+		self.thread.start()
+
+	def _run_loop(self):
+		"""
+		Runs the worker event loop forever on the background thread
+		"""
+		asyncio.set_event_loop(self.loop)
+		self.loop.run_forever()
+
+	async def _call(self, request_id: int, func, args):
+		"""
+		Runs a single request and posts its outcome to the results queue
+
+		:param request_id: Id of the request being run.
+		:param func: A coroutine function or blocking callable to run.
+		:param args: Positional arguments for func.
+		"""
+		try:
+			if asyncio.iscoroutinefunction(func):
+				result = await func(*args)
+			else:
+				result = await self.loop.run_in_executor(None, func, *args)
+			self.results.put((request_id, 'done', result))
+		except asyncio.CancelledError:
+			self.results.put((request_id, 'cancelled', None))
+			raise
+		except Exception as e:
+			self.results.put((request_id, 'error', e))
+
+	async def _stream(self, request_id: int, func, args, stop: threading.Event):
+		"""
+		Runs a streaming request, posting each text delta as it arrives and the full text at the end
+
+		:param request_id: Id of the request being run.
+		:param func: A callable returning a generator of text deltas, or an async generator function run on the loop itself.
+		:param args: Positional arguments for func.
+		:param stop: Event set when the request is cancelled, checked between chunks.
+		"""
+		def consume():
+			parts = []
+			deltas = func(*args)
+			try:
+				for delta in deltas:
+					if stop.is_set():
+						break
+					parts.append(delta)
+					self.results.put((request_id, 'chunk', delta))
+			finally:
+				deltas.close() # Closes the underlying HTTP stream if we stopped early
+			return "".join(parts)
+
+		async def consume_async():
+			parts = []
+			async with aclosing(func(*args)) as deltas: # Cancelling the task closes the stream in its own context
+				async for delta in deltas:
+					parts.append(delta)
+					self.results.put((request_id, 'chunk', delta))
+			return "".join(parts)
+
+		try:
+			if inspect.isasyncgenfunction(func):
+				result = await consume_async()
+			else:
+				result = await self.loop.run_in_executor(None, consume)
+			self.results.put((request_id, 'done', result))
+		except asyncio.CancelledError:
+			self.results.put((request_id, 'cancelled', None))
+			raise
+		except Exception as e:
+			self.results.put((request_id, 'error', e))
+
+	def submit(self, func, *args) -> int:
+		"""
+		Schedule a model call on the background loop
+
+		:param func: A coroutine function or blocking callable to run.
+		:param args: Positional arguments for func.
+		:return: Id of the request, used to match results and to cancel.
+		"""
+		request_id = next(self.ids)
+		self.requests[request_id] = asyncio.run_coroutine_threadsafe(self._call(request_id, func, args), self.loop)
+		return request_id
+
+	def submit_stream(self, func, *args) -> int:
+		"""
+		Schedule a streaming model call on the background loop. Text deltas are reported
+		by poll with the status 'chunk' before the final 'done' result.
+
+		:param func: A callable returning a generator of text deltas, or an async generator function.
+		:param args: Positional arguments for func.
+		:return: Id of the request, used to match results and to cancel.
+		"""
+		request_id = next(self.ids)
+		stop = threading.Event()
+		self.stop_flags[request_id] = stop
+		self.requests[request_id] = asyncio.run_coroutine_threadsafe(self._stream(request_id, func, args, stop), self.loop)
+		return request_id
+
+	def cancel(self, request_id: int):
+		"""
+		Cancel an in-flight request. Blocking calls already running in the thread pool
+		cannot be interrupted, but their result will be discarded. Streaming calls stop
+		at the next chunk.
+
+		:param request_id: Id of the request to cancel.
+		"""
+		future = self.requests.pop(request_id, None)
+		stop = self.stop_flags.pop(request_id, None)
+		if stop is not None:
+			stop.set()
+		if future is not None:
+			future.cancel()
+
+	def poll(self):
+		"""
+		Drain all finished requests without blocking. Must be called from the Tk thread.
+
+		:return: List of (request_id, status, result) tuples for requests that were not cancelled, in arrival order.
+		"""
+		finished = []
+		while True:
+			try:
+				request_id, status, result = self.results.get_nowait()
+			except queue.Empty:
+				break
+			if status == 'chunk':
+				if request_id in self.requests:
+					finished.append((request_id, status, result))
+			elif self.requests.pop(request_id, None) is not None:
+				self.stop_flags.pop(request_id, None)
+				finished.append((request_id, status, result))
+		return finished
+
+	def shutdown(self):
+		"""
+		Cancel all outstanding requests and stop the background loop
+		"""
+		for request_id in list(self.requests):
+			self.cancel(request_id)
+		self.loop.call_soon_threadsafe(self.loop.stop)
+		self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,150 @@
+from typing import List, Dict, Any
+
+class messageTree:
+	def __init__(self):
+		"""
+		Initialize a persistent tree of chat messages. Every chat is a branch of the tree, held only as
+		the node of its last message, so chats forked from one another share the nodes of the messages
+		before the fork. Nodes are only ever added, which makes forking a chat a single assignment.
+		"""
+		self.parents = [] # Node id of the previous message of each node, -1 for the first message of a chat
+		self.messages = [] # Chatlog entry of each node
+		self.owners = [] # Id of the chat that added each node, a chat that still ends below the node
+		self.children = {} # Node id -> ids of the nodes following it, -1 for first messages, in the order they were added
+		self.tips = {} # Chat id -> node id of the last message of the chat, -1 while it is empty
+		self.roots = {} # Chat id -> id of the chat that started empty, which it and its forks continue from
+
+	def new_chat(self, node: int = -1, chat_id: int = None, fork_of: int = None) -> int:
+		"""
+		Start a chat that continues from a node
+
+		:param node: Node of the last message the new chat shares, -1 to share none.
+		:param chat_id: Id of the new chat, defaults to one more than the highest chat id.
+		:param fork_of: Id of the chat the new chat is forked from, so a fork that shares no messages still
+			makes its first message a version of the other chat's. Without it an empty new chat is unrelated to every other chat.
+		:return: Id of the new chat.
+		"""
+		if chat_id is None:
+			chat_id = max(self.tips, default=0) + 1
+		self.tips[chat_id] = node
+		if node != -1:
+			self.roots[chat_id] = self.roots[self.owners[node]]
+		else:
+			self.roots[chat_id] = self.roots[fork_of] if fork_of is not None else chat_id
+		return chat_id
+
+	def append(self, chat_id: int, msg: Dict[str, Any]) -> int:
+		"""
+		Add a message to the end of a chat
+
+		:param chat_id: Id of the chat.
+		:param msg: Chatlog entry containing message id, sender, and content.
+		:return: Node id of the message.
+		"""
+		node = len(self.messages)
+		parent = self.tips[chat_id]
+		self.parents.append(parent)
+		self.messages.append(msg)
+		self.owners.append(chat_id)
+		self.children.setdefault(parent, []).append(node)
+		self.tips[chat_id] = node
+		return node
+
+	def add_chat(self, chatlog: List[Dict[str, Any]], chat_id: int = None) -> int:
+		"""
+		Add a whole chat log as a new chat that shares no messages
+
+		:param chatlog: List of dictionaries containing message id, sender, and content.
+		:param chat_id: Id of the new chat, defaults to one more than the highest chat id.
+		:return: Id of the new chat.
+		"""
+		chat_id = self.new_chat(chat_id=chat_id)
+		for msg in chatlog:
+			self.append(chat_id, msg)
+		return chat_id
+
+	def find(self, chat_id: int, msg_id: int) -> int:
+		"""
+		Find the node of a message in a chat, walking back from its last message
+
+		:param chat_id: Id of the chat.
+		:param msg_id: Id number of the message.
+		:return: Node id of the message, or -1 if the chat has no such message.
+		"""
+		node = self.tips.get(chat_id, -1)
+		while node != -1 and self.messages[node]['msg_id'] > msg_id:
+			node = self.parents[node]
+		return node if node != -1 and self.messages[node]['msg_id'] == msg_id else -1
+
+	def path(self, node: int) -> List[int]:
+		"""
+		Get the nodes leading to a node
+
+		:param node: Node id of the last message, -1 for none.
+		:return: Node ids from the first message to the given one.
+		"""
+		nodes = []
+		while node != -1:
+			nodes.append(node)
+			node = self.parents[node]
+		nodes.reverse()
+		return nodes
+
+	def chatlog(self, chat_id: int) -> List[Dict[str, Any]]:
+		"""
+		Get the messages of a chat
+
+		:param chat_id: Id of the chat.
+		:return: A new list of the chat's chatlog entries, the entries themselves are shared.
+		"""
+		return [self.messages[node] for node in self.path(self.tips[chat_id])]
+
+	def alternatives(self, node: int) -> List[int]:
+		"""
+		Get the versions of a message, the messages that follow the same earlier messages
+
+		:param node: Node id of the message.
+		:return: Node ids of the versions in the order they were written, including the given node.
+		"""
+		parent = self.parents[node]
+		if parent != -1:
+			return self.children[parent]
+		root = self.roots[self.owners[node]] # First messages only have versions in chats forked from one another
+		return [first for first in self.children[-1] if self.roots[self.owners[first]] == root]
+
+	def to_dict(self) -> Dict[str, Any]:
+		"""
+		Convert the tree to JSON-serializable data. Every message is stored once, however many chats share it.
+
+		:return: Dictionary with a [parent, owner, message] triple per node and a [chat id, last node, root chat id] triple per chat.
+		"""
+		return {
+			'nodes': [[parent, owner, msg] for parent, owner, msg in zip(self.parents, self.owners, self.messages)],
+			'tips': [[chat_id, node, self.roots[chat_id]] for chat_id, node in self.tips.items()]
+		}
+
+	@classmethod
+	def from_dict(cls, data: Dict[str, Any]) -> 'messageTree':
+		"""
+		Rebuild a tree from the data made by to_dict
+
+		:param data: Dictionary with the nodes and chats of the tree.
+		:return: The tree.
+		"""
+		tree = cls()
+		for node, (parent, owner, msg) in enumerate(data['nodes']):
+			tree.parents.append(parent)
+			tree.owners.append(owner)
+			tree.messages.append(msg)
+			tree.children.setdefault(parent, []).append(node)
+		tree.tips = {tip[0]: tip[1] for tip in data['tips']}
+		tree.roots = {tip[0]: tip[2] if len(tip) > 2 else tip[0] for tip in data['tips']} # Older files have no roots
+		return tree
+
+	def conversations(self) -> Dict[int, Dict[str, Any]]:
+		"""
+		Get every chat in the same chat_id/chatlog schema as Conversations.json
+
+		:return: Dictionary mapping chat ids to their chat.
+		"""
+		return {chat_id: {'chat_id': chat_id, 'chatlog': self.chatlog(chat_id)} for chat_id in self.tips}
@@ -0,0 +1,461 @@
+import tkinter as tk
+from tkinter import ttk
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+class messageView:
+	cache_size = 500 # Measurements kept, a streamed response is measured again at every update
+
+	def __init__(self, canvas, scrollbar, colors, icons, edit_icon, dots_icon, on_edit, page_size=50, branches=None, on_switch=None, dark=True):
+		"""
+		Initialize a virtualized message list drawn on a canvas. Only messages near the viewport get
+		widgets, taken from a small pool of rows that are rebound to other messages as the user scrolls.
+
+		:param canvas: Canvas the messages are drawn on.
+		:param scrollbar: Scrollbar linked to the canvas.
+		:param colors: Dictionary of the message colors for each theme.
+		:param icons: Dictionary mapping a sender to its icon image.
+		:param edit_icon: Image for the edit button of user messages.
+		:param dots_icon: Image shown while the chatbot is thinking.
+		:param on_edit: Called with the message id when an edit button is clicked.
+		:param page_size: Number of older messages loaded at a time when scrolling up through a restored chat.
+		:param branches: Called with the message id of a user message, returns the shown version and number of versions of an edited message, or None.
+		:param on_switch: Called with the message id and -1 or 1 when the previous or next version of a message is picked.
+		:param dark: Whether the dark theme is in use.
+		"""
+		self.canvas = canvas
+		self.scrollbar = scrollbar
+		self.colors = colors
+		self.icons = icons
+		self.edit_icon = edit_icon
+		self.dots_icon = dots_icon
+		self.on_edit = on_edit
+		self.branches = branches
+		self.on_switch = on_switch
+		self.font = ('Arial', 14)
+		self.wraplength = 500
+		self.page_size = page_size
+
+		self.older = [] # Chatlog entries above the first message in the view, not measured or drawn yet
+		self.messages = [] # Chatlog entries in display order
+		self.msg_ids = [] # Id of each message, for lookups by id
+		self.tops = [] # Y offset of each message on the canvas
+		self.heights = [] # Height of each message on the canvas
+		self.height_cache = OrderedDict() # (sender, content) -> measured height, least recently used first
+		self.rows = {} # Message index -> row bound to it
+		self.widgets = {} # Message id -> row bound to it, for the messages that currently have widgets
+		self.free = [] # Rows not bound to any message
+		self.pinned = set() # Ids of messages whose rows must not be recycled, e.g. while being edited
+		self.dots = None # Canvas item of the thinking dots
+		self.width = 1
+		self.scrollregion = None # (width, height) last given to the canvas
+
+		# Changes are applied in a single deferred pass per frame, see schedule
+		self.render_job = None
+		self.scroll_pending = False # Scroll to the bottom on the next pass
+		self.relayout_pending = False # Message offsets changed, move the bound rows on the next pass
+		self.dirty = set() # Indices of messages whose bound rows must be redrawn on the next pass
+		self.scroll_offset = 0 # Pixels added above the viewport, scrolled past on the next pass to keep the view still
+
+		# Message bubbles share one named style per sender, so a theme change recolors all of them in a single update
+		self.style = ttk.Style(self.canvas)
+		self.set_theme(dark)
+
+		# Widgets that are never shown, used to measure messages without laying out the window
+		self.measure_label = ttk.Label(self.canvas, style='Bot.Bubble.TLabel', font=self.font, justify='left', wraplength=self.wraplength)
+		self.icon_heights = {sender: self.measure_widget(tk.Label(self.canvas, image=icon)) for sender, icon in self.icons.items()}
+		self.edit_height = max(self.measure_widget(tk.Button(self.canvas, image=self.edit_icon)),
+			self.measure_widget(ttk.Button(self.canvas, text='<', width=2)))
+
+		self.canvas.configure(yscrollcommand=self.on_yscroll, bg=self.colors.get('bg_scrollable_window'))
+		self.canvas.bind('<Configure>', self.on_resize)
+
+	@staticmethod
+	def measure_widget(widget):
+		"""
+		Get the requested height of a widget that is only needed for measuring, then destroy it
+		:param widget: An unmapped widget
+		:return: Requested height in pixels
+		"""
+		height = widget.winfo_reqheight()
+		widget.destroy()
+		return height
+
+	def set_theme(self, dark):
+		"""
+		Color the message bubble styles for a theme. Call after every theme change, as ttk keeps style settings per theme.
+		:param dark: Whether the dark theme is in use
+		"""
+		self.dark = dark
+		if dark:
+			self.style.configure('User.Bubble.TLabel', background=self.colors.get("user_msg_bg_dark"), foreground=self.colors.get("user_msg_text_dark"))
+			self.style.configure('Bot.Bubble.TLabel', background=self.colors.get("bot_msg_bg_dark"), foreground=self.colors.get("user_msg_text_dark"))
+		else:
+			self.style.configure('User.Bubble.TLabel', background=self.colors.get("user_msg_bg_light"), foreground=self.colors.get("user_msg_text_light"))
+			self.style.configure('Bot.Bubble.TLabel', background=self.colors.get("bot_msg_bg_light"), foreground=self.colors.get("user_msg_text_light"))
+
+	def cached(self, cache, key, compute):
+		"""
+		Look up a measurement, computing it if it is missing. Only the cache_size most recently used are kept.
+		:param cache: OrderedDict of measurements
+		:param key: Key of the measurement
+		:param compute: Function returning the measurement
+		:return: The measurement
+		"""
+		value = cache.get(key)
+		if value is None:
+			value = compute()
+			cache[key] = value
+			if len(cache) > self.cache_size:
+				cache.popitem(last=False)
+		else:
+			cache.move_to_end(key)
+		return value
+
+	def measure(self, msg):
+		"""
+		Measure the height of a message row, caching the result per sender and content
+		:param msg: Dictionary containing message id, sender, and content
+		:return: Height of the row in pixels
+		"""
+		def compute():
+			self.measure_label.config(text=msg['content'])
+			label_height = self.measure_label.winfo_reqheight()
+			if msg['sender'] == "User":
+				label_height += self.edit_height
+			return max(self.icon_heights.get(msg['sender'], 0), label_height)
+		return self.cached(self.height_cache, (msg['sender'], msg['content']), compute)
+
+	def new_row(self):
+		"""
+		Create a row of widgets that can be bound to any message
+		:return: Dictionary of the row's widgets
+		"""
+		frame = ttk.Frame(self.canvas)
+		return {
+			'frame': frame,
+			'icon': tk.Label(frame),
+			**self.new_tools(frame),
+			'label': ttk.Label(frame, font=self.font, justify='left', wraplength=self.wraplength),
+			'window': self.canvas.create_window(0, -10000, window=frame, anchor='nw', width=self.width)
+		}
+
+	def new_tools(self, frame):
+		"""
+		Create the edit button of a row, and the buttons to page through the versions of an edited message
+		:param frame: Frame of the row
+		:return: Dictionary of the tool widgets, 'tools' being the frame holding the others
+		"""
+		tools = ttk.Frame(frame)
+		return {
+			'tools': tools,
+			'edit': tk.Button(tools, image=self.edit_icon, bg=self.colors.get("edit_button_bg")),
+			'prev': ttk.Button(tools, text='<', width=2),
+			'count': ttk.Label(tools),
+			'next': ttk.Button(tools, text='>', width=2)
+		}
+
+	def bind_tools(self, row, msg_info):
+		"""
+		Set up the tool widgets of a row for a user message, the caller places the tools frame
+		:param row: Row to draw into
+		:param msg_info: Dictionary containing message id, sender, and content
+		"""
+		msg_id = msg_info['msg_id']
+		for widget in (row['prev'], row['count'], row['next']):
+			widget.pack_forget()
+		row['edit'].config(command=lambda: self.on_edit(msg_id))
+		row['edit'].pack(side='right')
+		position = self.branches(msg_id) if self.branches else None
+		if position:
+			row['next'].config(command=lambda: self.on_switch(msg_id, 1))
+			row['prev'].config(command=lambda: self.on_switch(msg_id, -1))
+			row['count'].config(text=f"{position[0]}/{position[1]}")
+			for widget in (row['next'], row['count'], row['prev']):
+				widget.pack(side='right', padx=(0, 3))
+
+	def bind_row(self, row, index):
+		"""
+		Draw a message into a row and move the row to the message's position
+		:param row: Row to draw into
+		:param index: Index of the message in the view
+		"""
+		msg_info = self.messages[index]
+		msg = msg_info['content']
+		send = msg_info['sender']
+		for widget in (row['icon'], row['tools'], row['label']):
+			widget.pack_forget()
+
+		# Determine alignment based on the sender, with dynamic padding based on message length
+		if send == "User":
+			anchor, side = 'e', 'right'
+			padx_right = 10
+			padx_left = max(100, 250 - len(msg)*7)
+		else:
+			anchor, side = 'w', 'left'
+			padx_left = 10
+			padx_right = max(100, 250 - len(msg)*7)
+
+		# Add icons for the message to indicate who is speaking
+		row['icon'].config(image=self.icons.get(send, ''))
+		row['icon'].pack(side=side, anchor='n', padx=(padx_left if send != "User" else 0, padx_right if send == "User" else 0))
+
+		# If the sender is a user, add a button to edit the message, and buttons to switch between its versions once edited
+		if send == "User":
+			self.bind_tools(row, msg_info)
+			row['tools'].pack(side='bottom', anchor='se', padx=(0, padx_right))
+
+		row['label'].config(text=msg, style='User.Bubble.TLabel' if send == "User" else 'Bot.Bubble.TLabel')
+		row['label'].pack(side=side, anchor=anchor, padx=(padx_left, padx_right))
+
+		row.update({'info': msg_info, 'index': index, 'padxr': padx_right, 'padxl': padx_left})
+		self.move_row(row, self.tops[index])
+
+	def move_row(self, row, top):
+		"""
+		Move a row to a vertical position on the canvas
+		:param row: Row to move
+		:param top: Y offset of the top of the row
+		"""
+		self.canvas.coords(row['window'], 0, top)
+
+	def release_row(self, index):
+		"""
+		Unbind the row of a message and return it to the pool
+		:param index: Index of the message in the view
+		"""
+		row = self.rows.pop(index)
+		self.widgets.pop(row['info']['msg_id'], None)
+		self.move_row(row, -10000)
+		self.free.append(row)
+
+	def refresh(self):
+		"""
+		Bind rows to the messages in and around the viewport and recycle all others
+		"""
+		top = self.canvas.canvasy(0)
+		view_height = max(self.canvas.winfo_height(), 1)
+		first = max(bisect_right(self.tops, top - view_height / 2) - 1, 0)
+		last = bisect_left(self.tops, top + view_height * 1.5)
+
+		# Load the previous page once the top of the view is reached
+		if self.older and first == 0:
+			self.prepend(self.older[-self.page_size:])
+			del self.older[-self.page_size:]
+			return
+
+		for index in list(self.rows):
+			if (index < first or index >= last) and self.messages[index]['msg_id'] not in self.pinned:
+				self.release_row(index)
+		for index in range(first, last):
+			if index in self.rows:
+				continue
+			row = self.free.pop() if self.free else self.new_row()
+			self.rows[index] = row
+			self.widgets[self.messages[index]['msg_id']] = row
+			self.bind_row(row, index)
+
+	def update_scrollregion(self):
+		"""
+		Sets the scroll region from the measured message heights instead of the bounding box of all items.
+		The canvas is only reconfigured when the region changed, as that makes it report its view through
+		yscrollcommand again.
+		"""
+		total = self.tops[-1] + self.heights[-1] if self.messages else 0
+		if self.dots is not None:
+			self.canvas.coords(self.dots, 5, total)
+			total += self.dots_icon.height()
+		if self.scrollregion != (self.width, total):
+			self.scrollregion = (self.width, total)
+			self.canvas.configure(scrollregion=(0, 0, self.width, total))
+
+	def schedule(self, scroll=False, relayout=False):
+		"""
+		Request a render pass. All changes made before the window is idle again are applied together,
+		so adding many messages costs a single scroll region update, scroll and rebind.
+		:param scroll: Scroll to the bottom of the chat window during the pass
+		:param relayout: Message offsets changed and bound rows must be moved
+		"""
+		self.scroll_pending |= scroll
+		self.relayout_pending |= relayout
+		if self.render_job is None:
+			self.render_job = self.canvas.after_idle(self.render)
+
+	def render(self):
+		"""
+		Apply all scheduled changes: scroll region, row positions, auto-scroll and row binding
+		"""
+		self.render_job = None
+		self.update_scrollregion()
+		if self.scroll_offset:
+			total = self.tops[-1] + self.heights[-1]
+			self.canvas.yview_moveto((self.canvas.canvasy(0) + self.scroll_offset) / total)
+			self.scroll_offset = 0
+		if self.relayout_pending:
+			for index, row in self.rows.items():
+				self.move_row(row, self.tops[index])
+		for index in self.dirty:
+			if index in self.rows and self.messages[index]['msg_id'] not in self.pinned:
+				self.bind_row(self.rows[index], index)
+		if self.scroll_pending:
+			self.canvas.yview_moveto(1)
+		self.scroll_pending = self.relayout_pending = False
+		self.dirty.clear()
+		self.refresh()
+
+	def append(self, msg_info):
+		"""
+		Add a message to the bottom of the view
+		:param msg_info: Dictionary containing message id, sender, and content
+		"""
+		self.extend([msg_info])
+
+	def extend(self, messages):
+		"""
+		Add several messages to the bottom of the view, drawn in one render pass
+		:param messages: List of dictionaries containing message id, sender, and content
+		"""
+		for msg_info in messages:
+			self.tops.append(self.tops[-1] + self.heights[-1] if self.messages else 0)
+			self.heights.append(self.measure(msg_info))
+			self.messages.append(msg_info)
+			self.msg_ids.append(msg_info['msg_id'])
+		self.schedule()
+
+	def prepend(self, messages):
+		"""
+		Add older messages above the first message in the view without moving what is on screen
+		:param messages: List of dictionaries containing message id, sender, and content
+		"""
+		heights = [self.measure(msg_info) for msg_info in messages]
+		tops = []
+		added = 0
+		for height in heights:
+			tops.append(added)
+			added += height
+		count = len(messages)
+		self.tops = tops + [top + added for top in self.tops]
+		self.heights = heights + self.heights
+		self.messages = messages + self.messages
+		self.msg_ids = [msg_info['msg_id'] for msg_info in messages] + self.msg_ids
+		self.rows = {index + count: row for index, row in self.rows.items()}
+		for row in self.rows.values():
+			row['index'] += count
+		self.dirty = {index + count for index in self.dirty}
+		self.scroll_offset += added
+		self.schedule(relayout=True)
+
+	def set_messages(self, messages):
+		"""
+		Replace the messages in the view, only measuring and drawing the most recent page.
+		Older pages are loaded as the user scrolls up.
+		:param messages: List of dictionaries containing message id, sender, and content
+		"""
+		self.truncate(0)
+		self.older = list(messages[:-self.page_size])
+		self.extend(messages[-self.page_size:])
+		self.scroll_to_end()
+
+	def update_message(self, msg_id):
+		"""
+		Redraw a message whose content has changed, moving the messages below it if its height changed
+		:param msg_id: Id number of the message
+		"""
+		index = bisect_left(self.msg_ids, msg_id)
+		height = self.measure(self.messages[index])
+		delta = height - self.heights[index]
+		self.heights[index] = height
+		for i in range(index + 1, len(self.tops)):
+			self.tops[i] += delta
+		self.dirty.add(index)
+		self.schedule(relayout=bool(delta))
+
+	def truncate(self, msg_id):
+		"""
+		Remove a message and every message after it from the view
+		:param msg_id: Id number of the first message to remove
+		"""
+		index = bisect_left(self.msg_ids, msg_id)
+		if index == 0:
+			self.older = [msg_info for msg_info in self.older if msg_info['msg_id'] < msg_id]
+		for i in [i for i in self.rows if i >= index]:
+			self.release_row(i)
+		self.pinned = {pinned for pinned in self.pinned if pinned < msg_id}
+		self.dirty = {i for i in self.dirty if i < index}
+		del self.messages[index:]
+		del self.msg_ids[index:]
+		del self.tops[index:]
+		del self.heights[index:]
+		self.schedule()
+
+	def pin(self, msg_id):
+		"""
+		Keep the row of a message bound while it is being edited
+		:param msg_id: Id number of the message
+		"""
+		self.pinned.add(msg_id)
+
+	def start_edit(self, msg_id):
+		"""
+		Hide a message's text and tools so an editor can be drawn in their place, its row stays bound until unpinned
+		:param msg_id: Id number of the message, which must currently have a row
+		:return: Frame to pack the editor widgets into
+		"""
+		self.pin(msg_id)
+		row = self.widgets[msg_id]
+		row['tools'].pack_forget()
+		row['label'].pack_forget()
+		return row['frame']
+
+	def unpin(self, msg_id):
+		"""
+		Allow the row of a message to be recycled again and redraw it
+		:param msg_id: Id number of the message
+		"""
+		self.pinned.discard(msg_id)
+		row = self.widgets.get(msg_id)
+		if row is not None:
+			self.dirty.add(row['index'])
+		self.schedule()
+
+	def show_dots(self):
+		"""
+		Draw dots below the last message to indicate the chatbot is thinking
+		"""
+		if self.dots is None:
+			self.dots = self.canvas.create_image(5, 0, image=self.dots_icon, anchor='nw')
+		self.schedule()
+
+	def hide_dots(self):
+		"""
+		Remove the thinking dots
+		"""
+		if self.dots is not None:
+			self.canvas.delete(self.dots)
+			self.dots = None
+			self.schedule()
+
+	def scroll_to_end(self):
+		"""
+		Scroll to the bottom of the chat window on the next render pass
+		"""
+		self.schedule(scroll=True)
+
+	def on_yscroll(self, first, last):
+		"""
+		Updates the scrollbar and rebinds rows whenever the canvas view moves. Only the bound rows are
+		refreshed, a full render pass would report the view again and never go idle.
+		"""
+		self.scrollbar.set(first, last)
+		self.refresh()
+
+	def on_resize(self, event):
+		"""
+		Adjusts the width of the rows to match the canvas's width.
+		"""
+		self.width = event.width
+		for row in self.rows.values():
+			self.canvas.itemconfig(row['window'], width=event.width)
+		for row in self.free:
+			self.canvas.itemconfig(row['window'], width=event.width)
+		self.schedule()
@@ -0,0 +1,384 @@
+import json
+import math
+import time
+import threading
+import contextvars
+from contextlib import aclosing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, List
+
+from ContextManager import estimate_tokens
+
+# Span of the model call running in the current thread or task, filled in by the handlers, cache and rate limiter
+current_span = contextvars.ContextVar('current_span', default=None)
+
+def record(**values):
+	"""
+	Set values on the span of the model call in progress, if it is being measured
+
+	:param values: Span fields to set, e.g. cache='hit'.
+	"""
+	span = current_span.get()
+	if span is not None:
+		span.update(values)
+
+def add(name: str, amount: float = 1):
+	"""
+	Add to a counter on the span of the model call in progress, if it is being measured
+
+	:param name: Span field to add to, e.g. 'retries'.
+	:param amount: Amount to add.
+	"""
+	span = current_span.get()
+	if span is not None:
+		span[name] = span.get(name, 0) + amount
+
+def record_usage(usage):
+	"""
+	Record the token counts a provider reported for the model call in progress
+
+	:param usage: Usage object of an OpenAI or Anthropic response, or None if the provider sent none.
+	"""
+	if usage is None:
+		return
+	if getattr(usage, 'input_tokens', None) is not None:
+		# Anthropic counts prompt cache reads and writes separately from the other input tokens
+		cache_read = getattr(usage, 'cache_read_input_tokens', None) or 0
+		cache_write = getattr(usage, 'cache_creation_input_tokens', None) or 0
+		record(input_tokens=usage.input_tokens + cache_read + cache_write, output_tokens=usage.output_tokens,
+			cache_read_tokens=cache_read, cache_write_tokens=cache_write)
+	else:
+		# OpenAI includes cached tokens in the prompt tokens, and caches automatically without reporting writes
+		details = getattr(usage, 'prompt_tokens_details', None)
+		record(input_tokens=usage.prompt_tokens, output_tokens=usage.completion_tokens,
+			cache_read_tokens=getattr(details, 'cached_tokens', None) or 0)
+
+def trace(event_name: str, info: Dict[str, Any]):
+	"""
+	httpcore trace callback timing the connection setup of a request. Requests sent on a pooled
+	connection emit no connection events, so their connect time stays 0.
+
+	:param event_name: Name of the httpcore event, e.g. 'connection.connect_tcp.started'.
+	:param info: Event details, unused.
+	"""
+	span = current_span.get()
+	if span is None:
+		return
+	if event_name == 'connection.connect_tcp.started':
+		span['_connecting'] = time.monotonic()
+	elif event_name in ('connection.connect_tcp.complete', 'connection.start_tls.complete') and '_connecting' in span:
+		span['connect'] = span.get('connect', 0) + time.monotonic() - span['_connecting']
+		span['_connecting'] = time.monotonic()
+
+async def trace_async(event_name: str, info: Dict[str, Any]):
+	"""
+	httpcore trace callback for the asyncio clients
+
+	:param event_name: Name of the httpcore event.
+	:param info: Event details, unused.
+	"""
+	trace(event_name, info)
+
+def trace_request(request):
+	"""
+	httpx request hook attaching the trace callback to an outgoing request
+
+	:param request: The httpx request.
+	"""
+	request.extensions['trace'] = trace
+
+async def trace_request_async(request):
+	"""
+	httpx request hook attaching the trace callback to a request of an asyncio client
+
+	:param request: The httpx request.
+	"""
+	request.extensions['trace'] = trace_async
+
+def percentile(values: List[float], fraction: float):
+	"""
+	Get a percentile by the nearest-rank method
+
+	:param values: Sorted values.
+	:param fraction: Percentile as a fraction, e.g. 0.95.
+	:return: The percentile, or None if there are no values.
+	"""
+	if not values:
+		return None
+	return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+class callMetrics:
+	def __init__(self, file_path: str = None, port: int = None):
+		"""
+		Initialize the collection of per-call spans: queue wait, connection setup, time to first token,
+		total time, token counts, retries and cache use. Finished spans are appended to a JSONL file
+		and can be scraped in the Prometheus text format.
+
+		:param file_path: JSONL file spans and the session summary are appended to, None to keep them in memory only.
+		:param port: Port to serve Prometheus metrics on at /metrics, None to not serve them.
+		"""
+		self.spans = []
+		self.lock = threading.Lock() # Spans finish on the Tk thread, the endpoint reads them from its own
+		self.file = open(file_path, 'a', encoding='utf-8') if file_path else None
+		self.server = None
+		if port:
+			self.serve(port)
+
+	def start(self, model: str) -> Dict[str, Any]:
+		"""
+		Start the span of a model call when it is queued
+
+		:param model: The proper LLM name.
+		:return: The span, to be passed to measure and finish.
+		"""
+		return {'model': model, 'time': time.time(), 'queue_wait': None, 'connect': 0, 'ttft': None, 'total': None,
+			'input_tokens': None, 'output_tokens': None, 'cache_read_tokens': None, 'cache_write_tokens': None, 'cache': None,
+			'retries': 0, 'throttled': 0, '_queued': time.monotonic()}
+
+	def measure(self, span: Dict[str, Any], chat_function):
+		"""
+		Wrap a blocking function so its run is timed and recorded on the span
+
+		:param span: Span returned by start.
+		:param chat_function: Function to measure.
+		:return: Function with the same signature as chat_function.
+		"""
+		def call(*args):
+			token = current_span.set(span)
+			span['_started'] = time.monotonic()
+			span['queue_wait'] = span['_started'] - span['_queued']
+			try:
+				return chat_function(*args)
+			finally:
+				span['total'] = time.monotonic() - span['_started']
+				current_span.reset(token)
+		return call
+
+	def measure_stream(self, span: Dict[str, Any], stream_function):
+		"""
+		Wrap a blocking generator function so its run, including the time to the first chunk, is recorded on the span
+
+		:param span: Span returned by start.
+		:param stream_function: Generator function to measure.
+		:return: Generator function with the same signature as stream_function.
+		"""
+		def call(*args):
+			token = current_span.set(span)
+			span['_started'] = time.monotonic()
+			span['queue_wait'] = span['_started'] - span['_queued']
+			try:
+				for delta in stream_function(*args):
+					if span['ttft'] is None:
+						span['ttft'] = time.monotonic() - span['_started']
+					yield delta
+			finally:
+				span['total'] = time.monotonic() - span['_started']
+				current_span.reset(token)
+		return call
+
+	def measure_async(self, span: Dict[str, Any], chat_function):
+		"""
+		Wrap a coroutine function so its run is timed and recorded on the span
+
+		:param span: Span returned by start.
+		:param chat_function: Coroutine function to measure.
+		:return: Coroutine function with the same signature as chat_function.
+		"""
+		async def call(*args):
+			token = current_span.set(span)
+			span['_started'] = time.monotonic()
+			span['queue_wait'] = span['_started'] - span['_queued']
+			try:
+				return await chat_function(*args)
+			finally:
+				span['total'] = time.monotonic() - span['_started']
+				current_span.reset(token)
+		return call
+
+	def measure_async_stream(self, span: Dict[str, Any], stream_function):
+		"""
+		Wrap an async generator function so its run, including the time to the first chunk, is recorded on the span
+
+		:param span: Span returned by start.
+		:param stream_function: Async generator function to measure.
+		:return: Async generator function with the same signature as stream_function.
+		"""
+		async def call(*args):
+			span['_started'] = time.monotonic()
+			span['queue_wait'] = span['_started'] - span['_queued']
+			try:
+				async with aclosing(stream_function(*args)) as deltas:
+					while True:
+						# The span is only set while a chunk is awaited, a generator may be resumed or closed from another context
+						token = current_span.set(span)
+						try:
+							delta = await anext(deltas)
+						except StopAsyncIteration:
+							break
+						finally:
+							current_span.reset(token)
+						if span['ttft'] is None:
+							span['ttft'] = time.monotonic() - span['_started']
+						yield delta
+			finally:
+				span['total'] = time.monotonic() - span['_started']
+		return call
+
+	def finish(self, span: Dict[str, Any], status: str, text: str = None) -> Dict[str, Any]:
+		"""
+		Complete a span once its result reaches the UI and export it
+
+		:param span: Span returned by start.
+		:param status: Outcome of the call: 'done', 'error', 'cancelled', or 'discarded' for unused speculative calls.
+		:param text: The response text, used to estimate the output tokens if the provider reported none.
+		:return: The span without its internal timestamps, to be stored with the message.
+		"""
+		span = {name: value for name, value in span.items() if not name.startswith('_')}
+		span['status'] = status
+		if span['output_tokens'] is None and text:
+			span['output_tokens'] = estimate_tokens(span['model'], text)
+			span['tokens_estimated'] = True
+		generating = (span['total'] or 0) - (span['ttft'] or 0)
+		if span['output_tokens'] and generating > 0 and span['cache'] != 'hit':
+			span['tokens_per_sec'] = span['output_tokens'] / generating
+		for name in ('queue_wait', 'connect', 'ttft', 'total', 'throttled', 'tokens_per_sec'):
+			if span.get(name) is not None:
+				span[name] = round(span[name], 4)
+
+		with self.lock:
+			self.spans.append(span)
+		if self.file:
+			self.file.write(json.dumps({'type': 'span', **span}) + "\n")
+			self.file.flush()
+		return span
+
+	def summary(self) -> Dict[str, Any]:
+		"""
+		Summarize the spans of this session
+
+		:return: Dictionary of call counts, p50/p95 latencies, tokens per second and cache hit rate.
+		"""
+		with self.lock:
+			spans = list(self.spans)
+		done = [span for span in spans if span['status'] == 'done']
+		totals = sorted(span['total'] for span in done if span['total'] is not None)
+		ttfts = sorted(span['ttft'] for span in done if span['ttft'] is not None)
+		speeds = sorted(span['tokens_per_sec'] for span in done if span.get('tokens_per_sec'))
+		cached = [span['cache'] for span in spans if span['cache']]
+		input_tokens = sum(span['input_tokens'] or 0 for span in spans)
+		cache_read = sum(span['cache_read_tokens'] or 0 for span in spans)
+		return {
+			'calls': len(spans),
+			'errors': sum(span['status'] == 'error' for span in spans),
+			'retries': sum(span['retries'] for span in spans),
+			'p50_total': percentile(totals, 0.5),
+			'p95_total': percentile(totals, 0.95),
+			'p50_ttft': percentile(ttfts, 0.5),
+			'p95_ttft': percentile(ttfts, 0.95),
+			'p50_tokens_per_sec': percentile(speeds, 0.5),
+			'input_tokens': input_tokens,
+			'output_tokens': sum(span['output_tokens'] or 0 for span in spans),
+			'cache_read_tokens': cache_read,
+			'cache_write_tokens': sum(span['cache_write_tokens'] or 0 for span in spans),
+			'prompt_cache_hit_rate': cache_read / input_tokens if input_tokens else None,
+			'cache_hit_rate': cached.count('hit') / len(cached) if cached else None
+		}
+
+	def prometheus_text(self) -> str:
+		"""
+		Render the spans of this session in the Prometheus text exposition format
+
+		:return: Metrics text.
+		"""
+		with self.lock:
+			spans = list(self.spans)
+		lines = []
+		def metric(name, kind, help_text, samples):
+			lines.append(f"# HELP {name} {help_text}")
+			lines.append(f"# TYPE {name} {kind}")
+			for labels, value in samples:
+				label_text = ",".join(f'{key}="{value}"' for key, value in labels.items())
+				lines.append(f"{name}{{{label_text}}} {value}")
+
+		counts, tokens, seconds, retries = {}, {}, {}, {}
+		for span in spans:
+			key = (span['model'], span['status'])
+			counts[key] = counts.get(key, 0) + 1
+			retries[span['model']] = retries.get(span['model'], 0) + span['retries']
+			for direction in ('input', 'output', 'cache_read', 'cache_write'):
+				tokens[(span['model'], direction)] = tokens.get((span['model'], direction), 0) + (span[direction + '_tokens'] or 0)
+			for phase in ('queue_wait', 'connect', 'ttft', 'total'):
+				if span[phase] is not None:
+					seconds[(span['model'], phase)] = seconds.get((span['model'], phase), 0) + span[phase]
+		metric('llm_calls_total', 'counter', 'Model calls by outcome.',
+			[({'model': model, 'status': status}, count) for (model, status), count in counts.items()])
+		metric('llm_retries_total', 'counter', 'Retried model calls.',
+			[({'model': model}, count) for model, count in retries.items()])
+		metric('llm_tokens_total', 'counter', 'Tokens sent and received, and prompt tokens read from and written to the provider cache.',
+			[({'model': model, 'direction': direction}, count) for (model, direction), count in tokens.items()])
+		metric('llm_phase_seconds_total', 'counter', 'Time spent in each phase of a model call.',
+			[({'model': model, 'phase': phase}, round(value, 4)) for (model, phase), value in seconds.items()])
+		summary = self.summary()
+		metric('llm_latency_seconds', 'gauge', 'Total model call latency percentiles this session.',
+			[({'quantile': quantile}, summary[key]) for quantile, key in (('0.5', 'p50_total'), ('0.95', 'p95_total')) if summary[key] is not None])
+		return "\n".join(lines) + "\n"
+
+	def serve(self, port: int):
+		"""
+		Serve prometheus_text at /metrics on a background thread
+
+		:param port: Port to listen on, bound to localhost.
+		"""
+		metrics = self
+		class handler(BaseHTTPRequestHandler):
+			def do_GET(self):
+				if self.path != '/metrics':
+					self.send_error(404)
+					return
+				body = metrics.prometheus_text().encode('utf-8')
+				self.send_response(200)
+				self.send_header('Content-Type', 'text/plain; version=0.0.4')
+				self.send_header('Content-Length', str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+
+			def log_message(self, format, *args):
+				pass
+
+		self.server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+		threading.Thread(target=self.server.serve_forever, name="metrics", daemon=True).start()
+
+	def log(self, kind: str, **values):
+		"""
+		Save a record that is not about a model call, e.g. startup times
+
+		:param kind: Type of the record.
+		:param values: Fields of the record.
+		"""
+		if self.file:
+			self.file.write(json.dumps({'type': kind, 'time': time.time(), **values}) + "\n")
+			self.file.flush()
+
+	def close(self) -> Dict[str, Any]:
+		"""
+		Print and save the session summary, and stop the endpoint
+
+		:return: The session summary.
+		"""
+		summary = self.summary()
+		if summary['calls']:
+			def seconds(value):
+				return "n/a" if value is None else f"{value:.2f}s"
+			print(f"{summary['calls']} model calls, {summary['errors']} failed, {summary['retries']} retries. "
+				f"Latency p50 {seconds(summary['p50_total'])}, p95 {seconds(summary['p95_total'])}; "
+				f"first token p50 {seconds(summary['p50_ttft'])}, p95 {seconds(summary['p95_ttft'])}; "
+				f"{summary['p50_tokens_per_sec'] or 0:.1f} tokens/s; "
+				f"{summary['prompt_cache_hit_rate'] or 0:.0%} of input tokens read from the prompt cache.")
+		if self.file:
+			self.file.write(json.dumps({'type': 'summary', 'time': time.time(), **summary}) + "\n")
+			self.file.close()
+			self.file = None
+		if self.server:
+			self.server.shutdown()
+			self.server = None
+		return summary
@@ -0,0 +1,232 @@
+import time
+import json
+import random
+import asyncio
+import argparse
+import threading
+from aiohttp import web
+
+# Words the mock responses are made of, each counted as one token
+mock_words = ["lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing", "elit", "sed", "do",
+	"eiusmod", "tempor", "incididunt", "ut", "labore", "et", "dolore", "magna", "aliqua"]
+
+class mockLLMServer:
+	def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.2, tokens_per_sec: float = 100,
+			error_rate: float = 0.0, error_status: int = 503, response_tokens: int = 50, seed: int = None):
+		"""
+		Initialize a local stand-in for the model APIs, speaking the OpenAI chat completions and
+		Anthropic messages wire formats closely enough for the official SDKs. Responses are filler text
+		paced like a real model, so the app and benchmarks can run without API keys.
+
+		:param host: Address to listen on.
+		:param port: Port to listen on, 0 to pick a free one.
+		:param latency: Seconds before the first token, like network and queueing delay.
+		:param tokens_per_sec: Rate tokens are generated at after the first.
+		:param error_rate: Fraction of requests answered with an error instead.
+		:param error_status: HTTP status of the errors, e.g. 429 or 503.
+		:param response_tokens: Number of tokens in each response, capped by the request's max_tokens.
+		:param seed: Seed for the error draws, for repeatable runs.
+		"""
+		self.host = host
+		self.port = port
+		self.latency = latency
+		self.tokens_per_sec = tokens_per_sec
+		self.error_rate = error_rate
+		self.error_status = error_status
+		self.response_tokens = response_tokens
+		self.random = random.Random(seed)
+		self.requests = 0 # Requests received, including failed ones
+		self.loop = None
+		self.runner = None
+		self.thread = None
+
+	def make_app(self) -> web.Application:
+		"""
+		Build the aiohttp application serving both APIs
+
+		:return: The application.
+		"""
+		app = web.Application()
+		app.router.add_post('/v1/chat/completions', self.openai_chat)
+		app.router.add_post('/v1/messages', self.anthropic_messages)
+		app.router.add_route('HEAD', '/{tail:.*}', self.head) # Handlers prewarm their connection with a HEAD request
+		return app
+
+	async def head(self, request: web.Request) -> web.Response:
+		"""
+		Answer a connection prewarm request
+		"""
+		return web.Response()
+
+	def take_request(self, body):
+		"""
+		Count a request and decide how it is answered
+
+		:param body: The parsed JSON request body.
+		:return: Tuple of (whether to fail, input token count, words of the response).
+		"""
+		self.requests += 1
+		failed = self.random.random() < self.error_rate
+		input_tokens = max(1, len(json.dumps(body.get('messages', ''))) // 4)
+		count = min(self.response_tokens, body.get('max_tokens') or self.response_tokens)
+		words = [mock_words[i % len(mock_words)] for i in range(count)]
+		return failed, input_tokens, words
+
+	async def pace(self, words):
+		"""
+		Yield the response words at the configured rate after the first token latency
+
+		:param words: Words of the response.
+		:return: Async generator of words, each with a leading space after the first.
+		"""
+		await asyncio.sleep(self.latency)
+		for index, word in enumerate(words):
+			if index:
+				await asyncio.sleep(1 / self.tokens_per_sec)
+			yield word if index == 0 else " " + word
+
+	async def openai_chat(self, request: web.Request) -> web.StreamResponse:
+		"""
+		Answer a chat completion request in the OpenAI format, streamed as server-sent events if asked to
+		"""
+		body = await request.json()
+		failed, input_tokens, words = self.take_request(body)
+		if failed:
+			return web.json_response({'error': {'message': "Mock server error", 'type': 'server_error', 'code': None}},
+				status=self.error_status, headers={'retry-after': '1'})
+		completion_id = f"chatcmpl-mock{self.requests}"
+		created = int(time.time())
+		usage = {'prompt_tokens': input_tokens, 'completion_tokens': len(words), 'total_tokens': input_tokens + len(words)}
+
+		if not body.get('stream'):
+			text = "".join([word async for word in self.pace(words)])
+			return web.json_response({'id': completion_id, 'object': 'chat.completion', 'created': created, 'model': body['model'],
+				'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': text}, 'finish_reason': 'stop'}], 'usage': usage})
+
+		response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+		await response.prepare(request)
+		def chunk(delta, finish_reason=None):
+			return {'id': completion_id, 'object': 'chat.completion.chunk', 'created': created, 'model': body['model'],
+				'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]}
+		await self.send_event(response, chunk({'role': 'assistant', 'content': ""}))
+		async for word in self.pace(words):
+			await self.send_event(response, chunk({'content': word}))
+		await self.send_event(response, chunk({}, 'stop'))
+		if (body.get('stream_options') or {}).get('include_usage'):
+			await self.send_event(response, {**chunk({}), 'choices': [], 'usage': usage})
+		await response.write(b"data: [DONE]\n\n")
+		await response.write_eof()
+		return response
+
+	async def anthropic_messages(self, request: web.Request) -> web.StreamResponse:
+		"""
+		Answer a messages request in the Anthropic format, streamed as server-sent events if asked to
+		"""
+		body = await request.json()
+		failed, input_tokens, words = self.take_request(body)
+		if failed:
+			return web.json_response({'type': 'error', 'error': {'type': 'overloaded_error', 'message': "Mock server error"}},
+				status=self.error_status, headers={'retry-after': '1'})
+		message = {'id': f"msg_mock{self.requests}", 'type': 'message', 'role': 'assistant', 'model': body['model'],
+			'content': [], 'stop_reason': None, 'stop_sequence': None, 'usage': {'input_tokens': input_tokens, 'output_tokens': 1}}
+
+		if not body.get('stream'):
+			text = "".join([word async for word in self.pace(words)])
+			return web.json_response({**message, 'content': [{'type': 'text', 'text': text}], 'stop_reason': 'end_turn',
+				'usage': {'input_tokens': input_tokens, 'output_tokens': len(words)}})
+
+		response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+		await response.prepare(request)
+		await self.send_event(response, {'type': 'message_start', 'message': message}, 'message_start')
+		await self.send_event(response, {'type': 'content_block_start', 'index': 0, 'content_block': {'type': 'text', 'text': ""}}, 'content_block_start')
+		async for word in self.pace(words):
+			await self.send_event(response, {'type': 'content_block_delta', 'index': 0, 'delta': {'type': 'text_delta', 'text': word}}, 'content_block_delta')
+		await self.send_event(response, {'type': 'content_block_stop', 'index': 0}, 'content_block_stop')
+		await self.send_event(response, {'type': 'message_delta', 'delta': {'stop_reason': 'end_turn', 'stop_sequence': None},
+			'usage': {'output_tokens': len(words)}}, 'message_delta')
+		await self.send_event(response, {'type': 'message_stop'}, 'message_stop')
+		await response.write_eof()
+		return response
+
+	@staticmethod
+	async def send_event(response: web.StreamResponse, data, event: str = None):
+		"""
+		Write one server-sent event
+
+		:param response: The streaming response.
+		:param data: JSON payload of the event.
+		:param event: Event name, the Anthropic format names every event.
+		"""
+		prefix = f"event: {event}\n" if event else ""
+		await response.write((prefix + "data: " + json.dumps(data) + "\n\n").encode('utf-8'))
+
+	def start(self) -> str:
+		"""
+		Start serving on a background thread
+
+		:return: Root URL of the server, e.g. http://127.0.0.1:8123.
+		"""
+		started = threading.Event()
+		def run():
+			self.loop = asyncio.new_event_loop()
+			asyncio.set_event_loop(self.loop)
+			self.runner = web.AppRunner(self.make_app(), access_log=None)
+			self.loop.run_until_complete(self.runner.setup())
+			site = web.TCPSite(self.runner, self.host, self.port)
+			self.loop.run_until_complete(site.start())
+			self.port = self.runner.addresses[0][1]
+			started.set()
+			self.loop.run_forever()
+
+		self.thread = threading.Thread(target=run, name="mock-llm", daemon=True)
+		self.thread.start()
+		started.wait()
+		return self.url
+
+	@property
+	def url(self) -> str:
+		return f"http://{self.host}:{self.port}"
+
+	def provider_options(self):
+		"""
+		Get providerRegistry options pointing every handler at this server
+
+		:return: Dictionary mapping each provider to its handler's keyword arguments.
+		"""
+		return {
+			'openai': {'api_key': 'mock', 'base_url': self.url + "/v1"},
+			'anyscale': {'api_key': 'mock', 'base_url': self.url + "/"},
+			'anthropic': {'api_key': 'mock', 'base_url': self.url}
+		}
+
+	def stop(self):
+		"""
+		Stop the server and its thread
+		"""
+		if self.loop is None:
+			return
+		asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result()
+		self.loop.call_soon_threadsafe(self.loop.stop)
+		self.thread.join()
+		self.loop = None
+
+def main():
+	parser = argparse.ArgumentParser(description="Serve mock OpenAI and Anthropic APIs for running the app without API keys.")
+	parser.add_argument('--host', type=str, default='127.0.0.1')
+	parser.add_argument('--port', type=int, default=8765)
+	parser.add_argument('--latency', type=float, default=0.2,
+						help='Seconds before the first token')
+	parser.add_argument('--tokens_per_sec', type=float, default=100)
+	parser.add_argument('--error_rate', type=float, default=0.0,
+						help='Fraction of requests answered with an error')
+	parser.add_argument('--error_status', type=int, default=503)
+	parser.add_argument('--response_tokens', type=int, default=50)
+	args = parser.parse_args()
+
+	server = mockLLMServer(args.host, args.port, args.latency, args.tokens_per_sec, args.error_rate,
+		args.error_status, args.response_tokens)
+	print(f"Serving mock APIs at {server.url}: OpenAI at {server.url}/v1, Anthropic at {server.url}")
+	web.run_app(server.make_app(), host=args.host, port=args.port, print=None, access_log=None)
+
+if __name__ == "__main__":
+	main()
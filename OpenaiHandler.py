@@ -1,28 +1,147 @@
-import openai
+import httpx
+from typing import List, Dict
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
+
+from Metrics import record_usage, trace_request, trace_request_async
 
 class openaiHandler:
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, base_url: str = None):
         """
-        Initialize the OpenAI API handler with the necessary API key.
+        Initialize the OpenAI API handler with the necessary API key and optional base URL.
+        Requests share one keep-alive connection pool for the life of the handler.
         
         :param api_key: Your OpenAI API key.
+        :param base_url: The base URL of an OpenAI-compatible API, e.g. a local mock server. Defaults to the OpenAI API.
         """
         self.api_key = api_key
-        openai.api_key = self.api_key
+        self.base_url = base_url
+        self.max_tokens = 800
+        self.temperature = 0.7
+        self.http_client = DefaultHttpxClient(limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=300),
+            event_hooks={'request': [trace_request], 'response': [self.report_headers]})
+        self.client = OpenAI(base_url=self.base_url, api_key=self.api_key, http_client=self.http_client, max_retries=0)
+        self.async_client = None
+        self.on_headers = None # Called with the headers of every API response, set by the provider registry
+
+    def prewarm(self):
+        """
+        Open a pooled connection to the API ahead of the first request, so it does not pay for DNS and TLS setup.
+        """
+        try:
+            self.http_client.head(str(self.client.base_url), timeout=5)
+        except httpx.HTTPError:
+            pass
+
+    def report_headers(self, response):
+        """
+        Pass the headers of an API response to on_headers, e.g. so a rate limiter can follow the provider's limits.
 
-    def gpt_chat(self, conversation: str, model: str) -> str:
+        :param response: The httpx response.
+        """
+        if self.on_headers:
+            self.on_headers(response.headers)
+
+    async def report_headers_async(self, response):
+        """
+        Pass the headers of an API response made by the asyncio client to on_headers.
+
+        :param response: The httpx response.
+        """
+        self.report_headers(response)
+
+    def gpt_chat(self, messages: List[Dict[str, str]], model: str) -> str:
         """
         Handle a chat requests for GPT-3.5 and GPT-4.
         
-        :param conversation: The conversation history as a single string. Includes system instructions.
+        :param messages: Role-tagged messages starting with the system prompt, built by promptBuilder.
+        :param model: The chat completion model to use.
+        :return: The response from GPT3.5 or GPT-4.
+        """
+        response = self.client.chat.completions.create(
+            model=model,
+            messages=messages,
+            max_tokens=self.max_tokens,
+            temperature=self.temperature
+        )
+        record_usage(response.usage)
+        return response.choices[0].message.content
+
+    def gpt_chat_stream(self, messages: List[Dict[str, str]], model: str):
+        """
+        Handle a streaming chat request for GPT-3.5 and GPT-4.
+
+        :param messages: Role-tagged messages starting with the system prompt, built by promptBuilder.
+        :param model: The chat completion model to use.
+        :return: A generator yielding text deltas as they are generated.
+        """
+        stream = self.client.chat.completions.create(
+            model=model,
+            messages=messages,
+            max_tokens=self.max_tokens,
+            temperature=self.temperature,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        try:
+            for chunk in stream:
+                if chunk.usage:
+                    record_usage(chunk.usage)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            stream.close()
+
+
+    def get_async_client(self) -> AsyncOpenAI:
+        """
+        Build the asyncio client on first use. It has its own connection pool, bound to the event loop that first uses it.
+
+        :return: The asyncio OpenAI client.
+        """
+        if self.async_client is None:
+            self.async_client = AsyncOpenAI(base_url=self.base_url, api_key=self.api_key, max_retries=0,
+                http_client=DefaultAsyncHttpxClient(limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=300),
+                    event_hooks={'request': [trace_request_async], 'response': [self.report_headers_async]}))
+        return self.async_client
+
+    async def chat(self, messages: List[Dict[str, str]], model: str) -> str:
+        """
+        Handle a chat request for GPT-3.5 and GPT-4 without blocking the event loop.
+
+        :param messages: Role-tagged messages starting with the system prompt, built by promptBuilder.
         :param model: The chat completion model to use.
         :return: The response from GPT3.5 or GPT-4.
         """
-        messages = [{"role": "user", "content": conversation}]
-        response = openai.chat.completions.create(
+        response = await self.get_async_client().chat.completions.create(
+            model=model,
+            messages=messages,
+            max_tokens=self.max_tokens,
+            temperature=self.temperature
+        )
+        record_usage(response.usage)
+        return response.choices[0].message.content
+
+    async def chat_stream(self, messages: List[Dict[str, str]], model: str):
+        """
+        Handle a streaming chat request for GPT-3.5 and GPT-4 without blocking the event loop.
+
+        :param messages: Role-tagged messages starting with the system prompt, built by promptBuilder.
+        :param model: The chat completion model to use.
+        :return: An async generator yielding text deltas as they are generated.
+        """
+        stream = await self.get_async_client().chat.completions.create(
             model=model,
             messages=messages,
-            max_tokens=800,
-            temperature=0.7
+            max_tokens=self.max_tokens,
+            temperature=self.temperature,
+            stream=True,
+            stream_options={"include_usage": True}
         )
-        return response.choices[0].message.content
\ No newline at end of file
+        try:
+            async for chunk in stream:
+                if chunk.usage:
+                    record_usage(chunk.usage)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            await stream.close()
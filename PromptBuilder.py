@@ -0,0 +1,102 @@
+from bisect import bisect_left
+from typing import List, Dict, Any
+
+SYSTEM_PROMPT = "You are a helpful assistant."
+
+# Dictionary mapping chatlog senders to the roles of the provider message formats
+sender_roles = {
+	'User': 'user',
+	'Bot': 'assistant'
+}
+
+class promptBuilder:
+	def __init__(self, system: str = SYSTEM_PROMPT):
+		"""
+		Initialize an incremental builder of the role-tagged message list sent to the model. The list is
+		kept up to date as messages are added, so building it only costs the messages added since the
+		last build, and earlier messages keep the same shape every turn.
+
+		:param system: The system prompt sent ahead of the conversation.
+		"""
+		self.system = {'role': 'system', 'content': system}
+		self.msg_ids = [] # Ids of the added chatlog messages, in chatlog order
+		self.added = [] # The added chatlog messages, in chatlog order
+		self.positions = [] # Index in self.messages holding each added chatlog message
+		self.messages = [] # Role-tagged messages, consecutive messages of one role merged into one
+
+	def append(self, msg: Dict[str, Any]):
+		"""
+		Add a single chatlog message to the end of the message list. Providers expect user and
+		assistant turns to alternate, so a message from the same role as the last one is merged into it.
+
+		:param msg: Chatlog entry containing message id, sender, and content.
+		"""
+		role = sender_roles.get(msg['sender'], 'user')
+		if self.messages and self.messages[-1]['role'] == role:
+			# Replace rather than modify, lists returned by earlier builds share the message dictionaries
+			self.messages[-1] = {'role': role, 'content': self.messages[-1]['content'] + "\n" + msg['content']}
+		else:
+			self.messages.append({'role': role, 'content': msg['content']})
+		self.msg_ids.append(msg['msg_id'])
+		self.added.append(msg)
+		self.positions.append(len(self.messages) - 1)
+
+	def sync(self, chatlog: List[Dict[str, Any]]):
+		"""
+		Add any chatlog messages that have not been added yet
+
+		:param chatlog: The current chat log, which must extend the messages already added.
+		"""
+		for msg in chatlog[len(self.msg_ids):]:
+			self.append(msg)
+
+	def truncate(self, msg_id: int):
+		"""
+		Remove a message and every message after it
+
+		:param msg_id: Id number of the first message to remove.
+		"""
+		index = bisect_left(self.msg_ids, msg_id)
+		if index == len(self.msg_ids):
+			return
+		position = self.positions[index]
+		first = bisect_left(self.positions, position) # First chatlog message merged into the same provider message
+		kept = self.added[first:index]
+		del self.messages[position:]
+		del self.msg_ids[first:]
+		del self.added[first:]
+		del self.positions[first:]
+		for msg in kept:
+			self.append(msg)
+
+	def build(self, chatlog: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+		"""
+		Build the model messages for the chat log
+
+		:param chatlog: The current chat log.
+		:return: The system prompt followed by the role-tagged conversation.
+		"""
+		self.sync(chatlog)
+		return [self.system] + self.messages
+
+def to_messages(chatlog: List[Dict[str, Any]], system: str = SYSTEM_PROMPT) -> List[Dict[str, str]]:
+	"""
+	Build the model messages for a list of chatlog entries in one go
+
+	:param chatlog: Chatlog entries, which need not be contiguous.
+	:param system: The system prompt sent ahead of the conversation, None for none.
+	:return: The system prompt followed by the role-tagged conversation.
+	"""
+	messages = promptBuilder(system).build(chatlog)
+	return messages if system is not None else messages[1:]
+
+def split_system(messages: List[Dict[str, str]]):
+	"""
+	Separate the system prompt from the conversation, for APIs that take it as its own parameter
+
+	:param messages: Messages built by promptBuilder.
+	:return: Tuple of the system prompt, or None if there is none, and the remaining messages.
+	"""
+	if messages and messages[0]['role'] == 'system':
+		return messages[0]['content'], messages[1:]
+	return None, messages
@@ -0,0 +1,111 @@
+import sys
+import importlib
+import threading
+
+from RateLimiter import providerLimiter, limitedProvider
+
+# Dictionary mapping shorthand to proper LLM names. Change manually to test different models.
+model_name_mapping = {'GPT-4': 'gpt-4o-mini', 
+		'Llama3': 'meta-llama/Meta-Llama-3-70B-Instruct', 
+		'Claude3': 'claude-3-haiku-20240307'}
+
+# Dictionary mapping proper LLM names to how many prompt tokens to send, leaving room for the response
+model_token_budgets = {'gpt-4o-mini': 120000,
+		'meta-llama/Meta-Llama-3-70B-Instruct': 7000,
+		'claude-3-haiku-20240307': 190000}
+
+# Dictionary mapping providers to the module and class of their handler
+provider_handlers = {
+	'openai': ('OpenaiHandler', 'openaiHandler'),
+	'anyscale': ('AnyscaleHandler', 'anyscaleHandler'),
+	'anthropic': ('AnthropicHandler', 'anthropicHandler')
+}
+
+# Dictionary mapping proper LLM names to their provider and the name of the handler's chat method
+model_providers = {
+	'gpt-4o-mini': ('openai', 'gpt_chat'),
+	'meta-llama/Meta-Llama-3-70B-Instruct': ('anyscale', 'anyscale_chat'),
+	'claude-3-haiku-20240307': ('anthropic', 'claude_chat')
+}
+
+class providerRegistry:
+	def __init__(self, options):
+		"""
+		Initialize a registry that builds each provider's handler on first use. Handler modules,
+		and with them the provider SDKs, are only imported once a provider is actually needed.
+
+		:param options: Dictionary mapping a provider to the keyword arguments of its handler, e.g. the API key.
+		"""
+		self.options = options
+		self.handlers = {}
+		self.limiters = {provider: providerLimiter() for provider in provider_handlers} # Shared by every call to a provider
+		self.lock = threading.Lock() # Handlers may be requested from the Tk thread and the worker at once
+
+	def get(self, provider: str):
+		"""
+		Get the handler of a provider, building it if this is the first use
+
+		:param provider: Provider name, a key of provider_handlers.
+		:return: The provider's handler.
+		"""
+		with self.lock:
+			handler = self.handlers.get(provider)
+			if handler is None:
+				module_name, class_name = provider_handlers[provider]
+				handler_class = getattr(importlib.import_module(module_name), class_name)
+				handler = handler_class(**self.options.get(provider, {}))
+				handler.on_headers = self.limiters[provider].observe
+				self.handlers[provider] = handler
+			return handler
+
+	def handler(self, model: str):
+		"""
+		Get the handler serving a model
+
+		:param model: Proper LLM name.
+		:return: The provider's handler.
+		"""
+		return self.get(model_providers[model][0])
+
+	def provider(self, model: str):
+		"""
+		Get the ChatProvider serving a model, rate limited and retried like every other call to its provider
+
+		:param model: Proper LLM name.
+		:return: limitedProvider wrapping the handler.
+		"""
+		provider = model_providers[model][0]
+		return limitedProvider(self.get(provider), self.limiters[provider])
+
+	def chat_function(self, model: str, stream: bool = False):
+		"""
+		Look up the handler function serving a model
+
+		:param model: Proper LLM name.
+		:param stream: Whether to return the streaming variant.
+		:return: The chat function wrapped by the provider's limiter, or None if no provider serves the model.
+		"""
+		if model not in model_providers:
+			return None
+		provider, method = model_providers[model]
+		handler = self.get(provider)
+		limiter = self.limiters[provider]
+		if stream:
+			return limiter.wrap_stream(getattr(handler, method + "_stream"), handler)
+		return limiter.wrap(getattr(handler, method), handler)
+
+	def prewarm(self, model: str):
+		"""
+		Build the handler serving a model and open its connection on a background thread,
+		so neither the SDK import nor connection setup is paid by the first message
+
+		:param model: Proper LLM name.
+		"""
+		def run():
+			try:
+				self.get(model_providers[model][0]).prewarm()
+			except Exception as e:
+				print(f"Error preparing the {model} client: {e}", file=sys.stderr)
+
+		if model in model_providers:
+			threading.Thread(target=run, name="prewarm", daemon=True).start()
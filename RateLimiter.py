@@ -0,0 +1,333 @@
+import time
+import random
+import asyncio
+import threading
+from contextlib import aclosing
+from typing import List, Dict
+from email.utils import parsedate_to_datetime
+
+import Metrics
+from ContextManager import count_tokens
+
+# Status codes worth retrying: timeouts, conflicts, rate limits and server errors
+retry_statuses = {408, 409, 429, 500, 502, 503, 504, 529}
+
+class CircuitOpenError(Exception):
+	"""
+	Raised instead of calling a provider that has been failing
+	"""
+
+def is_retryable(error: Exception) -> bool:
+	"""
+	Check if a failed call is worth retrying
+
+	:param error: Exception raised by a handler.
+	:return: True for rate limits, timeouts, connection errors and server errors.
+	"""
+	status = getattr(error, 'status_code', None)
+	if status is not None:
+		return status in retry_statuses or status >= 500
+	return isinstance(error, (TimeoutError, ConnectionError)) or type(error).__name__ in ('APIConnectionError', 'APITimeoutError')
+
+def header_int(headers, *names):
+	"""
+	Read the first integer header present under any of the given names
+
+	:param headers: Response headers.
+	:param names: Header names to try in order.
+	:return: The header value, or None if none is present.
+	"""
+	for name in names:
+		value = headers.get(name)
+		if value is not None:
+			try:
+				return int(value)
+			except ValueError:
+				pass
+	return None
+
+class tokenBucket:
+	def __init__(self, per_minute: int = None):
+		"""
+		Initialize a token bucket refilled continuously at a per-minute rate. Callers reserve capacity
+		up front and are told how long to wait, so concurrent callers queue instead of bursting.
+
+		:param per_minute: Allowed amount per minute, None for no limit until one is learned from headers.
+		"""
+		self.capacity = per_minute
+		self.level = per_minute
+		self.updated = time.monotonic()
+		self.lock = threading.Lock() # Reserved from the worker threads and event loops alike
+
+	def refill(self):
+		"""
+		Add the capacity earned since the last update. Must be called with the lock held.
+		"""
+		now = time.monotonic()
+		self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60)
+		self.updated = now
+
+	def reserve(self, amount: float) -> float:
+		"""
+		Reserve capacity for a call
+
+		:param amount: Amount the call will use.
+		:return: Seconds to wait before making the call.
+		"""
+		with self.lock:
+			if self.capacity is None:
+				return 0
+			self.refill()
+			self.level -= min(amount, self.capacity)
+			return 0 if self.level >= 0 else -self.level * 60 / self.capacity
+
+	def update(self, limit: int = None, remaining: int = None):
+		"""
+		Adjust the bucket to limits reported by the provider
+
+		:param limit: Allowed amount per minute.
+		:param remaining: Amount the provider says is left right now.
+		"""
+		with self.lock:
+			if limit:
+				if self.capacity is None:
+					self.level = limit
+				self.capacity = limit
+			if self.capacity is not None and remaining is not None:
+				self.refill()
+				self.level = min(self.level, remaining)
+
+class retryPolicy:
+	def __init__(self, attempts: int = 5, base: float = 0.5, cap: float = 30.0):
+		"""
+		Initialize an exponential backoff policy with full jitter
+
+		:param attempts: Total number of attempts including the first.
+		:param base: Delay in seconds before the first retry, doubled on every retry.
+		:param cap: Longest delay in seconds.
+		"""
+		self.attempts = attempts
+		self.base = base
+		self.cap = cap
+
+	def delay(self, attempt: int, error: Exception) -> float:
+		"""
+		Get the delay before the next attempt, honouring a Retry-After header when the provider sent one
+
+		:param attempt: Number of the attempt that failed, starting at 0.
+		:param error: Exception raised by the failed attempt.
+		:return: Seconds to wait.
+		"""
+		response = getattr(error, 'response', None)
+		retry_after = response.headers.get('retry-after') if response is not None else None
+		if retry_after:
+			try:
+				return min(float(retry_after), self.cap)
+			except ValueError:
+				try:
+					return min(max(parsedate_to_datetime(retry_after).timestamp() - time.time(), 0), self.cap)
+				except (TypeError, ValueError):
+					pass
+		return random.uniform(0, min(self.cap, self.base * 2 ** attempt))
+
+class circuitBreaker:
+	def __init__(self, threshold: int = 5, cooldown: float = 30.0):
+		"""
+		Initialize a circuit breaker that stops calls to a provider after repeated failures
+
+		:param threshold: Consecutive calls that failed with retryable errors on every attempt before the circuit opens.
+		:param cooldown: Seconds the circuit stays open before a trial call is let through.
+		"""
+		self.threshold = threshold
+		self.cooldown = cooldown
+		self.failures = 0
+		self.opened = None
+		self.lock = threading.Lock()
+
+	def check(self):
+		"""
+		Raise CircuitOpenError if calls are currently blocked
+		"""
+		with self.lock:
+			if self.opened is not None and time.monotonic() - self.opened < self.cooldown:
+				raise CircuitOpenError(f"Provider failed {self.failures} times in a row, retrying in {self.cooldown - (time.monotonic() - self.opened):.0f}s")
+
+	def success(self):
+		"""
+		Record a successful call, closing the circuit
+		"""
+		with self.lock:
+			self.failures = 0
+			self.opened = None
+
+	def failure(self):
+		"""
+		Record a call that used up its retries, opening the circuit once the threshold is reached
+		"""
+		with self.lock:
+			self.failures += 1
+			if self.failures >= self.threshold:
+				self.opened = time.monotonic()
+
+class providerLimiter:
+	def __init__(self, requests_per_minute: int = None, tokens_per_minute: int = None, policy: retryPolicy = None,
+			breaker: circuitBreaker = None):
+		"""
+		Initialize the rate limiting, retry and circuit breaking applied to every call to one provider
+
+		:param requests_per_minute: Initial request limit, None until learned from response headers.
+		:param tokens_per_minute: Initial token limit, None until learned from response headers.
+		:param policy: Retry policy for failed calls.
+		:param breaker: Circuit breaker shared by all calls to the provider.
+		"""
+		self.requests = tokenBucket(requests_per_minute)
+		self.tokens = tokenBucket(tokens_per_minute)
+		self.policy = policy or retryPolicy()
+		self.breaker = breaker or circuitBreaker()
+		self.retries = 0 # Total retries made, for reporting
+
+	def observe(self, headers):
+		"""
+		Update the limits from the rate limit headers of a provider response
+
+		:param headers: Response headers from OpenAI, Anthropic or a compatible API.
+		"""
+		self.requests.update(header_int(headers, 'x-ratelimit-limit-requests', 'anthropic-ratelimit-requests-limit'),
+			header_int(headers, 'x-ratelimit-remaining-requests', 'anthropic-ratelimit-requests-remaining'))
+		self.tokens.update(header_int(headers, 'x-ratelimit-limit-tokens', 'anthropic-ratelimit-tokens-limit'),
+			header_int(headers, 'x-ratelimit-remaining-tokens', 'anthropic-ratelimit-tokens-remaining'))
+
+	def before(self, messages: List[Dict[str, str]], model: str, max_tokens) -> float:
+		"""
+		Check the circuit and reserve capacity for a call
+
+		:param messages: The messages being sent.
+		:param model: The proper LLM name.
+		:param max_tokens: Response token limit of the handler.
+		:return: Seconds to wait before making the call.
+		"""
+		self.breaker.check()
+		tokens = count_tokens(model, messages) + (max_tokens or 0)
+		wait = max(self.requests.reserve(1), self.tokens.reserve(tokens))
+		Metrics.add('throttled', wait)
+		return wait
+
+	def after_failure(self, attempt: int, error: Exception) -> float:
+		"""
+		Decide whether to retry a failed call. Re-raises the error if not.
+
+		:param attempt: Number of the attempt that failed, starting at 0.
+		:param error: Exception raised by the failed attempt.
+		:return: Seconds to wait before retrying.
+		"""
+		if not is_retryable(error):
+			raise error
+		if attempt + 1 >= self.policy.attempts:
+			self.breaker.failure() # One failure per call, so a single failing call cannot open the circuit for every caller
+			raise error
+		self.retries += 1
+		Metrics.add('retries')
+		return self.policy.delay(attempt, error)
+
+	def wrap(self, chat_function, handler):
+		"""
+		Wrap a blocking handler chat function
+
+		:param chat_function: Handler method taking a message list and a model name.
+		:param handler: The handler the method belongs to.
+		:return: Function with the same signature as chat_function.
+		"""
+		def call(messages, model):
+			for attempt in range(self.policy.attempts):
+				time.sleep(self.before(messages, model, getattr(handler, 'max_tokens', None)))
+				try:
+					result = chat_function(messages, model)
+				except Exception as e:
+					time.sleep(self.after_failure(attempt, e))
+					continue
+				self.breaker.success()
+				return result
+		return call
+
+	def wrap_stream(self, stream_function, handler):
+		"""
+		Wrap a blocking handler streaming function. Calls are only retried if they fail before the first chunk.
+
+		:param stream_function: Handler method taking a message list and a model name and yielding text deltas.
+		:param handler: The handler the method belongs to.
+		:return: Generator function with the same signature as stream_function.
+		"""
+		def call(messages, model):
+			for attempt in range(self.policy.attempts):
+				time.sleep(self.before(messages, model, getattr(handler, 'max_tokens', None)))
+				started = False
+				try:
+					for delta in stream_function(messages, model):
+						started = True
+						yield delta
+				except Exception as e:
+					if started:
+						raise
+					time.sleep(self.after_failure(attempt, e))
+					continue
+				self.breaker.success()
+				return
+		return call
+
+	def wrap_async(self, chat_function, handler):
+		"""
+		Wrap an asyncio handler chat function
+
+		:param chat_function: Coroutine function taking a message list and a model name.
+		:param handler: The handler the method belongs to.
+		:return: Coroutine function with the same signature as chat_function.
+		"""
+		async def call(messages, model):
+			for attempt in range(self.policy.attempts):
+				await asyncio.sleep(self.before(messages, model, getattr(handler, 'max_tokens', None)))
+				try:
+					result = await chat_function(messages, model)
+				except Exception as e:
+					await asyncio.sleep(self.after_failure(attempt, e))
+					continue
+				self.breaker.success()
+				return result
+		return call
+
+	def wrap_async_stream(self, stream_function, handler):
+		"""
+		Wrap an asyncio handler streaming function. Calls are only retried if they fail before the first chunk.
+
+		:param stream_function: Async generator function taking a message list and a model name.
+		:param handler: The handler the method belongs to.
+		:return: Async generator function with the same signature as stream_function.
+		"""
+		async def call(messages, model):
+			for attempt in range(self.policy.attempts):
+				await asyncio.sleep(self.before(messages, model, getattr(handler, 'max_tokens', None)))
+				started = False
+				try:
+					async with aclosing(stream_function(messages, model)) as deltas:
+						async for delta in deltas:
+							started = True
+							yield delta
+				except Exception as e:
+					if started:
+						raise
+					await asyncio.sleep(self.after_failure(attempt, e))
+					continue
+				self.breaker.success()
+				return
+		return call
+
+class limitedProvider:
+	def __init__(self, handler, limiter: providerLimiter):
+		"""
+		Expose a handler through the ChatProvider interface with its provider's limiter applied
+
+		:param handler: Handler implementing ChatProvider.
+		:param limiter: The provider's limiter.
+		"""
+		self.handler = handler
+		self.chat = limiter.wrap_async(handler.chat, handler)
+		self.chat_stream = limiter.wrap_async_stream(handler.chat_stream, handler)
@@ -0,0 +1,197 @@
+import time
+import json
+import asyncio
+import sqlite3
+import hashlib
+import threading
+from contextlib import aclosing
+from typing import List, Dict
+
+import Metrics
+
+class responseCache:
+	def __init__(self, path: str, mode: str = 'on', ttl: float = 0, max_entries: int = 10000):
+		"""
+		Initialize a persistent response cache backed by SQLite
+
+		:param path: Path to the SQLite database file.
+		:param mode: 'on' to read and write, 'readonly' to only read cached responses.
+		:param ttl: Seconds a response stays valid, 0 to keep responses until evicted.
+		:param max_entries: Maximum number of responses kept, least recently used are evicted first.
+		"""
+		self.mode = mode
+		self.ttl = ttl
+		self.max_entries = max_entries
+		self.lock = threading.Lock() # The connection is shared by the worker threads
+		self.conn = sqlite3.connect(path, check_same_thread=False)
+		self.conn.execute("PRAGMA journal_mode=WAL")
+		self.conn.execute("""
+			CREATE TABLE IF NOT EXISTS responses (
+				key TEXT PRIMARY KEY,
+				model TEXT NOT NULL,
+				temperature REAL,
+				max_tokens INTEGER,
+				prompt_hash TEXT NOT NULL,
+				response TEXT NOT NULL,
+				created REAL NOT NULL,
+				accessed REAL NOT NULL
+			)""")
+		self.conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+		self.conn.commit()
+
+	@staticmethod
+	def make_key(model: str, temperature, max_tokens, messages: List[Dict[str, str]]):
+		"""
+		Build the cache key for a request
+
+		:param model: The true model name.
+		:param temperature: Sampling temperature used by the handler, or None for the provider default.
+		:param max_tokens: Response token limit used by the handler, or None for the provider default.
+		:param messages: The role-tagged messages sent to the model.
+		:return: Tuple of the cache key and the prompt hash.
+		"""
+		prompt_hash = hashlib.sha256(json.dumps(messages, ensure_ascii=False).encode('utf-8')).hexdigest()
+		key = hashlib.sha256(json.dumps([model, temperature, max_tokens, prompt_hash]).encode('utf-8')).hexdigest()
+		return key, prompt_hash
+
+	def get(self, key: str):
+		"""
+		Look up a cached response, dropping it if it has expired
+
+		:param key: Cache key from make_key.
+		:return: The cached response, or None on a miss.
+		"""
+		now = time.time()
+		with self.lock:
+			row = self.conn.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+			if row is None:
+				return None
+			if self.ttl and row[1] < now - self.ttl:
+				if self.mode == 'on':
+					self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+					self.conn.commit()
+				return None
+			if self.mode == 'on':
+				self.conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+				self.conn.commit()
+			return row[0]
+
+	def put(self, key: str, prompt_hash: str, model: str, temperature, max_tokens, response: str):
+		"""
+		Store a response and evict the least recently used entries over the size limit
+
+		:param key: Cache key from make_key.
+		:param prompt_hash: Hash of the prompt from make_key.
+		:param model: The true model name.
+		:param temperature: Sampling temperature used by the handler.
+		:param max_tokens: Response token limit used by the handler.
+		:param response: The model response.
+		"""
+		if self.mode != 'on' or not response:
+			return
+		now = time.time()
+		with self.lock:
+			self.conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+				(key, model, temperature, max_tokens, prompt_hash, response, now, now))
+			self.conn.execute("""
+				DELETE FROM responses WHERE key IN (
+					SELECT key FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?
+				)""", (self.max_entries,))
+			self.conn.commit()
+
+	def wrap(self, chat_function, handler):
+		"""
+		Wrap a handler chat function so responses are served from and saved to the cache
+
+		:param chat_function: Handler function taking a message list and a model name.
+		:param handler: The handler serving the model, whose sampling settings are part of the key.
+		:return: Function with the same signature as chat_function.
+		"""
+		def call(messages: List[Dict[str, str]], model: str):
+			temperature, max_tokens = getattr(handler, 'temperature', None), getattr(handler, 'max_tokens', None)
+			key, prompt_hash = self.make_key(model, temperature, max_tokens, messages)
+			cached = self.get(key)
+			Metrics.record(cache='miss' if cached is None else 'hit')
+			if cached is not None:
+				return cached
+			response = chat_function(messages, model)
+			self.put(key, prompt_hash, model, temperature, max_tokens, response)
+			return response
+		return call
+
+	def wrap_stream(self, stream_function, handler):
+		"""
+		Wrap a handler streaming function. A cached response is yielded as a single chunk,
+		otherwise the streamed chunks are saved once the stream completes.
+
+		:param stream_function: Handler function taking a message list and a model name and yielding text deltas.
+		:param handler: The handler serving the model, whose sampling settings are part of the key.
+		:return: Generator function with the same signature as stream_function.
+		"""
+		def call(messages: List[Dict[str, str]], model: str):
+			temperature, max_tokens = getattr(handler, 'temperature', None), getattr(handler, 'max_tokens', None)
+			key, prompt_hash = self.make_key(model, temperature, max_tokens, messages)
+			cached = self.get(key)
+			Metrics.record(cache='miss' if cached is None else 'hit')
+			if cached is not None:
+				yield cached
+				return
+			parts = []
+			for delta in stream_function(messages, model):
+				parts.append(delta)
+				yield delta
+			self.put(key, prompt_hash, model, temperature, max_tokens, "".join(parts))
+		return call
+
+	def wrap_async(self, chat_function, handler):
+		"""
+		Wrap a ChatProvider chat coroutine function so responses are served from and saved to the cache.
+		The database is read and written off the event loop.
+
+		:param chat_function: Coroutine function taking a message list and a model name.
+		:param handler: The handler serving the model, whose sampling settings are part of the key.
+		:return: Coroutine function with the same signature as chat_function.
+		"""
+		async def call(messages: List[Dict[str, str]], model: str):
+			temperature, max_tokens = getattr(handler, 'temperature', None), getattr(handler, 'max_tokens', None)
+			key, prompt_hash = self.make_key(model, temperature, max_tokens, messages)
+			cached = await asyncio.to_thread(self.get, key)
+			Metrics.record(cache='miss' if cached is None else 'hit')
+			if cached is not None:
+				return cached
+			response = await chat_function(messages, model)
+			await asyncio.to_thread(self.put, key, prompt_hash, model, temperature, max_tokens, response)
+			return response
+		return call
+
+	def wrap_async_stream(self, stream_function, handler):
+		"""
+		Wrap a ChatProvider chat_stream function. A cached response is yielded as a single chunk,
+		otherwise the streamed chunks are saved once the stream completes.
+
+		:param stream_function: Async generator function taking a message list and a model name and yielding text deltas.
+		:param handler: The handler serving the model, whose sampling settings are part of the key.
+		:return: Async generator function with the same signature as stream_function.
+		"""
+		async def call(messages: List[Dict[str, str]], model: str):
+			temperature, max_tokens = getattr(handler, 'temperature', None), getattr(handler, 'max_tokens', None)
+			key, prompt_hash = self.make_key(model, temperature, max_tokens, messages)
+			cached = await asyncio.to_thread(self.get, key)
+			Metrics.record(cache='miss' if cached is None else 'hit')
+			if cached is not None:
+				yield cached
+				return
+			parts = []
+			async with aclosing(stream_function(messages, model)) as deltas:
+				async for delta in deltas:
+					parts.append(delta)
+					yield delta
+			await asyncio.to_thread(self.put, key, prompt_hash, model, temperature, max_tokens, "".join(parts))
+		return call
+
+	def close(self):
+		"""
+		Close the database connection
+		"""
+		with self.lock:
+			self.conn.close()
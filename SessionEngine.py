@@ -0,0 +1,373 @@
+import asyncio
+from contextlib import aclosing
+from typing import Dict, Any, AsyncIterator
+
+from ChatProvider import fan_out
+from PromptBuilder import promptBuilder
+from ContextManager import contextManager
+from MessageTree import messageTree
+from ProviderRegistry import model_token_budgets
+
+class sessionEngine:
+	def __init__(self, config: Dict[str, Any], store, metrics, summarizer=None, cache=None):
+		"""
+		Initialize one conversation independent of any UI: the chat log and its edit branches, their saving,
+		the model messages fitted to the token budget, and the routing of every turn to the true model.
+		ChatApp draws an engine's chat and runs its responses on its worker's event loop, SessionServer serves
+		many engines over HTTP. Views of the chat only carry the given model's name. The true model, the call metrics and
+		the comparison models' responses are saved with the messages but never shown.
+
+		:param config: Dictionary with the given_model, true_model (proper LLM name), stream, fan_out, fan_out_timeout,
+			system_prompt, context_strategy, keep_first and keep_last settings and the providerRegistry under 'providers'.
+		:param store: conversationStore the session's messages are written to.
+		:param metrics: callMetrics recording every model call.
+		:param summarizer: Function turning a transcript into a summary for the 'summary' context strategy, defaults to asking the true model.
+		:param cache: responseCache the true model's responses are served from and saved to, None to always ask the model.
+		"""
+		self.config = config
+		self.store = store
+		self.metrics = metrics
+		self.cache = cache
+		self.chatlog = []
+		self.tree = messageTree() # Every chat of this session, edits branch off the chat they were made in
+		self.chat_id = self.tree.new_chat() # Chat the chat log belongs to
+		self.chat_nodes = [] # Tree node of each message in the chat log
+		self.prompt_builder = promptBuilder(self.config['system_prompt'])
+		self.context_manager = contextManager(self.config['true_model'], model_token_budgets.get(self.config['true_model'], 4000),
+			strategy=self.config['context_strategy'], keep_first=self.config['keep_first'], keep_last=self.config['keep_last'],
+			summarizer=summarizer or self.summarize)
+		self.responding = False # Only one response can be in flight at a time
+
+	@property
+	def session(self) -> str:
+		"""
+		Id of the session, the same as in the conversation store
+		"""
+		return self.store.session
+
+	def add_message(self, msg_info: Dict[str, Any], save: bool = True):
+		"""
+		Add a message to the end of the chat log and of the current chat in the message tree
+
+		:param msg_info: Dictionary containing message id, sender, and content.
+		:param save: Whether to write the message to the conversation store now, streamed responses are saved once complete.
+		"""
+		self.chatlog.append(msg_info)
+		self.chat_nodes.append(self.tree.append(self.chat_id, msg_info))
+		if save:
+			self.save_message(msg_info)
+
+	def save_message(self, msg_info: Dict[str, Any]):
+		"""
+		Write a message of the current chat to the conversation store
+
+		:param msg_info: Chatlog entry.
+		"""
+		self.store.append_message(self.chat_id, msg_info)
+
+	def add_response(self, text: str, alternatives: Dict[str, str] = None, metrics: Dict[str, Any] = None, save: bool = True) -> Dict[str, Any]:
+		"""
+		Add a model response to the end of the chat log
+
+		:param text: The response text.
+		:param alternatives: Responses of the comparison models, saved with the message but not shown.
+		:param metrics: Latency and token span of the call that produced the response.
+		:param save: Whether to write the message to the conversation store now.
+		:return: The chatlog entry of the response.
+		"""
+		rsp_info = {'msg_id': len(self.chatlog) + 1, 'sender': 'Bot', 'content': text}
+		if alternatives:
+			rsp_info['alternatives'] = alternatives
+		if metrics:
+			rsp_info['metrics'] = metrics
+		self.add_message(rsp_info, save)
+		return rsp_info
+
+	def build_messages(self):
+		"""
+		Build the role-tagged model messages of the chat log, only converting messages added since the last call
+
+		:return: The full message list, starting with the system prompt.
+		"""
+		return self.prompt_builder.build(self.chatlog)
+
+	def add_user_message(self, text: str) -> Dict[str, Any]:
+		"""
+		Add a user message to the end of the chat log, without asking for the response to it
+
+		:param text: The user's message.
+		:return: The chatlog entry of the message.
+		"""
+		if self.responding:
+			raise RuntimeError("Still waiting on a response.")
+		if not text.strip():
+			raise ValueError("There was no message entered.")
+		msg_info = {'msg_id': len(self.chatlog) + 1, 'sender': 'User', 'content': text.strip()}
+		self.add_message(msg_info)
+		return msg_info
+
+	def send_message(self, text: str) -> AsyncIterator[str]:
+		"""
+		Add a user message to the chat and get the response to it
+
+		:param text: The user's message.
+		:return: Async generator of the response text, see respond. It must be iterated or closed before the next message.
+		"""
+		self.add_user_message(text)
+		self.responding = True # Set before the response starts, so a second message cannot slip in
+		return self.respond()
+
+	def edit_message(self, msg_id: int, text: str) -> AsyncIterator[str]:
+		"""
+		Replace a user message in a new chat that shares the messages before it, and get the response to it
+
+		:param msg_id: Id number of the message to edit.
+		:param text: The new text of the message.
+		:return: Async generator of the response text, see respond.
+		"""
+		if self.responding:
+			raise RuntimeError("Still waiting on a response.")
+		if not 1 <= msg_id <= len(self.chatlog) or self.chatlog[msg_id - 1]['sender'] != 'User':
+			raise ValueError(f"There is no user message with id {msg_id}.")
+		if not text.strip():
+			raise ValueError("There was no message entered.")
+		self.fork(msg_id)
+		return self.send_message(text)
+
+	def fork(self, msg_id: int):
+		"""
+		Continue in a new chat that shares the messages before a message, removing it and the messages after it
+		from the chat log. They stay in the message tree as part of the chat they were written in.
+
+		:param msg_id: Id number of the first message that is not shared.
+		"""
+		chat_id = self.tree.new_chat(self.chat_nodes[msg_id - 2] if msg_id > 1 else -1, fork_of=self.chat_id)
+		self.store.fork(chat_id, self.chat_id, msg_id)
+		self.chat_id = chat_id
+		self.delete_messages(msg_id)
+
+	def delete_messages(self, msg_id: int):
+		"""
+		Remove a message and every message after it from the chat log, they stay in the message tree.
+		Message ids count up from 1, so they are also positions.
+
+		:param msg_id: Id number of the first message to remove.
+		"""
+		self.prompt_builder.truncate(msg_id)
+		self.context_manager.truncate(msg_id)
+		del self.chatlog[msg_id - 1:]
+		del self.chat_nodes[msg_id - 1:]
+
+	def branch_position(self, msg_id: int):
+		"""
+		Find which version of a message the chat shows
+
+		:param msg_id: Id number of the message.
+		:return: Tuple of the 1-based position of the shown version and the number of versions, or None if the message was never edited.
+		"""
+		node = self.chat_nodes[msg_id - 1]
+		versions = self.tree.alternatives(node)
+		if len(versions) < 2:
+			return None
+		return versions.index(node) + 1, len(versions)
+
+	def switch_branch(self, msg_id: int, step: int) -> bool:
+		"""
+		Continue in the chat that wrote another version of a message, its last message comes after it
+
+		:param msg_id: Id number of the message.
+		:param step: -1 for the previous version, 1 for the next.
+		:return: Whether the chat log changed, it does not if the message was never edited.
+		"""
+		if self.responding:
+			raise RuntimeError("Still waiting on a response.")
+		if not 1 <= msg_id <= len(self.chatlog):
+			raise ValueError(f"There is no message with id {msg_id}.")
+		node = self.chat_nodes[msg_id - 1]
+		versions = self.tree.alternatives(node)
+		target = versions[(versions.index(node) + step) % len(versions)]
+		if target == node:
+			return False
+		self.chat_id = self.tree.owners[target]
+		self.chat_nodes = self.tree.path(self.tree.tips[self.chat_id])
+		self.prompt_builder.truncate(msg_id)
+		self.context_manager.truncate(msg_id)
+		self.chatlog = [self.tree.messages[node] for node in self.chat_nodes]
+		return True
+
+	def restore_chat(self, chat: Dict[str, Any]):
+		"""
+		Continue in a new chat that starts from a saved chat log
+
+		:param chat: Dictionary with the session, chat id and chat log of the saved chat.
+		"""
+		self.chat_id = self.tree.add_chat(chat['chatlog'])
+		self.chat_nodes = self.tree.path(self.tree.tips[self.chat_id])
+		self.chatlog = list(chat['chatlog'])
+		self.store.restore(self.chat_id, self.chatlog, {'session': chat['session'], 'chat_id': chat['chat_id']})
+		self.prompt_builder = promptBuilder(self.config['system_prompt'])
+		self.context_manager.truncate(0)
+
+	def start_response(self, draft: Dict[str, Any] = None) -> Dict[str, Any]:
+		"""
+		Start a response to the chat log, or to a draft of the next user message that is not part of it yet.
+		The messages are built and the metrics spans started here, so the response can be generated on another thread.
+
+		:param draft: Chatlog entry of the draft, its response is speculative until take_response is called.
+		:return: Dictionary with the chat log and messages the response is for, the metrics span of each model asked,
+			the text generated so far and the comparison models' responses once they are in.
+		"""
+		true_model = self.config['true_model']
+		if draft is None:
+			chatlog = list(self.chatlog)
+			messages = self.build_messages()
+			self.responding = True
+		else:
+			chatlog = self.chatlog + [draft]
+			messages = self.prompt_builder.build(chatlog)
+			self.prompt_builder.truncate(draft['msg_id']) # The draft is not part of the conversation yet
+		models = [true_model] + [model for model in self.config['fan_out'] if model != true_model]
+		spans = {model: self.metrics.start(model) for model in models}
+		if draft is not None:
+			for span in spans.values():
+				span['speculative'] = True
+		return {'chatlog': chatlog, 'messages': messages, 'spans': spans, 'parts': [], 'alternatives': None, 'speculative': draft is not None}
+
+	def take_response(self, response: Dict[str, Any]):
+		"""
+		Make a speculative response the response to the chat, once its draft was sent unchanged
+
+		:param response: Response returned by start_response for the draft.
+		"""
+		response['speculative'] = False
+		self.responding = True
+
+	async def generate(self, response: Dict[str, Any]) -> AsyncIterator[str]:
+		"""
+		Get the true model's response, or the responses of every fan-out model, without changing the chat.
+		The text is also collected in the response, for finish_response. Closing the generator early closes the model's stream.
+
+		:param response: Response returned by start_response.
+		:return: Async generator of text deltas as they are generated, or of the whole response at once when not streaming or fanning out.
+		"""
+		true_model = self.config['true_model']
+		spans = response['spans']
+		# Messages are fitted to the token budget off the event loop, summarizing may call the model
+		messages = await asyncio.to_thread(self.context_manager.fit, response['chatlog'], response['messages'])
+		if self.config['fan_out']:
+			results = await fan_out(self.config['providers'], list(spans), messages, self.config['fan_out_timeout'],
+				measure=lambda model, chat: self.metrics.measure_async(spans[model], chat))
+			rsp = results.pop(true_model)
+			if not isinstance(rsp, str):
+				raise rsp
+			response['alternatives'] = {model: result if isinstance(result, str) else f"Error: {result!r}" for model, result in results.items()}
+			response['parts'].append(rsp)
+			yield rsp
+			return
+		providers = self.config['providers']
+		provider = await asyncio.to_thread(providers.provider, true_model) # First use imports the SDK
+		if self.config['stream']:
+			chat_stream = provider.chat_stream
+			if self.cache:
+				chat_stream = self.cache.wrap_async_stream(chat_stream, providers.handler(true_model))
+			async with aclosing(self.metrics.measure_async_stream(spans[true_model], chat_stream)(messages, true_model)) as deltas:
+				async for delta in deltas:
+					response['parts'].append(delta)
+					yield delta
+		else:
+			chat = provider.chat
+			if self.cache:
+				chat = self.cache.wrap_async(chat, providers.handler(true_model))
+			rsp = await self.metrics.measure_async(spans[true_model], chat)(messages, true_model)
+			response['parts'].append(rsp)
+			yield rsp
+
+	def finish_response(self, response: Dict[str, Any], status: str) -> Dict[str, Any]:
+		"""
+		Finish the metrics spans of a response and add it to the chat. A response that was cancelled or failed
+		part way through is still added, marked as such, with the text generated before it stopped.
+
+		:param response: Response returned by start_response.
+		:param status: Outcome of the response: 'done', 'error', 'cancelled', or 'discarded' for unused speculative responses.
+		:return: The chatlog entry of the response, or None if it was not added.
+		"""
+		if not response['speculative']:
+			self.responding = False
+		true_model = self.config['true_model']
+		alternatives = response['alternatives']
+		text = "".join(response['parts'])
+		finished = {}
+		for model, span in response['spans'].items():
+			if alternatives is not None and model != true_model:
+				failed = alternatives[model].startswith("Error: ")
+				finished[model] = self.metrics.finish(span, 'error' if failed else 'done', None if failed else alternatives[model])
+			else:
+				finished[model] = self.metrics.finish(span, status, text if status == 'done' else None)
+		if not text or status == 'discarded':
+			return None
+		rsp_info = self.add_response(text, alternatives, finished[true_model], save=False)
+		if status != 'done':
+			rsp_info[status] = True
+		self.save_message(rsp_info)
+		return rsp_info
+
+	async def respond(self) -> AsyncIterator[str]:
+		"""
+		Get the response to the chat log and add it to the chat once it is complete, see generate.
+		Closing the generator early cancels the call, the text generated until then is kept.
+
+		:return: Async generator of text deltas as they are generated, or of the whole response at once when not streaming.
+		"""
+		response = self.start_response()
+		status = 'error'
+		try:
+			async with aclosing(self.generate(response)) as deltas:
+				async for delta in deltas:
+					yield delta
+			status = 'done'
+		except (asyncio.CancelledError, GeneratorExit):
+			status = 'cancelled'
+			raise
+		finally:
+			self.finish_response(response, status)
+
+	def summarize(self, text: str) -> str:
+		"""
+		Summarizes older turns with the true model, called by the context manager off the event loop
+
+		:param text: The summary prompt followed by the transcript.
+		:return: The summary text.
+		"""
+		providers = self.config['providers']
+		chat_function = providers.chat_function(self.config['true_model'])
+		if chat_function and self.cache:
+			chat_function = self.cache.wrap(chat_function, providers.handler(self.config['true_model']))
+		return chat_function([{'role': 'user', 'content': text}], self.config['true_model'])
+
+	def public_message(self, msg_info: Dict[str, Any]) -> Dict[str, Any]:
+		"""
+		Get the part of a message the participant may see
+
+		:param msg_info: Chatlog entry.
+		:return: Dictionary with the message id, sender and content, and the shown version and number of versions of edited messages.
+		"""
+		view = {'msg_id': msg_info['msg_id'], 'sender': msg_info['sender'], 'content': msg_info['content']}
+		position = self.branch_position(msg_info['msg_id'])
+		if position:
+			view['version'] = list(position)
+		return view
+
+	def view(self) -> Dict[str, Any]:
+		"""
+		Get the chat as the participant sees it
+
+		:return: Dictionary with the session id, the given model name and the visible chat log.
+		"""
+		return {'session': self.session, 'given_model': self.config['given_model'],
+			'chatlog': [self.public_message(msg) for msg in self.chatlog]}
+
+	def close(self):
+		"""
+		Mark the session as finished in the conversation store
+		"""
+		self.store.close()
@@ -0,0 +1,374 @@
+import json
+import time
+import asyncio
+import argparse
+from typing import Dict, Any
+
+from aiohttp import web, WSMsgType
+
+from IOFunctions import conversationStore
+from Metrics import callMetrics
+from PromptBuilder import SYSTEM_PROMPT
+from ProviderRegistry import providerRegistry, model_name_mapping
+from SessionEngine import sessionEngine
+
+# Shown to participants instead of the real error, which could name the true model
+RESPONSE_ERROR = "The model could not respond, please try again."
+
+class sessionServer:
+	def __init__(self, args):
+		"""
+		Initialize a server running many chat sessions at once on one event loop. Each session is a
+		sessionEngine held in memory, and every session's messages go to one shared conversation store
+		file, each under its own session id. Responses are streamed to the session's WebSockets.
+
+		:param args: Parsed command-line arguments, the defaults of every new session.
+		"""
+		self.args = args
+		self.sessions = {} # Session id -> {'engine', 'sockets', 'task', 'last_used'}
+		self.store_file = open(args.store_path, 'a', encoding='utf-8', buffering=1 << 16)
+		self.metrics = callMetrics(args.metrics_path or None, port=args.metrics_port)
+		self.registry = providerRegistry({
+			'openai': {'api_key': args.openai_key},
+			'anyscale': {'api_key': args.anyscale_key},
+			'anthropic': {'api_key': args.anthropic_key, 'prompt_caching': not args.no_prompt_cache}
+		})
+		self.reaper = None
+
+	def app(self) -> web.Application:
+		"""
+		Build the web application
+
+		:return: The aiohttp application with the session routes.
+		"""
+		app = web.Application()
+		app.add_routes([
+			web.post('/sessions', self.create_session),
+			web.get('/sessions/{session}', self.get_session),
+			web.delete('/sessions/{session}', self.delete_session),
+			web.post('/sessions/{session}/messages', self.post_message),
+			web.get('/sessions/{session}/ws', self.websocket)
+		])
+		app.on_startup.append(self.on_startup)
+		app.on_shutdown.append(self.on_shutdown)
+		app.on_cleanup.append(self.on_cleanup)
+		return app
+
+	def session_config(self, options: Dict[str, Any]) -> Dict[str, Any]:
+		"""
+		Build the configuration of a new session from the server defaults and the request
+
+		:param options: Request body, may set given_model and true_model by their short names, e.g. 'Claude3'.
+		:return: Session configuration in the format of ChatApp's config.
+		"""
+		given_model = options.get('given_model', self.args.given_model)
+		true_model = options.get('true_model', self.args.true_model)
+		if any(not isinstance(model, str) or model not in model_name_mapping for model in (given_model, true_model)):
+			raise ValueError(f"Models must be one of {', '.join(model_name_mapping)}.")
+		return {
+			'given_model': given_model,
+			'true_model': model_name_mapping[true_model],
+			'stream': not self.args.no_stream,
+			'system_prompt': self.args.system_prompt,
+			'context_strategy': self.args.context_strategy,
+			'keep_first': self.args.keep_first,
+			'keep_last': self.args.keep_last,
+			'fan_out': [model_name_mapping[model] for model in self.args.fan_out or []],
+			'fan_out_timeout': self.args.fan_out_timeout,
+			'providers': self.registry
+		}
+
+	def find(self, request: web.Request) -> Dict[str, Any]:
+		"""
+		Look up the session a request is for and mark it as used
+
+		:param request: Request with the session id in its path.
+		:return: The session.
+		"""
+		session = self.sessions.get(request.match_info['session'])
+		if session is None:
+			raise web.HTTPNotFound(text=json.dumps({'error': "There is no such session."}), content_type='application/json')
+		session['last_used'] = time.monotonic()
+		return session
+
+	async def read_body(self, request: web.Request) -> Dict[str, Any]:
+		"""
+		Read the JSON object a request was sent with
+
+		:param request: The request.
+		:return: The body, empty if the request has none.
+		"""
+		if not request.can_read_body:
+			return {}
+		try:
+			body = await request.json()
+		except ValueError:
+			body = None
+		if not isinstance(body, dict):
+			raise web.HTTPBadRequest(text=json.dumps({'error': "The body must be a JSON object."}), content_type='application/json')
+		return body
+
+	async def create_session(self, request: web.Request) -> web.Response:
+		"""
+		Start a session, POST /sessions with an optional JSON body of given_model and true_model
+		"""
+		if len(self.sessions) >= self.args.max_sessions:
+			return web.json_response({'error': "Too many sessions are open."}, status=503)
+		options = await self.read_body(request)
+		try:
+			config = self.session_config(options)
+		except ValueError as e:
+			return web.json_response({'error': str(e)}, status=400)
+		store = conversationStore(self.args.store_path, file=self.store_file, fsync_interval=self.args.fsync_interval,
+			given_model=config['given_model'], true_model=config['true_model'])
+		engine = sessionEngine(config, store, self.metrics)
+		self.sessions[engine.session] = {'engine': engine, 'sockets': set(), 'task': None, 'last_used': time.monotonic()}
+		return web.json_response(engine.view(), status=201)
+
+	async def get_session(self, request: web.Request) -> web.Response:
+		"""
+		Get a session's chat, GET /sessions/{session}
+		"""
+		return web.json_response(self.find(request)['engine'].view())
+
+	async def delete_session(self, request: web.Request) -> web.Response:
+		"""
+		End a session, DELETE /sessions/{session}
+		"""
+		await self.close_session(self.find(request)['engine'].session)
+		return web.Response(status=204)
+
+	async def post_message(self, request: web.Request) -> web.Response:
+		"""
+		Send a message and wait for the whole response, POST /sessions/{session}/messages with a JSON body of text
+		"""
+		session = self.find(request)
+		body = await self.read_body(request)
+		engine = session['engine']
+		if not isinstance(body.get('text'), str):
+			return web.json_response({'error': "The message needs a text."}, status=400)
+		try:
+			rsp = engine.send_message(body['text'])
+		except ValueError as e:
+			return web.json_response({'error': str(e)}, status=400)
+		except RuntimeError as e:
+			return web.json_response({'error': str(e)}, status=409)
+		await self.broadcast(session, {'type': 'message', 'message': engine.public_message(engine.chatlog[-1])})
+		if not await self.start_response(session, rsp):
+			return web.json_response({'error': RESPONSE_ERROR}, status=502)
+		return web.json_response(engine.public_message(engine.chatlog[-1]))
+
+	async def websocket(self, request: web.Request) -> web.WebSocketResponse:
+		"""
+		Chat over a WebSocket, GET /sessions/{session}/ws. The client sends JSON commands:
+		{"type": "send", "text"}, {"type": "edit", "msg_id", "text"}, {"type": "switch", "msg_id", "step"} and
+		{"type": "cancel"}. The server sends the chat on connect and after edits and switches ("chat"), each
+		new user message ("message"), the response text as it is generated ("chunk"), the finished response
+		("done"), cancelled responses ("cancelled") and errors ("error"), the last two with the partial response
+		as "message" if any text was generated. Errors in a command carry the HTTP status the
+		same request would get: 400 for blank or malformed commands, 409 while a response is still being generated.
+		"""
+		session = self.find(request)
+		engine = session['engine']
+		ws = web.WebSocketResponse(heartbeat=30)
+		await ws.prepare(request)
+		session['sockets'].add(ws)
+		await ws.send_json({'type': 'chat', **engine.view()})
+		try:
+			async for msg in ws:
+				if msg.type != WSMsgType.TEXT:
+					continue
+				session['last_used'] = time.monotonic()
+				try:
+					command = json.loads(msg.data)
+					kind = command['type']
+					if kind == 'cancel':
+						if session['task']:
+							session['task'].cancel()
+					elif kind == 'switch':
+						engine.switch_branch(int(command['msg_id']), 1 if int(command['step']) > 0 else -1)
+						await self.broadcast(session, {'type': 'chat', **engine.view()})
+					elif kind in ('send', 'edit'):
+						if kind == 'send':
+							rsp = engine.send_message(str(command['text']))
+							await self.broadcast(session, {'type': 'message', 'message': engine.public_message(engine.chatlog[-1])})
+							self.start_response(session, rsp)
+						else:
+							rsp = engine.edit_message(int(command['msg_id']), str(command['text']))
+							await self.broadcast(session, {'type': 'chat', **engine.view()})
+							self.start_response(session, rsp)
+					else:
+						raise ValueError(f"Unknown command {kind}.")
+				except RuntimeError as e:
+					await ws.send_json({'type': 'error', 'status': 409, 'error': str(e)})
+				except ValueError as e:
+					await ws.send_json({'type': 'error', 'status': 400, 'error': str(e)})
+				except (KeyError, TypeError):
+					await ws.send_json({'type': 'error', 'status': 400, 'error': "Malformed command."})
+		finally:
+			session['sockets'].discard(ws)
+		return ws
+
+	async def broadcast(self, session: Dict[str, Any], event: Dict[str, Any]):
+		"""
+		Send an event to every WebSocket of a session, in order
+
+		:param session: The session.
+		:param event: JSON-serializable event.
+		"""
+		data = json.dumps(event, ensure_ascii=False)
+		for ws in list(session['sockets']):
+			if not ws.closed:
+				try:
+					await ws.send_str(data)
+				except ConnectionError:
+					session['sockets'].discard(ws)
+
+	def start_response(self, session: Dict[str, Any], rsp) -> asyncio.Task:
+		"""
+		Run a response as the session's task, so it can be cancelled from any of its connections
+
+		:param session: The session.
+		:param rsp: Async generator returned by sessionEngine.send_message or edit_message.
+		:return: The task, which results in whether the response was added to the chat.
+		"""
+		engine = session['engine']
+		task = asyncio.create_task(self.run_response(session, rsp))
+		session['task'] = task
+
+		def finished(task):
+			# Also runs for a task cancelled before it started, which never enters the response
+			engine.responding = False
+			session['task'] = None
+			session['last_used'] = time.monotonic()
+		task.add_done_callback(finished)
+		return task
+
+	async def run_response(self, session: Dict[str, Any], rsp) -> bool:
+		"""
+		Stream a response to the session's WebSockets until it is complete, fails or is cancelled
+
+		:param session: The session.
+		:param rsp: Async generator returned by sessionEngine.send_message or edit_message.
+		:return: Whether the response was added to the chat.
+		"""
+		engine = session['engine']
+		length = len(engine.chatlog)
+
+		def kept(event):
+			# A response that stopped part way through is still added to the chat with the text generated so far
+			if len(engine.chatlog) > length:
+				event['message'] = engine.public_message(engine.chatlog[-1])
+			return event
+
+		try:
+			async for delta in rsp:
+				await self.broadcast(session, {'type': 'chunk', 'text': delta})
+			await self.broadcast(session, {'type': 'done', 'message': engine.public_message(engine.chatlog[-1])})
+			return True
+		except asyncio.CancelledError:
+			await self.broadcast(session, kept({'type': 'cancelled'}))
+			return False
+		except Exception as e:
+			print(f"Error getting response for session {engine.session}: {e}")
+			await self.broadcast(session, kept({'type': 'error', 'error': RESPONSE_ERROR}))
+			return False
+		finally:
+			await rsp.aclose()
+
+	async def close_session(self, session_id: str):
+		"""
+		Cancel a session's response, close its WebSockets and mark it as finished in the store
+
+		:param session_id: Id of the session.
+		"""
+		session = self.sessions.pop(session_id, None)
+		if session is None:
+			return
+		if session['task']:
+			session['task'].cancel()
+			await asyncio.gather(session['task'], return_exceptions=True)
+		for ws in list(session['sockets']):
+			await ws.close()
+		session['engine'].close()
+
+	async def reap(self):
+		"""
+		Close sessions that have had no requests, connections or responses for the session timeout
+		"""
+		while True:
+			await asyncio.sleep(min(60, self.args.session_timeout))
+			now = time.monotonic()
+			for session_id, session in list(self.sessions.items()):
+				if not session['sockets'] and not session['task'] and now - session['last_used'] > self.args.session_timeout:
+					await self.close_session(session_id)
+
+	async def on_startup(self, app: web.Application):
+		self.reaper = asyncio.create_task(self.reap())
+
+	async def on_shutdown(self, app: web.Application):
+		self.reaper.cancel()
+		for session_id in list(self.sessions):
+			await self.close_session(session_id)
+
+	async def on_cleanup(self, app: web.Application):
+		self.metrics.close()
+		self.store_file.close()
+
+def parse_server_arguments():
+	"""
+	Parse command-line arguments for the session server.
+
+	:return: Namespace object with arguments
+	"""
+	parser = argparse.ArgumentParser(description="Serve chat sessions over HTTP and WebSockets without the UI.")
+	parser.add_argument('--given_model', type=str, required=True,
+						choices=['GPT-4','Llama3','Claude3'],
+						help='Model name shown to participants, unless a session sets its own')
+	parser.add_argument('--true_model', type=str, required=True,
+						choices=['GPT-4','Llama3','Claude3'],
+						help='Model that answers, unless a session sets its own')
+	parser.add_argument('--host', type=str, default='127.0.0.1')
+	parser.add_argument('--port', type=int, default=8080)
+	parser.add_argument('--max_sessions', type=int, default=1000,
+						help='Maximum number of sessions open at once')
+	parser.add_argument('--session_timeout', type=float, default=1800,
+						help='Seconds an unused session stays open')
+	parser.add_argument('--no_stream', action='store_true',
+						help='Send each response in one piece instead of streaming it')
+	parser.add_argument('--system_prompt', type=str, default=SYSTEM_PROMPT,
+						help='System prompt sent ahead of every conversation')
+	parser.add_argument('--no_prompt_cache', action='store_true',
+						help='Disable prompt caching for Anthropic models')
+	parser.add_argument('--context_strategy', type=str, default='sliding',
+						choices=['sliding','first_last','summary'])
+	parser.add_argument('--keep_first', type=int, default=2)
+	parser.add_argument('--keep_last', type=int, default=20)
+	parser.add_argument('--fan_out', type=str, nargs='+',
+						choices=['GPT-4','Llama3','Claude3'],
+						help='Also ask these models each turn and save their responses')
+	parser.add_argument('--fan_out_timeout', type=float, default=60,
+						help='Seconds each fan-out model has to respond')
+	parser.add_argument('--store_path', type=str, default='Conversations.jsonl',
+						help='Conversation store every session is appended to')
+	parser.add_argument('--fsync_interval', type=float, default=5.0,
+						help='Minimum seconds between fsync calls of each session')
+	parser.add_argument('--metrics_path', type=str, default='Metrics.jsonl',
+						help='JSONL file of per-call metrics, empty to not save them')
+	parser.add_argument('--metrics_port', type=int,
+						help='Port to serve Prometheus metrics on')
+	parser.add_argument('--openai_key', type=str,
+						help='OpenAI API key')
+	parser.add_argument('--anyscale_key', type=str,
+						help='Anyscale API key')
+	parser.add_argument('--anthropic_key', type=str,
+						help='Anthropic API key')
+	return parser.parse_args()
+
+def main():
+	args = parse_server_arguments()
+	server = sessionServer(args)
+	web.run_app(server.app(), host=args.host, port=args.port)
+
+if __name__ == "__main__":
+	main()